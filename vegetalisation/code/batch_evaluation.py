@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.io import DatasetReader
+from rasterio.windows import Window
+
+from class_rasters import CLASS_DTYPE
+from confusionMatrix import (
+    class_lut,
+    compute_confusion_matrix_blocks,
+    compute_metrics_from_confusion_matrix,
+    evaluation_blocks,
+    load_matrix_config,
+    read_reference_codes,
+    resolve_matrix_config_path,
+)
+from workflow_utils import validate_positive_number, write_json
+
+DEFAULT_MATRIX_CONFIG = Path("configs/baseline/configs.yml")
+DEFAULT_BLOCK_SIZE = 1024
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Evaluate several predicted rasters against one reference raster, aligned and "
+            "remapped once per prediction grid, and write a comparison table."
+        )
+    )
+    parser.add_argument("--reference", type=Path, required=True)
+    parser.add_argument(
+        "--prediction",
+        type=Path,
+        action="append",
+        required=True,
+        help="Predicted raster. Repeatable.",
+    )
+    parser.add_argument("--output-dir", type=Path, required=True)
+    parser.add_argument("--matrix-config", type=Path, default=DEFAULT_MATRIX_CONFIG)
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=None,
+        help="Folder of the aligned reference rasters. Default: <output-dir>/reference_cache.",
+    )
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--table-name", default="comparison.csv")
+    parser.add_argument("--metrics-name", default="batch_metrics.json")
+    return parser.parse_args()
+
+
+def prediction_names(paths: list[Path]) -> list[str]:
+    # Paths relative to their common folder, e.g. `1845_5175/fusion/final_fused` for runs/*.
+    resolved = [path.resolve() for path in paths]
+    if len(resolved) == 1:
+        return [resolved[0].stem]
+    root = Path(os.path.commonpath([path.parent for path in resolved]))
+    return [path.relative_to(root).with_suffix("").as_posix() for path in resolved]
+
+
+def grid_key(dataset: DatasetReader) -> dict[str, object]:
+    return {
+        "crs": dataset.crs.to_wkt() if dataset.crs is not None else None,
+        "transform": list(dataset.transform)[:6],
+        "shape": [dataset.height, dataset.width],
+    }
+
+
+def reference_fingerprint(
+    reference: Path, prediction_src: DatasetReader, evaluation_config: dict
+) -> dict[str, object]:
+    stat = reference.stat()
+    return {
+        "reference": {"path": str(reference), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns},
+        "grid": grid_key(prediction_src),
+        "reference_remap": {
+            str(source): int(target)
+            for source, target in evaluation_config["reference_remap"].items()
+        },
+        "empty_class_id": int(evaluation_config["empty_class_id"]),
+    }
+
+
+def cached_reference(
+    reference: Path,
+    prediction_src: DatasetReader,
+    cache_dir: Path,
+    evaluation_config: dict,
+    *,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> Path:
+    # The reference is stored as evaluation classes on the overlap of the prediction grid, so
+    # predictions sharing that grid are compared to it without reading the reference again.
+    reference = reference.resolve()
+    fingerprint = reference_fingerprint(reference, prediction_src, evaluation_config)
+    # One cache entry per reference file and prediction grid; the fingerprint also tracks
+    # changes to the reference and to the remap.
+    key = json.dumps([str(reference), fingerprint["grid"]])
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    cache_path = cache_dir / f"reference_{digest}.tif"
+    fingerprint_path = cache_path.with_suffix(".json")
+    if cache_path.exists() and fingerprint_path.exists():
+        with fingerprint_path.open("r", encoding="utf-8") as handle:
+            if json.load(handle) == fingerprint:
+                return cache_path
+
+    lut = class_lut(evaluation_config["reference_remap"], int(evaluation_config["empty_class_id"]))
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    temporary_path = cache_path.with_suffix(".tmp.tif")
+    with rasterio.open(reference) as reference_src:
+        blocks = evaluation_blocks(reference_src, prediction_src, block_size)
+        overlap = blocks[0][0]
+        height = sum(int(block.height) for block, _ in blocks)
+        profile = {
+            "driver": "GTiff",
+            "height": height,
+            "width": int(overlap.width),
+            "count": 1,
+            "dtype": CLASS_DTYPE,
+            "crs": prediction_src.crs,
+            "transform": prediction_src.window_transform(overlap),
+            # Uncompressed: it is read once per prediction, and decoding LZW costs more than
+            # the larger read.
+            "tiled": True,
+        }
+        with rasterio.open(temporary_path, "w", **profile) as dst:
+            for block, reference_window in blocks:
+                codes = read_reference_codes(reference_src, prediction_src, block, reference_window)
+                top = int(block.row_off - overlap.row_off)
+                dst.write(
+                    lut[codes].astype(CLASS_DTYPE),
+                    1,
+                    window=Window(0, top, block.width, block.height),
+                )
+    temporary_path.replace(cache_path)
+    write_json(fingerprint, fingerprint_path)
+    print(f"Cached aligned reference: {cache_path}")
+    return cache_path
+
+
+def evaluate_batch(
+    reference: Path,
+    predictions: list[Path],
+    *,
+    cache_dir: Path,
+    matrix_config_path: Path = DEFAULT_MATRIX_CONFIG,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    workers: int = 1,
+) -> list[dict[str, object]]:
+    evaluation_config = load_matrix_config(resolve_matrix_config_path(matrix_config_path))[
+        "evaluation"
+    ]
+    class_names = {
+        int(class_id): class_name
+        for class_id, class_name in evaluation_config["class_names"].items()
+    }
+    num_classes = len(class_names)
+    empty_class_id = int(evaluation_config["empty_class_id"])
+    # The cached reference already holds evaluation classes.
+    reference_lut = class_lut({class_id: class_id for class_id in class_names}, empty_class_id)
+    prediction_lut = class_lut(evaluation_config["prediction_remap"], empty_class_id)
+
+    results = []
+    for name, prediction in zip(prediction_names(predictions), predictions, strict=True):
+        with rasterio.open(prediction) as prediction_src:
+            reference_path = cached_reference(
+                reference, prediction_src, cache_dir, evaluation_config, block_size=block_size
+            )
+        cm = compute_confusion_matrix_blocks(
+            reference_path,
+            prediction,
+            reference_lut,
+            prediction_lut,
+            num_classes,
+            block_size=block_size,
+            workers=workers,
+        )
+        results.append(
+            {
+                "name": name,
+                "prediction": str(prediction),
+                "reference_cache": str(reference_path),
+                "confusion_matrix": cm.tolist(),
+                **compute_metrics_from_confusion_matrix(cm, class_names),
+            }
+        )
+        print(f"Evaluated {name}: mean IoU {results[-1]['summary']['mean_iou']:.4f}")
+    return results
+
+
+def write_comparison_table(results: list[dict[str, object]], path: Path) -> None:
+    summary_names = list(results[0]["summary"])
+    class_columns = [
+        f"{metric}_{entry['class_name']}"
+        for entry in results[0]["per_class"]
+        for metric in ("iou", "precision", "recall", "dice")
+    ]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8", newline="") as handle:
+        writer = csv.writer(handle)
+        writer.writerow(["name", "prediction", "pixels", *summary_names, *class_columns])
+        for result in results:
+            writer.writerow(
+                [
+                    result["name"],
+                    result["prediction"],
+                    int(np.sum(result["confusion_matrix"])),
+                    *(result["summary"][name] for name in summary_names),
+                    *(
+                        entry[metric]
+                        for entry in result["per_class"]
+                        for metric in ("iou", "precision", "recall", "dice")
+                    ),
+                ]
+            )
+    print(f"Saved comparison table to: {path}")
+
+
+def main() -> None:
+    args = parse_args()
+    validate_positive_number(args.block_size, "block_size")
+    validate_positive_number(args.workers, "workers")
+    results = evaluate_batch(
+        args.reference,
+        args.prediction,
+        cache_dir=args.cache_dir or args.output_dir / "reference_cache",
+        matrix_config_path=args.matrix_config,
+        block_size=args.block_size,
+        workers=args.workers,
+    )
+
+    print(f"\n{'Prediction':<50}{'Mean IoU':>12}{'Mean Dice':>12}")
+    for result in results:
+        print(
+            f"{result['name']:<50}"
+            f"{result['summary']['mean_iou']:>12.4f}"
+            f"{result['summary']['mean_dice']:>12.4f}"
+        )
+    write_comparison_table(results, args.output_dir / args.table_name)
+    write_json(
+        {"reference": str(args.reference), "predictions": results},
+        args.output_dir / args.metrics_name,
+    )
+    print(f"Saved batch metrics to: {args.output_dir / args.metrics_name}")
+
+
+if __name__ == "__main__":
+    main()
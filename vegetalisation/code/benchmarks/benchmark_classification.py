@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from classification_kernels import classify_thresholds, remap_classes  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare per-class mask chains with the lookup-table classification kernels."
+    )
+    parser.add_argument("--size", type=int, default=10000, help="Raster side length in pixels.")
+    parser.add_argument("--repeats", type=int, default=3, help="Best-of runs per timing.")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def classify_heights_masks(height: np.ndarray, keep: np.ndarray) -> np.ndarray:
+    out = np.full(height.shape, np.nan, dtype=np.float32)
+    out[keep & (height < 0.3)] = 0
+    out[keep & (height >= 0.3) & (height < 5.0)] = 1
+    out[keep & (height >= 5.0)] = 2
+    return out
+
+
+def classify_difference_masks(diff: np.ndarray) -> np.ndarray:
+    classes = np.full_like(diff, np.nan, dtype=np.float32)
+    classes[(diff >= 0.5) & (diff < 1.5)] = 1
+    classes[(diff >= 1.5) & (diff < 5)] = 2
+    classes[(diff >= 5) & (diff < 15)] = 3
+    classes[diff >= 15] = 4
+    return classes
+
+
+def remap_masks(array: np.ndarray, mapping: dict[int, int], fill_value, dtype) -> np.ndarray:
+    result = np.full(array.shape, fill_value, dtype=dtype)
+    for source_class, target_class in mapping.items():
+        result[array == source_class] = target_class
+    return result
+
+
+def timed(function, *args, repeats: int) -> tuple[np.ndarray, float]:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main() -> None:
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    shape = (args.size, args.size)
+    height = rng.uniform(-1.0, 30.0, shape).astype(np.float32)
+    height[rng.random(shape) < 0.1] = np.nan
+    keep = rng.random(shape) < 0.7
+    reference = rng.integers(0, 8, shape).astype(np.float32)
+    reference[rng.random(shape) < 0.05] = np.nan
+    prediction = rng.integers(0, 19, shape, dtype=np.uint8)
+    reference_remap = {1: 0, 2: 1, 3: 1, 4: 2, 5: 2}
+    flair_remap = {8: 0, 14: 1, 12: 2, 13: 3}
+
+    cases = [
+        (
+            "height classes",
+            lambda: classify_heights_masks(height, keep),
+            lambda: classify_thresholds(height, (0.3, 5.0), (0, 1, 2), where=keep),
+        ),
+        (
+            "difference classes",
+            lambda: classify_difference_masks(height),
+            lambda: classify_thresholds(height, (0.5, 1.5, 5, 15), (np.nan, 1, 2, 3, 4)),
+        ),
+        (
+            "evaluation remap",
+            lambda: remap_masks(reference, reference_remap, np.nan, np.float32),
+            lambda: remap_classes(reference, reference_remap),
+        ),
+        (
+            "Flair argmax remap",
+            lambda: remap_masks(prediction, flair_remap, 255, np.uint8),
+            lambda: remap_classes(prediction, flair_remap, fill_value=255, dtype=np.uint8),
+        ),
+    ]
+    print(f"{args.size}x{args.size} rasters, best of {args.repeats} run(s).")
+    for name, masks, kernel in cases:
+        expected, mask_seconds = timed(masks, repeats=args.repeats)
+        result, kernel_seconds = timed(kernel, repeats=args.repeats)
+        same = np.array_equal(expected, result, equal_nan=expected.dtype.kind == "f")
+        print(
+            f"{name:>20}: masks {mask_seconds:7.3f} s, lookup table {kernel_seconds:7.3f} s "
+            f"({mask_seconds / kernel_seconds:4.1f}x, identical: {same})"
+        )
+
+
+if __name__ == "__main__":
+    main()
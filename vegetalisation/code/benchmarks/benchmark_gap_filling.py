@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from gap_filling import NEIGHBOR_OFFSETS, fill_gaps  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare iterative neighbor averaging with the frontier gap-filling engine."
+    )
+    parser.add_argument("--size", type=int, default=2000, help="Raster side length in pixels.")
+    parser.add_argument(
+        "--loop-size",
+        type=int,
+        default=300,
+        help="Raster side length timed with the historical loop (it is too slow for full tiles).",
+    )
+    parser.add_argument(
+        "--hole-fraction",
+        type=float,
+        default=0.15,
+        help="Side of each square hole as a fraction of the raster side.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def make_raster(size: int, hole_fraction: float, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    raster = (170.0 + np.cumsum(rng.normal(0.0, 0.05, (size, size)), axis=1)).astype(np.float32)
+    raster[rng.random(raster.shape) < 0.05] = np.nan
+    hole = max(1, int(size * hole_fraction))
+    for _ in range(4):
+        row, column = rng.integers(0, size - hole, 2)
+        raster[row : row + hole, column : column + hole] = np.nan
+    return raster
+
+
+def fill_gaps_loop(array: np.ndarray) -> tuple[np.ndarray, int]:
+    cleaned = array.astype(np.float32, copy=True)
+    height, width = cleaned.shape
+    passes = 0
+    while True:
+        nan_positions = np.argwhere(np.isnan(cleaned))
+        next_cleaned = cleaned.copy()
+        replaced_count = 0
+        for row_index, column_index in nan_positions:
+            neighbors = []
+            for row_offset, column_offset in NEIGHBOR_OFFSETS:
+                row, column = row_index + row_offset, column_index + column_offset
+                if 0 <= row < height and 0 <= column < width and not np.isnan(cleaned[row, column]):
+                    neighbors.append(float(cleaned[row, column]))
+            if neighbors:
+                next_cleaned[row_index, column_index] = np.float32(np.mean(neighbors))
+                replaced_count += 1
+        cleaned = next_cleaned
+        passes += 1
+        if replaced_count == 0:
+            return cleaned, passes
+
+
+def time_fill(raster: np.ndarray, method: str) -> float:
+    start = time.perf_counter()
+    fill_gaps(raster, method=method)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    args = parse_args()
+    small = make_raster(args.loop_size, args.hole_fraction, args.seed)
+    large = make_raster(args.size, args.hole_fraction, args.seed)
+
+    start = time.perf_counter()
+    expected, passes = fill_gaps_loop(small)
+    loop_seconds = time.perf_counter() - start
+    identical = np.array_equal(fill_gaps(small, method="mean"), expected, equal_nan=True)
+
+    small_gaps = int(np.isnan(small).sum())
+    large_gaps = int(np.isnan(large).sum())
+    print(
+        f"Loop    {args.loop_size}x{args.loop_size}: {small_gaps:>10,} gap pixels, "
+        f"{passes} passes, {loop_seconds:8.3f} s"
+    )
+    print(
+        f"Mean    {args.loop_size}x{args.loop_size}: "
+        f"{time_fill(small, 'mean'):8.3f} s (identical to loop: {identical})"
+    )
+    print(f"Mean    {args.size}x{args.size}: {large_gaps:>10,} gap pixels, ", end="")
+    print(f"{time_fill(large, 'mean'):8.3f} s")
+    print(f"Nearest {args.size}x{args.size}: {large_gaps:>10,} gap pixels, ", end="")
+    print(f"{time_fill(large, 'nearest'):8.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from lidarCorrection import fill_nan_with_neighbors  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare the per-pixel NaN filling loop with the row-wise window sums."
+    )
+    parser.add_argument("--size", type=int, default=4000, help="Raster side length in pixels.")
+    parser.add_argument(
+        "--loop-size",
+        type=int,
+        default=300,
+        help="Raster side length timed with the historical loop (it is too slow for mosaics).",
+    )
+    parser.add_argument(
+        "--window-sizes",
+        type=int,
+        nargs="+",
+        default=[3, 5, 7, 9],
+        help="Odd window sizes to time.",
+    )
+    parser.add_argument(
+        "--nan-fraction",
+        type=float,
+        default=0.05,
+        help="Fraction of isolated NaN pixels, on top of a few large holes.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def make_raster(size: int, nan_fraction: float, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    raster = (170.0 + np.cumsum(rng.normal(0.0, 0.05, (size, size)), axis=1)).astype(np.float32)
+    raster[rng.random(raster.shape) < nan_fraction] = np.nan
+    hole = max(1, size // 20)
+    for _ in range(4):
+        row, column = rng.integers(0, size - hole, 2)
+        raster[row : row + hole, column : column + hole] = np.nan
+    return raster
+
+
+def fill_nan_with_neighbors_loop(img: np.ndarray, window_size: int) -> np.ndarray:
+    filled = img.copy()
+    offset = window_size // 2
+    rows, cols = img.shape
+    for row in range(offset, rows - offset):
+        for col in range(offset, cols - offset):
+            if np.isnan(filled[row, col]):
+                window = filled[row - offset : row + offset + 1, col - offset : col + offset + 1]
+                valid = window[~np.isnan(window)]
+                if valid.size > 0:
+                    filled[row, col] = float(np.mean(valid))
+    return filled
+
+
+def timed(function, *args) -> tuple[np.ndarray, float]:
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main() -> None:
+    args = parse_args()
+    small = make_raster(args.loop_size, args.nan_fraction, args.seed)
+    large = make_raster(args.size, args.nan_fraction, args.seed)
+    print(f"{int(np.isnan(large).sum()):,} NaN pixels in the {args.size}x{args.size} raster.")
+
+    for window_size in args.window_sizes:
+        expected, loop_seconds = timed(fill_nan_with_neighbors_loop, small, window_size)
+        result, small_seconds = timed(fill_nan_with_neighbors, small, window_size)
+        _, large_seconds = timed(fill_nan_with_neighbors, large, window_size)
+        same_gaps = np.array_equal(np.isnan(expected), np.isnan(result))
+        max_difference = float(np.nanmax(np.abs(expected - result)))
+        print(
+            f"window {window_size}: loop {args.loop_size}px {loop_seconds:8.3f} s, "
+            f"sums {args.loop_size}px {small_seconds:8.3f} s "
+            f"(same gaps: {same_gaps}, max difference {max_difference:.2e}), "
+            f"sums {args.size}px {large_seconds:8.3f} s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from lidar_rasterization import (  # noqa: E402
+    GROUND_EXCLUDED_CLASSES,
+    compute_cell_indices,
+    rasterize_points,
+)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Compare the per-point rasterization loop with the vectorized rasterizer."
+    )
+    parser.add_argument("--points", type=int, default=5_000_000)
+    parser.add_argument(
+        "--loop-points",
+        type=int,
+        default=200_000,
+        help="Number of points timed with the historical loop (it is too slow for full tiles).",
+    )
+    parser.add_argument("--tile-size", type=float, default=1000.0)
+    parser.add_argument("--resolution", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def make_points(
+    count: int, tile_size: float, seed: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    x = 1845000.0 + rng.uniform(0.0, tile_size, count)
+    y = 5175000.0 + rng.uniform(0.0, tile_size, count)
+    z = np.round(170.0 + rng.gamma(2.0, 4.0, count), 2)
+    classes = rng.choice(np.array([1, 2, 3, 4, 5, 6, 9], dtype=np.uint8), count)
+    return x, y, z, classes
+
+
+def rasterize_points_loop(x_indices, y_indices, z, classes, shape):
+    mns = np.full(shape, np.nan, dtype=np.float32)
+    mnt = np.full(shape, np.nan, dtype=np.float32)
+    class_raster = np.full(shape, -1, dtype=np.int16)
+    points = zip(x_indices, y_indices, z, classes, strict=True)
+    for x_index, y_index, z_value, class_value in points:
+        if (
+            np.isnan(mnt[y_index, x_index]) or z_value < mnt[y_index, x_index]
+        ) and class_value not in GROUND_EXCLUDED_CLASSES:
+            mnt[y_index, x_index] = z_value
+        if np.isnan(mns[y_index, x_index]) or z_value > mns[y_index, x_index]:
+            mns[y_index, x_index] = z_value
+            class_raster[y_index, x_index] = class_value
+    return mns, mnt, class_raster
+
+
+def main() -> None:
+    args = parse_args()
+    x, y, z, classes = make_points(args.points, args.tile_size, args.seed)
+    size = int(np.ceil(args.tile_size / args.resolution))
+    shape = (size, size)
+    x_indices, y_indices = compute_cell_indices(
+        x,
+        y,
+        xmin=1845000.0,
+        ymax=5175000.0 + args.tile_size,
+        resolution=args.resolution,
+        shape=shape,
+    )
+
+    loop_count = min(args.loop_points, args.points)
+    start = time.perf_counter()
+    expected = rasterize_points_loop(
+        x_indices[:loop_count], y_indices[:loop_count], z[:loop_count], classes[:loop_count], shape
+    )
+    loop_seconds = time.perf_counter() - start
+
+    subset = rasterize_points(
+        x_indices[:loop_count], y_indices[:loop_count], z[:loop_count], classes[:loop_count], shape
+    )
+    identical = all(
+        np.array_equal(left, right, equal_nan=True)
+        for left, right in zip(expected, subset, strict=True)
+    )
+
+    start = time.perf_counter()
+    rasterize_points(x_indices, y_indices, z, classes, shape)
+    vectorized_seconds = time.perf_counter() - start
+
+    loop_rate = loop_count / loop_seconds
+    vectorized_rate = args.points / vectorized_seconds
+    print(f"Grid: {shape[0]}x{shape[1]} cells at {args.resolution} m")
+    print(
+        f"Loop       : {loop_count:>12,} points in {loop_seconds:8.3f} s "
+        f"-> {loop_rate:>14,.0f} points/s"
+    )
+    print(
+        f"Vectorized : {args.points:>12,} points in {vectorized_seconds:8.3f} s "
+        f"-> {vectorized_rate:>14,.0f} points/s"
+    )
+    print(f"Speedup    : {vectorized_rate / loop_rate:.1f}x")
+    print(f"Bit-identical on loop subset: {identical}")
+
+
+if __name__ == "__main__":
+    main()
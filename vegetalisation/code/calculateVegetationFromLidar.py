@@ -1,12 +1,18 @@
 from __future__ import annotations
 
 import argparse
+from contextlib import ExitStack
 from pathlib import Path
 
 import numpy as np
-import rasterio
 
-from workflow_utils import align_array_to_shape
+from class_rasters import CLASS_DTYPE, CLASS_NODATA, class_profile
+from classification_kernels import classify_thresholds
+from raster_alignment import common_grid, read_aligned
+from raster_products import RasterData, RasterSource, open_raster, write_raster
+
+DIFFERENCE_EDGES = (0.5, 1.5, 5, 15)
+DIFFERENCE_CLASSES = (CLASS_NODATA, 1, 2, 3, 4)
 
 
 def parse_args() -> argparse.Namespace:
@@ -22,21 +28,10 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
-def pad_or_crop_to_size(arr: np.ndarray, target_shape: tuple[int, int]) -> np.ndarray:
-    return align_array_to_shape(arr, target_shape, fill_value=np.nan, allow_crop=True)
-
-
-def load_raster(path: Path) -> tuple[np.ndarray, dict]:
-    with rasterio.open(path) as src:
-        return src.read(1).astype(np.float32), src.profile.copy()
-
-
-def save_raster(path: Path, data: np.ndarray, profile: dict) -> None:
+def height_profile(profile: dict) -> dict:
     output_profile = profile.copy()
     output_profile.update(dtype="float32", count=1, nodata=np.nan, compress="lzw")
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with rasterio.open(path, "w", **output_profile) as dst:
-        dst.write(data.astype(np.float32), 1)
+    return output_profile
 
 
 def compute_multi_vege(
@@ -62,32 +57,47 @@ def compute_multi_vege(
 
 
 def classify_from_difference(diff: np.ndarray) -> np.ndarray:
-    classes = np.full_like(diff, np.nan, dtype=np.float32)
-    classes[(diff >= 0.5) & (diff < 1.5)] = 1
-    classes[(diff >= 1.5) & (diff < 5)] = 2
-    classes[(diff >= 5) & (diff < 15)] = 3
-    classes[diff >= 15] = 4
-    return classes
+    return classify_thresholds(
+        diff,
+        DIFFERENCE_EDGES,
+        DIFFERENCE_CLASSES,
+        fill_value=CLASS_NODATA,
+        dtype=CLASS_DTYPE,
+    )
 
 
-def main() -> None:
-    args = parse_args()
-
-    max_height, profile = load_raster(args.lidar_max_height)
-    min_height, _ = load_raster(args.lidar_min_height)
-    lidar_class, _ = load_raster(args.lidar_class)
-    mask_raster, _ = load_raster(args.mask_raster)
+def lidar_vegetation(
+    max_height: RasterSource,
+    min_height: RasterSource,
+    lidar_class: RasterSource,
+    mask_raster: RasterSource,
+) -> tuple[RasterData, RasterData]:
+    with ExitStack() as stack:
+        sources = (max_height, min_height, lidar_class, mask_raster)
+        datasets = [stack.enter_context(open_raster(source)) for source in sources]
+        # Every input is read onto the pixel grid and extent of the max-height raster.
+        grid = common_grid(datasets, extent="reference")
+        profile = datasets[0].profile.copy()
+        arrays = [
+            read_aligned(dataset, grid, fill_value=np.nan, dtype=np.float32) for dataset in datasets
+        ]
+
+    height_result = compute_multi_vege(*arrays)
+    class_result = classify_from_difference(height_result)
+    return (
+        RasterData(height_result, height_profile(profile)),
+        RasterData(class_result, class_profile(profile)),
+    )
 
-    target_shape = max_height.shape
-    min_height = pad_or_crop_to_size(min_height, target_shape)
-    lidar_class = pad_or_crop_to_size(lidar_class, target_shape)
-    mask_raster = pad_or_crop_to_size(mask_raster, target_shape)
 
-    height_result = compute_multi_vege(max_height, min_height, lidar_class, mask_raster)
-    save_raster(args.height_output, height_result, profile)
+def main() -> None:
+    args = parse_args()
 
-    class_result = classify_from_difference(height_result)
-    save_raster(args.class_output, class_result, profile)
+    height_result, class_result = lidar_vegetation(
+        args.lidar_max_height, args.lidar_min_height, args.lidar_class, args.mask_raster
+    )
+    write_raster(height_result, args.height_output)
+    write_raster(class_result, args.class_output)
 
     print(f"Saved LiDAR vegetation height raster to: {args.height_output}")
     print(f"Saved LiDAR vegetation class raster to: {args.class_output}")
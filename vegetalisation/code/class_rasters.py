@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import math
+
+import numpy as np
+from rasterio.io import DatasetReader
+from rasterio.windows import Window
+
+from classification_kernels import remap_classes
+from raster_alignment import RasterGrid, dataset_grid, read_aligned
+
+# Vegetation class rasters are stored as uint8; 255 marks cells without a class.
+CLASS_DTYPE = np.uint8
+CLASS_NODATA = 255
+
+
+def class_profile(profile: dict) -> dict:
+    updated_profile = profile.copy()
+    updated_profile.update(dtype="uint8", count=1, nodata=CLASS_NODATA, compress="lzw")
+    return updated_profile
+
+
+def to_class_codes(array: np.ndarray, nodata: float | None = None) -> np.ndarray:
+    # Float class rasters written before the uint8 outputs use NaN for missing classes. NaN,
+    # `nodata` and values that are not a code between 0 and 254 all become CLASS_NODATA.
+    if nodata is not None and (math.isnan(nodata) or nodata == CLASS_NODATA):
+        nodata = None
+    if array.dtype == CLASS_DTYPE:
+        if nodata is None:
+            return array
+        codes = array.copy()
+        codes[array == nodata] = CLASS_NODATA
+        return codes
+    mapping = {code: code for code in range(CLASS_NODATA) if code != nodata}
+    return remap_classes(array, mapping, fill_value=CLASS_NODATA, dtype=CLASS_DTYPE)
+
+
+def read_class_codes(
+    dataset: DatasetReader,
+    grid: RasterGrid | None = None,
+    *,
+    window: Window | None = None,
+) -> np.ndarray:
+    grid = grid or dataset_grid(dataset)
+    dtype = np.dtype(dataset.dtypes[0])
+    if np.issubdtype(dtype, np.floating):
+        fill_value = np.nan
+    else:
+        fill_value = CLASS_NODATA if np.iinfo(dtype).max >= CLASS_NODATA else -1
+    array = read_aligned(dataset, grid, fill_value=fill_value, window=window)
+    return to_class_codes(array, dataset.nodata)
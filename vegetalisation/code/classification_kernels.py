@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+# Pixels classified at once. The scratch buffers of one chunk stay in cache, so each raster
+# is streamed once whatever the number of classes.
+CHUNK_PIXELS = 1 << 16
+
+
+def _prepare_output(
+    values: np.ndarray, out: np.ndarray | None, dtype: np.dtype | type
+) -> tuple[np.ndarray, np.ndarray]:
+    if out is None:
+        out = np.empty(values.shape, dtype=dtype)
+    if out.shape != values.shape:
+        raise ValueError(f"Output shape {out.shape} does not match input shape {values.shape}.")
+    target = out if out.flags.c_contiguous else np.empty(out.shape, dtype=out.dtype)
+    return out, target
+
+
+def _finish_output(out: np.ndarray, target: np.ndarray) -> np.ndarray:
+    if target is not out:
+        out[...] = target
+    return out
+
+
+def remap_classes(
+    values: np.ndarray,
+    mapping: Mapping[int, float],
+    *,
+    fill_value: float = np.nan,
+    keep_unmapped: bool = False,
+    dtype: np.dtype | type = np.float32,
+    out: np.ndarray | None = None,
+) -> np.ndarray:
+    values = np.ascontiguousarray(values)
+    out, target = _prepare_output(values, out, dtype)
+    sources = [int(source) for source in mapping]
+    low = min(sources, default=0) - 1
+    high = max(sources, default=0) + 1
+
+    # Table position 0 holds values below the mapped range, NaN and fractional values; the
+    # last position holds values above it. With keep_unmapped both are copied from the input.
+    if keep_unmapped:
+        table = np.arange(low, high + 1).astype(target.dtype)
+    else:
+        table = np.full(high - low + 1, fill_value, dtype=target.dtype)
+    for source, mapped in mapping.items():
+        table[int(source) - low] = mapped
+
+    flat_values = values.reshape(-1)
+    flat_out = target.reshape(-1)
+    floating = values.dtype.kind == "f"
+    scratch = np.empty(min(CHUNK_PIXELS, values.size), dtype=values.dtype if floating else np.intp)
+    positions = np.empty(scratch.shape, dtype=np.intp)
+    outside = np.empty(scratch.shape, dtype=bool)
+    for start in range(0, values.size, CHUNK_PIXELS):
+        chunk = flat_values[start : start + CHUNK_PIXELS]
+        size = chunk.size
+        index = positions[:size]
+        if floating:
+            clamped = scratch[:size]
+            # fmax replaces NaN by its second argument.
+            np.fmax(chunk, low, out=clamped)
+            np.fmin(clamped, high, out=clamped)
+            np.subtract(clamped, low, out=clamped)
+            np.copyto(index, clamped, casting="unsafe")
+            np.not_equal(index, clamped, out=outside[:size])
+            index[outside[:size]] = 0
+        else:
+            np.copyto(index, chunk)
+            np.clip(index, low, high, out=index)
+            np.subtract(index, low, out=index)
+        np.take(table, index, out=flat_out[start : start + size], mode="clip")
+        if keep_unmapped:
+            mask = outside[:size]
+            np.equal(index, 0, out=mask)
+            np.logical_or(mask, index == high - low, out=mask)
+            flat_out[start : start + size][mask] = chunk[mask]
+    return _finish_output(out, target)
+
+
+def classify_thresholds(
+    values: np.ndarray,
+    edges: Sequence[float],
+    classes: Sequence[float],
+    *,
+    fill_value: float = np.nan,
+    where: np.ndarray | None = None,
+    dtype: np.dtype | type = np.float32,
+    out: np.ndarray | None = None,
+) -> np.ndarray:
+    values = np.ascontiguousarray(values)
+    if len(classes) != len(edges) + 1:
+        raise ValueError("classes must have exactly one more entry than edges.")
+    # Comparisons happen in the raster precision, like `values >= threshold` does.
+    edge_dtype = values.dtype if values.dtype.kind == "f" else np.float64
+    bounds = np.asarray(edges, dtype=edge_dtype)
+    if np.isnan(bounds).any() or np.any(np.diff(bounds) <= 0):
+        raise ValueError(f"Threshold edges must be strictly increasing: {list(edges)}")
+    if where is not None:
+        where = np.ascontiguousarray(where, dtype=bool)
+        if where.shape != values.shape:
+            raise ValueError(f"Mask shape {where.shape} does not match input shape {values.shape}.")
+    out, target = _prepare_output(values, out, dtype)
+
+    # A pixel's table position counts the edges at or below it, plus `nan_step` for NaN and
+    # `masked_step` outside `where`. Every position past the last class holds fill_value.
+    nan_step = len(classes)
+    masked_step = nan_step + 1
+    table = np.full(nan_step + masked_step + 1, fill_value, dtype=target.dtype)
+    table[:nan_step] = classes
+    code_dtype = np.uint8 if table.size <= 256 else np.uint16
+
+    flat_values = values.reshape(-1)
+    flat_where = None if where is None else where.reshape(-1)
+    flat_out = target.reshape(-1)
+    codes = np.empty(min(CHUNK_PIXELS, values.size), dtype=code_dtype)
+    steps = np.empty(codes.shape, dtype=code_dtype)
+    mask = np.empty(codes.shape, dtype=bool)
+    positions = np.empty(codes.shape, dtype=np.intp)
+    for start in range(0, values.size, CHUNK_PIXELS):
+        chunk = flat_values[start : start + CHUNK_PIXELS]
+        size = chunk.size
+        code, step, chunk_mask = codes[:size], steps[:size], mask[:size]
+        code.fill(0)
+        for bound in bounds:
+            np.greater_equal(chunk, bound, out=chunk_mask)
+            np.add(code, chunk_mask.view(np.uint8), out=code, dtype=code_dtype)
+        if values.dtype.kind == "f":
+            np.isnan(chunk, out=chunk_mask)
+            np.multiply(chunk_mask.view(np.uint8), nan_step, out=step, dtype=code_dtype)
+            np.add(code, step, out=code)
+        if flat_where is not None:
+            np.logical_not(flat_where[start : start + size], out=chunk_mask)
+            np.multiply(chunk_mask.view(np.uint8), masked_step, out=step, dtype=code_dtype)
+            np.add(code, step, out=code)
+        np.copyto(positions[:size], code)
+        np.take(table, positions[:size], out=flat_out[start : start + size], mode="clip")
+    return _finish_output(out, target)
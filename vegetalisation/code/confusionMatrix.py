@@ -1,25 +1,38 @@
 from __future__ import annotations
 
 import argparse
+import json
+import math
+import multiprocessing
+import time
+import warnings
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
 
-import matplotlib.pyplot as plt
 import numpy as np
 import rasterio
-import seaborn as sns
 import yaml
+from affine import Affine
+from rasterio import windows
+from rasterio.crs import CRS
 from rasterio.enums import Resampling
-from rasterio.warp import reproject
-from rasterio.windows import from_bounds
+from rasterio.io import DatasetReader
+from rasterio.transform import array_bounds
+from rasterio.warp import reproject, transform_bounds
+from rasterio.windows import Window, from_bounds
 
-from workflow_utils import write_json
-
-try:
-    import torch
-except ImportError:  # pragma: no cover - optional dependency outside the Docker image
-    torch = None
+import classification_kernels
+from class_rasters import CLASS_DTYPE, CLASS_NODATA, to_class_codes
+from raster_products import RasterData, RasterSource, gdal_dataset, open_raster
+from workflow_utils import import_torch, validate_positive_number, write_json
 
 DEFAULT_MATRIX_CONFIG = Path("configs/baseline/configs.yml")
+DEFAULT_SAMPLE_BLOCK_SIZE = 256
+DEFAULT_SAMPLE_BOOTSTRAP = 1000
+# Side of a sampled block, in pixels of the coarse reference read used to stratify blocks.
+CLASS_PROFILE_PIXELS = 16
 
 
 def parse_args() -> argparse.Namespace:
@@ -38,6 +51,61 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Use CUDA via PyTorch for confusion-matrix accumulation when available.",
     )
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=None,
+        help=(
+            "Stream the rasters in full-width blocks of this many rows instead of loading the "
+            "whole overlap. The matrix is identical; --use-gpu only applies without blocks."
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processes accumulating blocks in parallel with --block-size.",
+    )
+    parser.add_argument(
+        "--tile-size",
+        type=int,
+        default=None,
+        help=(
+            "Also accumulate one confusion matrix per square tile of this many prediction pixels "
+            "and write per-tile accuracy and IoU as a GeoTIFF and a GeoJSON."
+        ),
+    )
+    parser.add_argument(
+        "--bootstrap",
+        type=int,
+        default=0,
+        help=(
+            "Bootstrap samples of the tiles, or of the sampled blocks, for confidence intervals. "
+            "Requires --tile-size or --sample."
+        ),
+    )
+    parser.add_argument("--bootstrap-seed", type=int, default=0)
+    parser.add_argument(
+        "--sample",
+        type=float,
+        default=None,
+        help=(
+            "Estimate the metrics from this fraction of the overlap, read as square blocks drawn "
+            "in strata of reference class and position, at least two per stratum, with "
+            f"bootstrap confidence intervals (--bootstrap samples, {DEFAULT_SAMPLE_BOOTSTRAP} "
+            "by default). Class strata are read from the reference overviews (gdaladdo); "
+            "without them the blocks are stratified by position only."
+        ),
+    )
+    parser.add_argument("--sample-block-size", type=int, default=DEFAULT_SAMPLE_BLOCK_SIZE)
+    parser.add_argument("--sample-seed", type=int, default=0)
+    parser.add_argument(
+        "--sample-check",
+        action="store_true",
+        help="Also run the full evaluation and report the speedup and the estimation error.",
+    )
+    parser.add_argument("--tile-raster-name", default="tile_metrics.tif")
+    parser.add_argument("--tile-geojson-name", default="tile_metrics.geojson")
     return parser.parse_args()
 
 
@@ -55,66 +123,740 @@ def resolve_matrix_config_path(config_path: Path) -> Path:
     return Path(__file__).resolve().parent / config_path
 
 
-def load_overlapping_rasters(reference_path: Path, prediction_path: Path) -> tuple[np.ndarray, np.ndarray]:
-    with rasterio.open(reference_path) as reference_src, rasterio.open(prediction_path) as prediction_src:
-        left = max(reference_src.bounds.left, prediction_src.bounds.left)
-        bottom = max(reference_src.bounds.bottom, prediction_src.bounds.bottom)
-        right = min(reference_src.bounds.right, prediction_src.bounds.right)
-        top = min(reference_src.bounds.top, prediction_src.bounds.top)
-
-        if left >= right or bottom >= top:
-            raise ValueError("Reference and prediction rasters do not overlap.")
-
-        prediction_window = from_bounds(
-            left,
-            bottom,
-            right,
-            top,
-            transform=prediction_src.transform,
-        ).round_offsets().round_lengths()
-
-        prediction = prediction_src.read(1, window=prediction_window).astype(np.float32)
-        if prediction_src.nodata is not None:
-            prediction[prediction == prediction_src.nodata] = np.nan
-
-        if reference_src.crs == prediction_src.crs:
-            reference_window = from_bounds(
-                left,
-                bottom,
-                right,
-                top,
-                transform=reference_src.transform,
-            ).round_offsets().round_lengths()
-            reference = reference_src.read(
-                1,
-                window=reference_window,
-                out_shape=prediction.shape,
-                resampling=Resampling.nearest,
-            ).astype(np.float32)
-            if reference_src.nodata is not None:
-                reference[reference == reference_src.nodata] = np.nan
+def overlap_windows(
+    reference_src: DatasetReader, prediction_src: DatasetReader
+) -> tuple[Window, Window | None]:
+    # Windows of the overlap on the prediction and, when both share a CRS, on the reference.
+    left = max(reference_src.bounds.left, prediction_src.bounds.left)
+    bottom = max(reference_src.bounds.bottom, prediction_src.bounds.bottom)
+    right = min(reference_src.bounds.right, prediction_src.bounds.right)
+    top = min(reference_src.bounds.top, prediction_src.bounds.top)
+
+    if left >= right or bottom >= top:
+        raise ValueError("Reference and prediction rasters do not overlap.")
+
+    prediction_window = from_bounds(left, bottom, right, top, transform=prediction_src.transform)
+    if reference_src.crs != prediction_src.crs:
+        return prediction_window.round_offsets().round_lengths(), None
+    reference_window = from_bounds(left, bottom, right, top, transform=reference_src.transform)
+    return (
+        prediction_window.round_offsets().round_lengths(),
+        reference_window.round_offsets().round_lengths(),
+    )
+
+
+def read_reference_codes(
+    reference_src: DatasetReader,
+    prediction_src: DatasetReader,
+    prediction_window: Window,
+    reference_window: Window | None,
+) -> np.ndarray:
+    # The reference is read onto the prediction pixels of `prediction_window`: resampled from
+    # `reference_window` when both share a CRS, reprojected otherwise.
+    shape = (int(prediction_window.height), int(prediction_window.width))
+    if reference_window is not None:
+        reference = reference_src.read(
+            1,
+            window=reference_window,
+            out_shape=shape,
+            resampling=Resampling.nearest,
+        )
+    else:
+        reference = np.full(shape, np.nan, dtype=np.float32)
+        reproject(
+            source=rasterio.band(gdal_dataset(reference_src), 1),
+            destination=reference,
+            src_transform=reference_src.transform,
+            src_crs=reference_src.crs,
+            src_nodata=reference_src.nodata,
+            dst_transform=prediction_src.window_transform(prediction_window),
+            dst_crs=prediction_src.crs,
+            dst_nodata=np.nan,
+            resampling=Resampling.nearest,
+        )
+    return to_class_codes(reference, reference_src.nodata)
+
+
+def load_overlapping_rasters(
+    reference_path: RasterSource, prediction_path: RasterSource
+) -> tuple[np.ndarray, np.ndarray]:
+    with (
+        open_raster(reference_path) as reference_src,
+        open_raster(prediction_path) as prediction_src,
+    ):
+        prediction_window, reference_window = overlap_windows(reference_src, prediction_src)
+        prediction = to_class_codes(
+            prediction_src.read(1, window=prediction_window), prediction_src.nodata
+        )
+        reference = read_reference_codes(
+            reference_src, prediction_src, prediction_window, reference_window
+        )
+    return reference, prediction
+
+
+def reference_block_window(
+    prediction_window: Window, reference_window: Window | None, block: Window
+) -> Window | None:
+    # The reference window covers the fraction of the whole reference window that the block
+    # covers, so the nearest-neighbour read of the block picks the same reference pixels as one
+    # read of the whole overlap.
+    if reference_window is None:
+        return None
+    scale_x = reference_window.width / prediction_window.width
+    scale_y = reference_window.height / prediction_window.height
+    return Window(
+        reference_window.col_off + (block.col_off - prediction_window.col_off) * scale_x,
+        reference_window.row_off + (block.row_off - prediction_window.row_off) * scale_y,
+        block.width * scale_x,
+        block.height * scale_y,
+    )
+
+
+def evaluation_blocks(
+    reference_src: DatasetReader, prediction_src: DatasetReader, block_size: int
+) -> list[tuple[Window, Window | None]]:
+    # Full-width row blocks of the overlap.
+    prediction_window, reference_window = overlap_windows(reference_src, prediction_src)
+    height = int(prediction_window.height)
+    blocks = []
+    for top in range(0, height, block_size):
+        block = Window(
+            prediction_window.col_off,
+            prediction_window.row_off + top,
+            prediction_window.width,
+            min(block_size, height - top),
+        )
+        blocks.append((block, reference_block_window(prediction_window, reference_window, block)))
+    return blocks
+
+
+def class_lut(mapping: dict, empty_class_id: int) -> np.ndarray:
+    # Class code -> evaluation class, as remap_classes does; CLASS_NODATA is always empty.
+    lut = np.full(CLASS_NODATA + 1, empty_class_id, dtype=np.int64)
+    for source, target in mapping.items():
+        if 0 <= int(source) < CLASS_NODATA:
+            lut[int(source)] = int(target)
+    return lut
+
+
+def accumulate_code_histogram(
+    reference: RasterSource,
+    prediction: RasterSource,
+    blocks: list[tuple[Window, Window | None]],
+) -> np.ndarray:
+    # Counts of (reference code, prediction code) pairs over the blocks, before any remapping.
+    histogram = np.zeros((CLASS_NODATA + 1) ** 2, dtype=np.int64)
+    with open_raster(reference) as reference_src, open_raster(prediction) as prediction_src:
+        for prediction_window, reference_window in blocks:
+            prediction_codes = to_class_codes(
+                prediction_src.read(1, window=prediction_window), prediction_src.nodata
+            )
+            reference_codes = read_reference_codes(
+                reference_src, prediction_src, prediction_window, reference_window
+            )
+            encoded = (reference_codes.astype(np.uint16) << 8) | prediction_codes
+            histogram += np.bincount(encoded.ravel(), minlength=histogram.size)
+    return histogram.reshape(CLASS_NODATA + 1, CLASS_NODATA + 1)
+
+
+def accumulate_blocks(
+    accumulate: Callable[..., np.ndarray],
+    reference: RasterSource,
+    prediction: RasterSource,
+    blocks: list[tuple[Window, Window | None]],
+    *options: object,
+    workers: int = 1,
+) -> np.ndarray:
+    in_memory = isinstance(reference, RasterData) or isinstance(prediction, RasterData)
+    if workers == 1 or in_memory or len(blocks) == 1:
+        return accumulate(reference, prediction, blocks, *options)
+
+    # Each task opens the rasters once for a run of consecutive blocks; only the counts come
+    # back from the workers.
+    task_size = -(-len(blocks) // (4 * workers))
+    tasks = [blocks[start : start + task_size] for start in range(0, len(blocks), task_size)]
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = [
+            executor.submit(accumulate, reference, prediction, task, *options) for task in tasks
+        ]
+        return sum(future.result() for future in futures)
+
+
+def compute_confusion_matrix_blocks(
+    reference: RasterSource,
+    prediction: RasterSource,
+    reference_lut: np.ndarray,
+    prediction_lut: np.ndarray,
+    num_classes: int,
+    *,
+    block_size: int,
+    workers: int = 1,
+) -> np.ndarray:
+    with open_raster(reference) as reference_src, open_raster(prediction) as prediction_src:
+        blocks = evaluation_blocks(reference_src, prediction_src, block_size)
+    histogram = accumulate_blocks(
+        accumulate_code_histogram, reference, prediction, blocks, workers=workers
+    )
+
+    # The remaps are applied to the code pairs rather than to every pixel.
+    cm = np.zeros((num_classes, num_classes), dtype=np.int64)
+    np.add.at(cm, (reference_lut[:, np.newaxis], prediction_lut[np.newaxis, :]), histogram)
+    return cm
+
+
+def accumulate_tile_matrices(
+    reference: RasterSource,
+    prediction: RasterSource,
+    blocks: list[tuple[Window, Window | None]],
+    overlap: Window,
+    tile_size: int,
+    reference_lut: np.ndarray,
+    prediction_lut: np.ndarray,
+    num_classes: int,
+) -> np.ndarray:
+    tiles_y = -(-int(overlap.height) // tile_size)
+    tiles_x = -(-int(overlap.width) // tile_size)
+    matrix_size = num_classes * num_classes
+    matrices = np.zeros(tiles_y * tiles_x * matrix_size, dtype=np.int64)
+    column_tiles = np.arange(int(overlap.width)) // tile_size
+    with open_raster(reference) as reference_src, open_raster(prediction) as prediction_src:
+        for prediction_window, reference_window in blocks:
+            prediction_codes = to_class_codes(
+                prediction_src.read(1, window=prediction_window), prediction_src.nodata
+            )
+            reference_codes = read_reference_codes(
+                reference_src, prediction_src, prediction_window, reference_window
+            )
+            # Only the tile rows crossed by the block are counted, from the first of them.
+            top = int(prediction_window.row_off - overlap.row_off)
+            row_tiles = np.arange(top, top + prediction_codes.shape[0]) // tile_size
+            first_tile = int(row_tiles[0]) * tiles_x
+            tiles = (row_tiles[:, np.newaxis] - row_tiles[0]) * tiles_x + column_tiles
+            encoded = (
+                tiles * num_classes + reference_lut[reference_codes]
+            ) * num_classes + prediction_lut[prediction_codes]
+            counts = np.bincount(encoded.ravel())
+            start = first_tile * matrix_size
+            matrices[start : start + counts.size] += counts
+    return matrices.reshape(tiles_y, tiles_x, num_classes, num_classes)
+
+
+@dataclass(frozen=True)
+class TileMatrices:
+    # One confusion matrix per tile of `tile_size` prediction pixels, row-major over the overlap.
+    matrices: np.ndarray
+    class_names: dict[int, str]
+    tile_size: int
+    overlap: Window
+    transform: Affine
+    crs: CRS | None
+
+    def tile_bounds(self, row: int, col: int) -> tuple[float, float, float, float]:
+        window = Window(
+            col * self.tile_size,
+            row * self.tile_size,
+            min(self.tile_size, int(self.overlap.width) - col * self.tile_size),
+            min(self.tile_size, int(self.overlap.height) - row * self.tile_size),
+        )
+        return array_bounds(
+            int(window.height), int(window.width), windows.transform(window, self.transform)
+        )
+
+
+def compute_tile_confusion_matrices(
+    reference: RasterSource,
+    prediction: RasterSource,
+    *,
+    tile_size: int,
+    matrix_config_path: Path = DEFAULT_MATRIX_CONFIG,
+    block_size: int | None = None,
+    workers: int = 1,
+) -> TileMatrices:
+    config = load_matrix_config(resolve_matrix_config_path(matrix_config_path))
+    evaluation_config = config["evaluation"]
+    class_names = {
+        int(class_id): class_name
+        for class_id, class_name in evaluation_config["class_names"].items()
+    }
+    empty_class_id = int(evaluation_config["empty_class_id"])
+
+    with open_raster(reference) as reference_src, open_raster(prediction) as prediction_src:
+        overlap, _ = overlap_windows(reference_src, prediction_src)
+        blocks = evaluation_blocks(reference_src, prediction_src, block_size or tile_size)
+        transform = prediction_src.window_transform(overlap)
+        crs = prediction_src.crs
+    matrices = accumulate_blocks(
+        accumulate_tile_matrices,
+        reference,
+        prediction,
+        blocks,
+        overlap,
+        tile_size,
+        class_lut(evaluation_config["reference_remap"], empty_class_id),
+        class_lut(evaluation_config["prediction_remap"], empty_class_id),
+        len(class_names),
+        workers=workers,
+    )
+    return TileMatrices(matrices, class_names, tile_size, overlap, transform, crs)
+
+
+def tile_metrics(tiles: TileMatrices) -> list[dict[str, object]]:
+    entries = []
+    for row, col in np.ndindex(tiles.matrices.shape[:2]):
+        cm = tiles.matrices[row, col]
+        pixels = int(cm.sum())
+        if pixels == 0:
+            continue
+        with warnings.catch_warnings():
+            # Tiles holding only excluded classes have no mean.
+            warnings.simplefilter("ignore", RuntimeWarning)
+            metrics = compute_metrics_from_confusion_matrix(cm, tiles.class_names)
+        entries.append(
+            {
+                "row": row,
+                "col": col,
+                "pixels": pixels,
+                "accuracy": float(np.trace(cm)) / pixels,
+                **metrics,
+            }
+        )
+    return entries
+
+
+def write_tile_raster(tiles: TileMatrices, entries: list[dict[str, object]], path: Path) -> None:
+    names = ["accuracy", "mean_iou"] + [
+        f"iou_{tiles.class_names[index]}" for index in range(len(tiles.class_names))
+    ]
+    bands = np.full((len(names), *tiles.matrices.shape[:2]), np.nan, dtype=np.float32)
+    for entry in entries:
+        values = [entry["accuracy"], entry["summary"]["mean_iou"]]
+        values.extend(class_entry["iou"] for class_entry in entry["per_class"])
+        bands[:, entry["row"], entry["col"]] = values
+    profile = {
+        "driver": "GTiff",
+        "height": bands.shape[1],
+        "width": bands.shape[2],
+        "count": len(names),
+        "dtype": "float32",
+        "nodata": np.nan,
+        "crs": tiles.crs,
+        "transform": tiles.transform * Affine.scale(tiles.tile_size),
+        "compress": "lzw",
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(bands)
+        for band, name in enumerate(names, start=1):
+            dst.set_band_description(band, name)
+    print(f"Saved tile metrics raster to: {path}")
+
+
+def write_tile_geojson(tiles: TileMatrices, entries: list[dict[str, object]], path: Path) -> None:
+    features = []
+    for entry in entries:
+        left, bottom, right, top = tiles.tile_bounds(entry["row"], entry["col"])
+        properties = {
+            "row": entry["row"],
+            "col": entry["col"],
+            "pixels": entry["pixels"],
+            "accuracy": entry["accuracy"],
+            "mean_iou": entry["summary"]["mean_iou"],
+        }
+        properties.update(
+            {
+                f"iou_{class_entry['class_name']}": class_entry["iou"]
+                for class_entry in entry["per_class"]
+            }
+        )
+        features.append(
+            {
+                "type": "Feature",
+                "properties": {
+                    key: None if isinstance(value, float) and np.isnan(value) else value
+                    for key, value in properties.items()
+                },
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [
+                        [[left, bottom], [right, bottom], [right, top], [left, top], [left, bottom]]
+                    ],
+                },
+            }
+        )
+    collection: dict[str, object] = {"type": "FeatureCollection", "features": features}
+    # Tiles keep the raster CRS, named the way GeoJSON readers such as GDAL expect it.
+    epsg = tiles.crs.to_epsg() if tiles.crs is not None else None
+    if epsg is not None:
+        collection["crs"] = {
+            "type": "name",
+            "properties": {"name": f"urn:ogc:def:crs:EPSG::{epsg}"},
+        }
+    with path.open("w", encoding="utf-8") as handle:
+        json.dump(collection, handle)
+    print(f"Saved tile metrics GeoJSON to: {path}")
+
+
+def interval_bounds(
+    replicates: np.ndarray, class_names: dict[int, str], confidence: float
+) -> dict[str, object]:
+    # Percentile intervals of the metrics over bootstrap replicates of the confusion matrix.
+    num_classes = len(class_names)
+    names = ("iou", "precision", "recall", "dice")
+    summary_values = []
+    class_values = []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for cm in replicates.reshape(-1, num_classes, num_classes):
+            metrics = compute_metrics_from_confusion_matrix(cm, class_names)
+            summary_values.append([metrics["summary"][f"mean_{name}"] for name in names])
+            class_values.append([[entry[name] for name in names] for entry in metrics["per_class"]])
+        bounds = [50 * (1 - confidence), 50 * (1 + confidence)]
+        summary_low, summary_high = np.nanpercentile(summary_values, bounds, axis=0)
+        class_low, class_high = np.nanpercentile(class_values, bounds, axis=0)
+    return {
+        "summary": {
+            f"mean_{name}": [float(summary_low[index]), float(summary_high[index])]
+            for index, name in enumerate(names)
+        },
+        "per_class": [
+            {
+                "class_id": class_id,
+                "class_name": class_names[class_id],
+                **{
+                    name: [float(class_low[class_id, index]), float(class_high[class_id, index])]
+                    for index, name in enumerate(names)
+                },
+            }
+            for class_id in range(num_classes)
+        ],
+    }
+
+
+def bootstrap_confidence_intervals(
+    matrices: np.ndarray,
+    class_names: dict[int, str],
+    *,
+    samples: int = 1000,
+    confidence: float = 0.95,
+    seed: int = 0,
+) -> dict[str, object]:
+    # Tiles are resampled with replacement and their matrices summed, so no pixel is read again.
+    num_classes = len(class_names)
+    matrices = matrices.reshape(-1, num_classes * num_classes)
+    matrices = matrices[matrices.sum(axis=1) > 0]
+    counts = np.random.default_rng(seed).multinomial(
+        len(matrices), np.full(len(matrices), 1.0 / len(matrices)), size=samples
+    )
+    return {
+        "method": "tile_bootstrap",
+        "tiles": len(matrices),
+        "samples": samples,
+        "confidence": confidence,
+        **interval_bounds(counts @ matrices, class_names, confidence),
+    }
+
+
+def stratified_bootstrap_intervals(
+    matrices: np.ndarray,
+    strata: np.ndarray,
+    stratum_sizes: np.ndarray,
+    class_names: dict[int, str],
+    *,
+    samples: int = 1000,
+    confidence: float = 0.95,
+    seed: int = 0,
+) -> dict[str, object] | None:
+    # Rescaled bootstrap of a stratified sample (Rao and Wu): in each stratum, n - 1 of its n
+    # blocks are redrawn and the weights rescaled so the replicates keep the variance of the
+    # estimate, finite-population correction included. A stratum read in full adds no
+    # variance, and one with a single block out of several gives no variance estimate at all.
+    drawn = np.bincount(strata, minlength=len(stratum_sizes))
+    if np.any((drawn < 2) & (drawn < stratum_sizes)):
+        return None
+    rng = np.random.default_rng(seed)
+    weights = np.empty((samples, len(matrices)))
+    for stratum, (count, size) in enumerate(zip(drawn, stratum_sizes, strict=True)):
+        members = np.flatnonzero(strata == stratum)
+        if count == size:
+            weights[:, members] = 1.0
+            continue
+        scale = math.sqrt(1 - count / size)
+        redrawn = rng.multinomial(count - 1, np.full(count, 1.0 / count), size=samples)
+        weights[:, members] = (size / count) * (1 - scale + scale * count / (count - 1) * redrawn)
+    return {
+        "method": "stratified_block_bootstrap",
+        "blocks": len(matrices),
+        "strata": len(stratum_sizes),
+        "samples": samples,
+        "confidence": confidence,
+        **interval_bounds(weights @ matrices.reshape(len(matrices), -1), class_names, confidence),
+    }
+
+
+def reference_pixels(
+    reference_src: DatasetReader, prediction_src: DatasetReader, prediction_window: Window
+) -> int:
+    # Reference pixels covering a window of the prediction, to count what a read decodes.
+    bounds = prediction_src.window_bounds(prediction_window)
+    if reference_src.crs != prediction_src.crs:
+        bounds = transform_bounds(prediction_src.crs, reference_src.crs, *bounds)
+    window = from_bounds(*bounds, transform=reference_src.transform)
+    return round(window.width * window.height)
+
+
+def reference_class_profile(
+    reference_src: DatasetReader,
+    prediction_src: DatasetReader,
+    reference_lut: np.ndarray,
+    step: int,
+) -> tuple[np.ndarray | None, int]:
+    # Evaluation classes of the reference on a grid `step` times coarser than the prediction
+    # overlap, and the reference pixels read for it. They are read from the coarsest overview
+    # still finer than that grid; without overviews the profile would decode the whole
+    # reference, so there is none.
+    factors = reference_src.overviews(1)
+    if not factors:
+        return None, 0
+    prediction_window, _ = overlap_windows(reference_src, prediction_src)
+    height, width = int(prediction_window.height), int(prediction_window.width)
+    shape = (-(-height // step), -(-width // step))
+    profile_size = step * abs(prediction_src.transform.a)
+    level = max(
+        (
+            index
+            for index, factor in enumerate(factors)
+            if factor * abs(reference_src.transform.a) <= profile_size
+        ),
+        default=0,
+    )
+    with rasterio.open(reference_src.name, overview_level=level) as overview:
+        _, overview_window = overlap_windows(overview, prediction_src)
+        if overview_window is not None:
+            reference = overview.read(
+                1, window=overview_window, out_shape=shape, resampling=Resampling.nearest
+            )
         else:
-            reference = np.full(prediction.shape, np.nan, dtype=np.float32)
+            reference = np.full(shape, np.nan, dtype=np.float32)
             reproject(
-                source=rasterio.band(reference_src, 1),
+                source=rasterio.band(overview, 1),
                 destination=reference,
-                src_transform=reference_src.transform,
-                src_crs=reference_src.crs,
-                src_nodata=reference_src.nodata,
-                dst_transform=prediction_src.window_transform(prediction_window),
+                src_transform=overview.transform,
+                src_crs=overview.crs,
+                src_nodata=overview.nodata,
+                dst_transform=prediction_src.window_transform(prediction_window)
+                * Affine.scale(width / shape[1], height / shape[0]),
                 dst_crs=prediction_src.crs,
                 dst_nodata=np.nan,
                 resampling=Resampling.nearest,
             )
+        pixels_read = reference_pixels(overview, prediction_src, prediction_window)
+    return reference_lut[to_class_codes(reference, reference_src.nodata)], pixels_read
 
-    return reference, prediction
 
+def sample_blocks(
+    reference_src: DatasetReader,
+    prediction_src: DatasetReader,
+    fraction: float,
+    block_size: int,
+    rng: np.random.Generator,
+    profile: np.ndarray | None,
+    num_classes: int,
+) -> tuple[list[tuple[Window, Window | None]], np.ndarray, np.ndarray, int]:
+    # Each block of the overlap is assigned to the reference class it holds most of in the
+    # profile, relative to the whole overlap, so blocks rich in a rare class form a group of
+    # their own. Every class group gets at least an equal share of the draws, so rare classes
+    # are sampled more densely. A group is split in row-major order into spatial strata of
+    # about two draws, and at least two blocks are drawn without replacement in each stratum
+    # that has them. Without a profile, all blocks form a single group.
+    prediction_window, reference_window = overlap_windows(reference_src, prediction_src)
+    height, width = int(prediction_window.height), int(prediction_window.width)
+    # A window of a striped GeoTIFF decodes whole rows, so blocks then span the overlap width.
+    striped = any(src.block_shapes[0][1] == src.width for src in (reference_src, prediction_src))
+    block_width = width if striped else block_size
+    grid = [
+        (top, left) for top in range(0, height, block_size) for left in range(0, width, block_width)
+    ]
+
+    if profile is None:
+        classes = np.zeros(len(grid), dtype=np.int64)
+    else:
+        step = max(1, block_size // CLASS_PROFILE_PIXELS)
+        histograms = np.array(
+            [
+                np.bincount(
+                    profile[
+                        top // step : -(-min(top + block_size, height) // step),
+                        left // step : -(-min(left + block_width, width) // step),
+                    ].ravel(),
+                    minlength=num_classes,
+                )
+                for top, left in grid
+            ],
+            dtype=np.float64,
+        )
+        shares = histograms / histograms.sum(axis=1, keepdims=True)
+        overall = histograms.sum(axis=0) / histograms.sum()
+        classes = np.argmax(
+            np.divide(shares, overall, out=np.zeros_like(shares), where=overall > 0), axis=1
+        )
 
-def remap_classes(array: np.ndarray, mapping: dict[int, int]) -> np.ndarray:
-    result = np.full_like(array, np.nan, dtype=np.float32)
-    for source_class, target_class in mapping.items():
-        result[array == source_class] = target_class
-    return result
+    drawn = []
+    strata = []
+    stratum_sizes = []
+    class_ids = np.unique(classes)
+    budget = math.ceil(fraction * len(grid))
+    for class_id in class_ids:
+        members = np.flatnonzero(classes == class_id)
+        class_draws = min(
+            len(members), max(math.ceil(fraction * len(members)), budget // len(class_ids))
+        )
+        for stratum in np.array_split(members, max(1, class_draws // 2)):
+            count = min(len(stratum), max(2, math.ceil(class_draws * len(stratum) / len(members))))
+            drawn.extend(rng.choice(stratum, count, replace=False).tolist())
+            strata.extend([len(stratum_sizes)] * count)
+            stratum_sizes.append(len(stratum))
+    # Blocks are read in row-major order.
+    order = np.argsort(drawn, kind="stable")
+    blocks = []
+    for index in np.asarray(drawn)[order]:
+        top, left = grid[index]
+        block = Window(
+            prediction_window.col_off + left,
+            prediction_window.row_off + top,
+            min(block_width, width - left),
+            min(block_size, height - top),
+        )
+        blocks.append((block, reference_block_window(prediction_window, reference_window, block)))
+    return blocks, np.asarray(strata)[order], np.asarray(stratum_sizes), len(grid)
+
+
+def accumulate_block_matrices(
+    reference: RasterSource,
+    prediction: RasterSource,
+    blocks: list[tuple[Window, Window | None]],
+    reference_lut: np.ndarray,
+    prediction_lut: np.ndarray,
+    num_classes: int,
+) -> np.ndarray:
+    matrices = np.zeros((len(blocks), num_classes * num_classes), dtype=np.int64)
+    with open_raster(reference) as reference_src, open_raster(prediction) as prediction_src:
+        for index, (prediction_window, reference_window) in enumerate(blocks):
+            prediction_codes = to_class_codes(
+                prediction_src.read(1, window=prediction_window), prediction_src.nodata
+            )
+            reference_codes = read_reference_codes(
+                reference_src, prediction_src, prediction_window, reference_window
+            )
+            encoded = (
+                reference_lut[reference_codes] * num_classes + prediction_lut[prediction_codes]
+            )
+            matrices[index] = np.bincount(encoded.ravel(), minlength=matrices.shape[1])
+    return matrices.reshape(len(blocks), num_classes, num_classes)
+
+
+@dataclass(frozen=True)
+class SampledMatrices:
+    # Confusion matrices of the sampled blocks, with the stratum each block was drawn from and
+    # the number of blocks of every stratum.
+    matrices: np.ndarray
+    strata: np.ndarray
+    stratum_sizes: np.ndarray
+    class_names: dict[int, str]
+    total_blocks: int
+    class_strata: bool
+    # Prediction pixels, then reference pixels including the class profile.
+    pixels_read: int
+    overlap_pixels: int
+    reference_pixels_read: int
+    reference_overlap_pixels: int
+
+    def estimated_speedup(self) -> float:
+        # Reads dominate, so a full pass is expected to take about this many times longer.
+        return (self.overlap_pixels + self.reference_overlap_pixels) / (
+            self.pixels_read + self.reference_pixels_read
+        )
+
+    def estimate(self) -> np.ndarray:
+        # Each block stands for the blocks of its stratum that were not drawn.
+        drawn = np.bincount(self.strata, minlength=len(self.stratum_sizes))
+        weights = (self.stratum_sizes / drawn)[self.strata]
+        return np.tensordot(weights, self.matrices, axes=1)
+
+
+def sample_confusion_matrices(
+    reference: RasterSource,
+    prediction: RasterSource,
+    *,
+    fraction: float,
+    block_size: int = DEFAULT_SAMPLE_BLOCK_SIZE,
+    matrix_config_path: Path = DEFAULT_MATRIX_CONFIG,
+    seed: int = 0,
+) -> SampledMatrices:
+    if not 0 < fraction <= 1:
+        raise ValueError(f"Sample fraction must be in (0, 1], got {fraction}.")
+    config = load_matrix_config(resolve_matrix_config_path(matrix_config_path))
+    evaluation_config = config["evaluation"]
+    class_names = {
+        int(class_id): class_name
+        for class_id, class_name in evaluation_config["class_names"].items()
+    }
+    empty_class_id = int(evaluation_config["empty_class_id"])
+    reference_lut = class_lut(evaluation_config["reference_remap"], empty_class_id)
+
+    with open_raster(reference) as reference_src, open_raster(prediction) as prediction_src:
+        overlap, _ = overlap_windows(reference_src, prediction_src)
+        profile, profile_pixels = reference_class_profile(
+            reference_src,
+            prediction_src,
+            reference_lut,
+            max(1, block_size // CLASS_PROFILE_PIXELS),
+        )
+        if profile is None:
+            print(
+                "The reference has no overviews, so the blocks are stratified by position only. "
+                "Build them (gdaladdo) for reference class strata."
+            )
+        blocks, strata, stratum_sizes, total_blocks = sample_blocks(
+            reference_src,
+            prediction_src,
+            fraction,
+            block_size,
+            np.random.default_rng(seed),
+            profile,
+            len(class_names),
+        )
+        reference_overlap_pixels = reference_pixels(reference_src, prediction_src, overlap)
+    pixels_read = sum(int(block.width * block.height) for block, _ in blocks)
+    overlap_pixels = int(overlap.width * overlap.height)
+    matrices = accumulate_block_matrices(
+        reference,
+        prediction,
+        blocks,
+        reference_lut,
+        class_lut(evaluation_config["prediction_remap"], empty_class_id),
+        len(class_names),
+    )
+    return SampledMatrices(
+        matrices,
+        strata,
+        stratum_sizes,
+        class_names,
+        total_blocks,
+        profile is not None,
+        pixels_read,
+        overlap_pixels,
+        # The blocks read the same share of the reference as of the prediction.
+        round(pixels_read * reference_overlap_pixels / overlap_pixels) + profile_pixels,
+        reference_overlap_pixels,
+    )
+
+
+def remap_classes(array: np.ndarray, mapping: dict[int, int], empty_class_id: int) -> np.ndarray:
+    # CLASS_NODATA marks cells without a class, so it always goes to the empty class.
+    mapping = {source: target for source, target in mapping.items() if source != CLASS_NODATA}
+    return classification_kernels.remap_classes(
+        array, mapping, fill_value=empty_class_id, dtype=CLASS_DTYPE
+    )
 
 
 def compute_confusion_matrix_cpu(
@@ -128,6 +870,7 @@ def compute_confusion_matrix_cpu(
 def compute_confusion_matrix_gpu(
     reference_final: np.ndarray, prediction_final: np.ndarray, num_classes: int
 ) -> np.ndarray:
+    torch = import_torch()
     if torch is None:
         raise RuntimeError("PyTorch is not installed, so GPU evaluation is unavailable.")
     if not torch.cuda.is_available():
@@ -142,30 +885,44 @@ def compute_confusion_matrix_gpu(
 
 
 def compute_confusion_percent_with_empty(
-    raster_ref_path: Path,
-    raster_compare_path: Path,
+    raster_ref_path: RasterSource,
+    raster_compare_path: RasterSource,
     *,
     matrix_config_path: Path = DEFAULT_MATRIX_CONFIG,
     use_gpu: bool = False,
+    block_size: int | None = None,
+    workers: int = 1,
 ) -> tuple[np.ndarray, np.ndarray, dict[int, str]]:
     config = load_matrix_config(resolve_matrix_config_path(matrix_config_path))
     evaluation_config = config["evaluation"]
 
-    reference, prediction = load_overlapping_rasters(raster_ref_path, raster_compare_path)
-
-    reference_remap = remap_classes(reference, evaluation_config["reference_remap"])
-    prediction_remap = remap_classes(prediction, evaluation_config["prediction_remap"])
-
     class_names = {
         int(class_id): class_name
         for class_id, class_name in evaluation_config["class_names"].items()
     }
     empty_class_id = int(evaluation_config["empty_class_id"])
+    num_classes = len(class_names)
 
-    reference_final = np.where(np.isnan(reference_remap), empty_class_id, reference_remap).astype(np.int64)
-    prediction_final = np.where(np.isnan(prediction_remap), empty_class_id, prediction_remap).astype(np.int64)
+    if block_size is not None:
+        cm = compute_confusion_matrix_blocks(
+            raster_ref_path,
+            raster_compare_path,
+            class_lut(evaluation_config["reference_remap"], empty_class_id),
+            class_lut(evaluation_config["prediction_remap"], empty_class_id),
+            num_classes,
+            block_size=block_size,
+            workers=workers,
+        )
+        return cm, confusion_percent(cm), class_names
+
+    reference, prediction = load_overlapping_rasters(raster_ref_path, raster_compare_path)
+    reference_final = remap_classes(
+        reference, evaluation_config["reference_remap"], empty_class_id
+    )
+    prediction_final = remap_classes(
+        prediction, evaluation_config["prediction_remap"], empty_class_id
+    )
 
-    num_classes = len(class_names)
     if use_gpu:
         try:
             print("Computing confusion matrix on GPU.")
@@ -175,17 +932,24 @@ def compute_confusion_percent_with_empty(
             cm = compute_confusion_matrix_cpu(reference_final, prediction_final, num_classes)
     else:
         cm = compute_confusion_matrix_cpu(reference_final, prediction_final, num_classes)
+    return cm, confusion_percent(cm), class_names
+
 
+def confusion_percent(cm: np.ndarray) -> np.ndarray:
     cm_percent = cm.astype(np.float64)
     row_sums = cm_percent.sum(axis=1, keepdims=True)
     cm_percent = np.divide(cm_percent, row_sums, out=np.zeros_like(cm_percent), where=row_sums != 0)
     cm_percent *= 100
-    return cm, cm_percent, class_names
+    return cm_percent
 
 
 def plot_confusion_matrix_percent(
     cm_percent: np.ndarray, class_names: dict[int, str], output_path: Path
 ) -> None:
+    # Plotting libraries take seconds to import, so only runs that plot load them.
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     plt.figure(figsize=(8, 6))
     sns.heatmap(
         cm_percent,
@@ -274,26 +1038,205 @@ def write_log(metrics: dict[str, object], log_path: Path) -> None:
         handle.write(f"Mean Precision : {summary['mean_precision']:.3f}\n")
         handle.write(f"Mean Recall    : {summary['mean_recall']:.3f}\n")
         handle.write(f"Mean Dice      : {summary['mean_dice']:.3f}\n")
+        intervals = metrics.get("confidence_intervals")
+        if intervals is not None:
+            resampled = (
+                f"{intervals['tiles']} tiles"
+                if "tiles" in intervals
+                else f"{intervals['blocks']} blocks in {intervals['strata']} strata"
+            )
+            handle.write(
+                f"\n==== {intervals['confidence']:.0%} Confidence Intervals "
+                f"({intervals['samples']} bootstrap samples of {resampled}) ====\n"
+            )
+            for name, (low, high) in intervals["summary"].items():
+                handle.write(f"{name:<15}: [{low:.3f}, {high:.3f}]\n")
+        sampling = metrics.get("sampling")
+        if sampling is not None:
+            handle.write(
+                f"\nEstimated from {sampling['sampled_blocks']} of {sampling['total_blocks']} "
+                f"blocks of {sampling['block_size']} pixels in {sampling['strata']} strata "
+                f"({sampling['pixels_read'] / sampling['overlap_pixels']:.1%} of the overlap, "
+                f"estimated speedup {sampling['estimated_speedup']:.1f}x).\n"
+            )
+
+
+def evaluate_prediction(
+    reference: RasterSource,
+    prediction: RasterSource,
+    output_dir: Path,
+    *,
+    matrix_config_path: Path = DEFAULT_MATRIX_CONFIG,
+    use_gpu: bool = False,
+    block_size: int | None = None,
+    workers: int = 1,
+    tile_size: int | None = None,
+    bootstrap_samples: int = 0,
+    bootstrap_seed: int = 0,
+    sample_fraction: float | None = None,
+    sample_block_size: int = DEFAULT_SAMPLE_BLOCK_SIZE,
+    sample_seed: int = 0,
+    sample_check: bool = False,
+    plot_name: str = "confusion_matrix_percent.png",
+    metrics_name: str = "metrics_summary.json",
+    log_name: str = "metrics_log.txt",
+    tile_raster_name: str = "tile_metrics.tif",
+    tile_geojson_name: str = "tile_metrics.geojson",
+) -> dict[str, object]:
+    if sample_fraction is not None and tile_size is not None:
+        raise ValueError("Sampling cannot be combined with tile metrics.")
+    if bootstrap_samples and tile_size is None and sample_fraction is None:
+        raise ValueError("Bootstrap confidence intervals require a tile size or a sample.")
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    def full_pass() -> tuple[np.ndarray, np.ndarray, dict[int, str]]:
+        return compute_confusion_percent_with_empty(
+            reference,
+            prediction,
+            matrix_config_path=matrix_config_path,
+            use_gpu=use_gpu,
+            block_size=block_size,
+            workers=workers,
+        )
+
+    tiles = None
+    sampled = None
+    if sample_fraction is not None:
+        start = time.perf_counter()
+        sampled = sample_confusion_matrices(
+            reference,
+            prediction,
+            fraction=sample_fraction,
+            block_size=sample_block_size,
+            matrix_config_path=matrix_config_path,
+            seed=sample_seed,
+        )
+        sample_seconds = time.perf_counter() - start
+        # The estimate is a weighted sum of block counts, so it is not an integer matrix.
+        cm = sampled.estimate()
+        cm_percent = confusion_percent(cm)
+        class_names = sampled.class_names
+    elif tile_size is None:
+        cm, cm_percent, class_names = full_pass()
+    else:
+        # The tile matrices sum to the matrix of the whole overlap, so one pass gives both.
+        tiles = compute_tile_confusion_matrices(
+            reference,
+            prediction,
+            tile_size=tile_size,
+            matrix_config_path=matrix_config_path,
+            block_size=block_size,
+            workers=workers,
+        )
+        cm = tiles.matrices.sum(axis=(0, 1))
+        cm_percent = confusion_percent(cm)
+        class_names = tiles.class_names
+    plot_confusion_matrix_percent(cm_percent, class_names, output_dir / plot_name)
+
+    metrics = compute_metrics_from_confusion_matrix(cm, class_names)
+    if tiles is not None:
+        entries = tile_metrics(tiles)
+        write_tile_raster(tiles, entries, output_dir / tile_raster_name)
+        write_tile_geojson(tiles, entries, output_dir / tile_geojson_name)
+        if bootstrap_samples:
+            metrics["confidence_intervals"] = {
+                "tile_size": tile_size,
+                **bootstrap_confidence_intervals(
+                    tiles.matrices, class_names, samples=bootstrap_samples, seed=bootstrap_seed
+                ),
+            }
+    if sampled is not None:
+        intervals = stratified_bootstrap_intervals(
+            sampled.matrices,
+            sampled.strata,
+            sampled.stratum_sizes,
+            class_names,
+            samples=bootstrap_samples or DEFAULT_SAMPLE_BOOTSTRAP,
+            seed=bootstrap_seed,
+        )
+        if intervals is None:
+            print("A stratum has a single sampled block, so no confidence interval is reported.")
+        else:
+            metrics["confidence_intervals"] = {"block_size": sample_block_size, **intervals}
+        sampling = {
+            "fraction": sample_fraction,
+            "block_size": sample_block_size,
+            "seed": sample_seed,
+            "sampled_blocks": len(sampled.matrices),
+            "total_blocks": sampled.total_blocks,
+            "strata": len(sampled.stratum_sizes),
+            "class_strata": sampled.class_strata,
+            "pixels_read": sampled.pixels_read,
+            "overlap_pixels": sampled.overlap_pixels,
+            "reference_pixels_read": sampled.reference_pixels_read,
+            "reference_overlap_pixels": sampled.reference_overlap_pixels,
+            "elapsed_seconds": sample_seconds,
+            "estimated_speedup": sampled.estimated_speedup(),
+        }
+        if sample_check:
+            start = time.perf_counter()
+            full_cm = full_pass()[0]
+            full_seconds = time.perf_counter() - start
+            full_summary = compute_metrics_from_confusion_matrix(full_cm, class_names)["summary"]
+            sampling["full_pass"] = {
+                "elapsed_seconds": full_seconds,
+                "speedup": full_seconds / sample_seconds,
+                "summary": full_summary,
+                "error": {
+                    name: metrics["summary"][name] - value for name, value in full_summary.items()
+                },
+            }
+        metrics["sampling"] = sampling
+        print(
+            f"Sampled {sampling['sampled_blocks']} of {sampling['total_blocks']} blocks "
+            f"({sampled.pixels_read / sampled.overlap_pixels:.1%} of the pixels, "
+            f"estimated speedup {sampling['estimated_speedup']:.1f}x) "
+            f"in {sample_seconds:.2f} s"
+            + (
+                f"; full pass {sampling['full_pass']['elapsed_seconds']:.2f} s "
+                f"({sampling['full_pass']['speedup']:.1f}x slower)"
+                if sample_check
+                else ""
+            )
+        )
+    write_json(metrics, output_dir / metrics_name)
+    write_log(metrics, output_dir / log_name)
+
+    print(f"Saved metrics JSON to: {output_dir / metrics_name}")
+    print(f"Saved metrics log to: {output_dir / log_name}")
+    return metrics
 
 
 def main() -> None:
     args = parse_args()
-    args.output_dir.mkdir(parents=True, exist_ok=True)
-
-    cm, cm_percent, class_names = compute_confusion_percent_with_empty(
+    validate_positive_number(args.workers, "workers")
+    validate_positive_number(args.sample_block_size, "sample_block_size")
+    for name in ("block_size", "tile_size"):
+        if getattr(args, name) is not None:
+            validate_positive_number(getattr(args, name), name)
+    if args.bootstrap < 0:
+        raise ValueError("bootstrap must not be negative.")
+    evaluate_prediction(
         args.reference,
         args.prediction,
+        args.output_dir,
         matrix_config_path=args.matrix_config,
         use_gpu=args.use_gpu,
+        block_size=args.block_size,
+        workers=args.workers,
+        tile_size=args.tile_size,
+        bootstrap_samples=args.bootstrap,
+        bootstrap_seed=args.bootstrap_seed,
+        sample_fraction=args.sample,
+        sample_block_size=args.sample_block_size,
+        sample_seed=args.sample_seed,
+        sample_check=args.sample_check,
+        plot_name=args.plot_name,
+        metrics_name=args.metrics_name,
+        log_name=args.log_name,
+        tile_raster_name=args.tile_raster_name,
+        tile_geojson_name=args.tile_geojson_name,
     )
-    plot_confusion_matrix_percent(cm_percent, class_names, args.output_dir / args.plot_name)
-
-    metrics = compute_metrics_from_confusion_matrix(cm, class_names)
-    write_json(metrics, args.output_dir / args.metrics_name)
-    write_log(metrics, args.output_dir / args.log_name)
-
-    print(f"Saved metrics JSON to: {args.output_dir / args.metrics_name}")
-    print(f"Saved metrics log to: {args.output_dir / args.log_name}")
 
 
 if __name__ == "__main__":
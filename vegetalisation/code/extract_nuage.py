@@ -15,11 +15,12 @@ DEFAULT_XMIN_START = 1841500
 DEFAULT_XMIN_END = 1852000
 DEFAULT_YMIN_START = 5169000
 DEFAULT_YMIN_END = 5179000
+DEFAULT_TILE_SIZE_METERS = 1000
 CHUNK_SIZE = 8192
 REQUEST_TIMEOUT_SECONDS = 60
 
 
-def parse_args() -> argparse.Namespace:
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Download LAZ tiles from a JSON inventory for a bounding box."
     )
@@ -29,7 +30,7 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--xmin-end", type=int, default=DEFAULT_XMIN_END)
     parser.add_argument("--ymin-start", type=int, default=DEFAULT_YMIN_START)
     parser.add_argument("--ymin-end", type=int, default=DEFAULT_YMIN_END)
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
 def load_tiles(json_file: Path) -> list[dict[str, Any]]:
@@ -57,6 +58,25 @@ def tile_origin(tile: dict[str, Any]) -> tuple[int, int]:
     )
 
 
+def tile_footprints(
+    tiles: list[dict[str, Any]],
+    tile_size: float = DEFAULT_TILE_SIZE_METERS,
+) -> dict[str, tuple[float, float, float, float]]:
+    footprints: dict[str, tuple[float, float, float, float]] = {}
+    for tile in tiles:
+        url = tile.get("url")
+        if not isinstance(url, str):
+            continue
+        tile_x_min, tile_y_min = tile_origin(tile)
+        footprints[Path(url.strip()).name] = (
+            float(tile_x_min),
+            float(tile_y_min),
+            float(tile_x_min + tile_size),
+            float(tile_y_min + tile_size),
+        )
+    return footprints
+
+
 def select_tiles(
     tiles: list[dict[str, Any]],
     xmin_start: int,
@@ -82,8 +102,8 @@ def download_tile(session: requests.Session, url: str, output_path: Path) -> Non
                     handle.write(chunk)
 
 
-def main() -> None:
-    args = parse_args()
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
     validate_bbox(args.xmin_start, args.xmin_end, args.ymin_start, args.ymin_end)
     args.output_dir.mkdir(parents=True, exist_ok=True)
 
@@ -1,11 +1,20 @@
 from __future__ import annotations
 
 import argparse
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
 import rasterio
 import yaml
+from rasterio.windows import Window
+
+from classification_kernels import remap_classes
+from probability_store import ProbabilityBands, probability_bands
+from raster_products import RasterData, RasterSource, open_raster, write_raster
+from workflow_utils import validate_positive_number
 
 DEFAULT_MATRIX_CONFIG = Path("configs/baseline/configs.yml")
 
@@ -14,9 +23,26 @@ def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Reweight class probabilities, then filter and remap target classes."
     )
-    parser.add_argument("--input", "-i", type=Path, required=True, help="Input probability GeoTIFF")
+    parser.add_argument(
+        "--input", "-i", type=Path, required=True, help="Input probability GeoTIFF or store"
+    )
     parser.add_argument("--output", "-o", type=Path, required=True, help="Output remapped GeoTIFF")
     parser.add_argument("--matrix-config", type=Path, default=DEFAULT_MATRIX_CONFIG)
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=None,
+        help=(
+            "Reweight the probabilities in full-width blocks of this many rows instead of loading "
+            "every band whole. The output is identical."
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Threads processing blocks in parallel with --block-size.",
+    )
     return parser.parse_args()
 
 
@@ -45,6 +71,120 @@ def load_reweight_config(config_path: Path) -> tuple[dict[int, float], dict[int,
     return weights, mapping, ignore_value
 
 
+def _band_plan(
+    bands: ProbabilityBands, weights: dict[int, float], mapping: dict[int, int]
+) -> tuple[np.ndarray, dict[int, int]]:
+    return bands.band_weights(weights), bands.band_mapping(mapping)
+
+
+def source_bands(source: RasterSource) -> ProbabilityBands:
+    if isinstance(source, RasterData):
+        return ProbabilityBands(tuple(range(source.bands.shape[0])))
+    with rasterio.open(source) as src:
+        return probability_bands(src)
+
+
+def reweight_block(
+    probs: np.ndarray,
+    band_weights: np.ndarray,
+    band_mapping: dict[int, int],
+    ignore_value: int,
+) -> np.ndarray:
+    # `probs` is a float32 band stack that is reweighted in place. Quantized store bands are
+    # reweighted as is: the argmax does not depend on their common scale.
+    for band, weight in enumerate(band_weights):
+        if weight != 1.0:
+            probs[band] *= weight
+    prediction = np.argmax(probs, axis=0).astype(np.uint8)
+    return remap_classes(prediction, band_mapping, fill_value=ignore_value, dtype=np.uint8)
+
+
+def read_probability_block(source: RasterSource, window: Window) -> np.ndarray:
+    if isinstance(source, RasterData):
+        return source.bands[(slice(None), *window.toslices())].astype(np.float32)
+    # Each block opens the raster again, so worker threads never share a dataset.
+    with rasterio.open(source) as src:
+        return src.read(window=window).astype(np.float32, copy=False)
+
+
+def reweighted_blocks(
+    source: RasterSource,
+    weights: dict[int, float],
+    mapping: dict[int, int],
+    ignore_value: int,
+    *,
+    block_size: int,
+    workers: int = 1,
+) -> Iterator[tuple[Window, np.ndarray]]:
+    if isinstance(source, RasterData):
+        _, height, width = source.bands.shape
+    else:
+        with rasterio.open(source) as src:
+            height, width = src.height, src.width
+    band_weights, band_mapping = _band_plan(source_bands(source), weights, mapping)
+    windows = [
+        Window(0, top, width, min(block_size, height - top)) for top in range(0, height, block_size)
+    ]
+
+    def process(window: Window) -> np.ndarray:
+        probs = read_probability_block(source, window)
+        return reweight_block(probs, band_weights, band_mapping, ignore_value)
+
+    if workers == 1:
+        for window in windows:
+            yield window, process(window)
+        return
+
+    # At most `workers` blocks are in flight, which bounds memory to that many band stacks.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending: deque[Future[np.ndarray]] = deque()
+        try:
+            for index, window in enumerate(windows):
+                pending.extend(
+                    executor.submit(process, windows[ahead])
+                    for ahead in range(index + len(pending), min(index + workers, len(windows)))
+                )
+                yield window, pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _output_meta(source: RasterSource, ignore_value: int) -> dict:
+    if isinstance(source, RasterData):
+        meta = source.file_profile()
+    else:
+        with rasterio.open(source) as src:
+            meta = src.meta.copy()
+    meta.update(count=1, dtype="uint8", nodata=ignore_value)
+    return meta
+
+
+def reweight_probabilities(
+    source: RasterSource,
+    weights: dict[int, float],
+    mapping: dict[int, int],
+    ignore_value: int,
+    *,
+    block_size: int | None = None,
+    workers: int = 1,
+) -> RasterData:
+    meta = _output_meta(source, ignore_value)
+    if block_size is None:
+        band_weights, band_mapping = _band_plan(source_bands(source), weights, mapping)
+        with open_raster(source) as src:
+            probs = src.read().astype(np.float32, copy=False)
+        return RasterData(reweight_block(probs, band_weights, band_mapping, ignore_value), meta)
+
+    filtered = np.empty((meta["height"], meta["width"]), dtype=np.uint8)
+    blocks = reweighted_blocks(
+        source, weights, mapping, ignore_value, block_size=block_size, workers=workers
+    )
+    for window, block in blocks:
+        filtered[window.toslices()] = block
+    return RasterData(filtered, meta)
+
+
 def reweight_and_filter(
     input_tif: Path,
     output_tif: Path,
@@ -52,6 +192,9 @@ def reweight_and_filter(
     mapping: dict[int, int] | None = None,
     ignore_value: int | None = None,
     matrix_config_path: Path = DEFAULT_MATRIX_CONFIG,
+    *,
+    block_size: int | None = None,
+    workers: int = 1,
 ) -> None:
     config_weights, config_mapping, config_ignore_value = load_reweight_config(
         resolve_matrix_config_path(matrix_config_path)
@@ -60,39 +203,33 @@ def reweight_and_filter(
     mapping = mapping or config_mapping
     ignore_value = config_ignore_value if ignore_value is None else int(ignore_value)
 
-    with rasterio.open(input_tif) as src:
-        probs = src.read().astype(np.float32)
-        meta = src.meta.copy()
-
-    missing_classes = [class_id for class_id in weights if class_id >= probs.shape[0]]
-    if missing_classes:
-        raise ValueError(
-            f"Weight(s) defined for missing class band(s): {missing_classes}. "
-            f"Input only contains {probs.shape[0]} band(s)."
+    if block_size is None:
+        write_raster(reweight_probabilities(input_tif, weights, mapping, ignore_value), output_tif)
+    else:
+        # Each block is written as soon as it is reweighted; only the in-flight band stacks are
+        # held in memory.
+        output_tif.parent.mkdir(parents=True, exist_ok=True)
+        blocks = reweighted_blocks(
+            input_tif, weights, mapping, ignore_value, block_size=block_size, workers=workers
         )
-
-    for class_id, weight in weights.items():
-        probs[class_id] *= weight
-
-    prediction = np.argmax(probs, axis=0).astype(np.uint8)
-    filtered = np.full(prediction.shape, ignore_value, dtype=np.uint8)
-    for original_class, mapped_class in mapping.items():
-        filtered[prediction == original_class] = mapped_class
-
-    meta.update(count=1, dtype="uint8", nodata=ignore_value)
-    output_tif.parent.mkdir(parents=True, exist_ok=True)
-    with rasterio.open(output_tif, "w", **meta) as dst:
-        dst.write(filtered, 1)
+        with rasterio.open(output_tif, "w", **_output_meta(input_tif, ignore_value)) as dst:
+            for window, block in blocks:
+                dst.write(block, 1, window=window)
 
     print(f"Saved reweighted raster to: {output_tif}")
 
 
 def main() -> None:
     args = parse_args()
+    validate_positive_number(args.workers, "workers")
+    if args.block_size is not None:
+        validate_positive_number(args.block_size, "block_size")
     reweight_and_filter(
         args.input,
         args.output,
         matrix_config_path=args.matrix_config,
+        block_size=args.block_size,
+        workers=args.workers,
     )
 
 
@@ -0,0 +1,351 @@
+from __future__ import annotations
+
+import argparse
+import math
+from collections.abc import Mapping
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import rasterio
+import yaml
+from rasterio.windows import Window
+
+from class_rasters import CLASS_NODATA
+from confusionMatrix import (
+    compute_metrics_from_confusion_matrix,
+    load_matrix_config,
+    overlap_windows,
+    read_reference_codes,
+    remap_classes,
+)
+from flair_probs_reweight import load_reweight_config, read_probability_block
+from probability_store import ProbabilityBands, probability_bands
+from raster_products import RasterData, RasterSource, open_raster
+from workflow_utils import validate_positive_number, write_json
+
+DEFAULT_MATRIX_CONFIG = Path("configs/baseline/configs.yml")
+DEFAULT_BLOCK_SIZE = 512
+# Largest probability overlap, in MiB, that the search keeps in memory.
+DEFAULT_MEMORY_LIMIT_MIB = 2048
+OBJECTIVES = ("mean_iou", "mean_dice", "mean_precision", "mean_recall")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Evaluate several FLAIR class weightings against a reference raster in one read of "
+            "the probabilities, and optionally search for better weights."
+        )
+    )
+    parser.add_argument(
+        "--input", "-i", type=Path, required=True, help="Input probability GeoTIFF or store"
+    )
+    parser.add_argument("--reference", type=Path, required=True)
+    parser.add_argument("--output", "-o", type=Path, required=True, help="Output JSON report")
+    parser.add_argument("--matrix-config", type=Path, default=DEFAULT_MATRIX_CONFIG)
+    parser.add_argument(
+        "--candidates",
+        type=Path,
+        default=None,
+        help="YAML file mapping candidate names to weights overriding flair.reweight.weights.",
+    )
+    parser.add_argument(
+        "--candidate-config",
+        type=Path,
+        action="append",
+        default=[],
+        help="Experiment configs.yml whose flair.reweight.weights is evaluated. Repeatable.",
+    )
+    parser.add_argument(
+        "--search",
+        action="store_true",
+        help="Run a coordinate search on the class weights, starting from the best candidate.",
+    )
+    parser.add_argument(
+        "--search-classes",
+        type=str,
+        default=None,
+        help="Comma-separated classes whose weight is searched. Default: flair.reweight.mapping.",
+    )
+    parser.add_argument("--objective", choices=OBJECTIVES, default="mean_iou")
+    parser.add_argument("--step", type=float, default=2.0, help="Initial weight factor.")
+    parser.add_argument("--min-step", type=float, default=1.05, help="Smallest weight factor.")
+    parser.add_argument("--max-rounds", type=int, default=30)
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE)
+    parser.add_argument(
+        "--memory-limit-mib",
+        type=int,
+        default=DEFAULT_MEMORY_LIMIT_MIB,
+        help=(
+            "Largest probability overlap kept in memory for --search; a larger one is read from "
+            "disk once per round. A probability store keeps it small."
+        ),
+    )
+    return parser.parse_args()
+
+
+def resolve_matrix_config_path(config_path: Path) -> Path:
+    if config_path.is_absolute():
+        return config_path
+    return Path(__file__).resolve().parent / config_path
+
+
+def load_candidates(path: Path) -> dict[str, dict[int, float]]:
+    with path.open("r", encoding="utf-8") as handle:
+        raw_candidates = yaml.safe_load(handle)
+    if not isinstance(raw_candidates, dict):
+        raise ValueError(f"Candidates must map names to class weights: {path}")
+    return {
+        str(name): {int(class_id): float(weight) for class_id, weight in weights.items()}
+        for name, weights in raw_candidates.items()
+    }
+
+
+def prediction_lut(
+    band_mapping: Mapping[int, int], band_count: int, ignore_value: int, evaluation_config: dict
+) -> np.ndarray:
+    # Winning band -> evaluation class, as the reweighted raster would be remapped by
+    # confusionMatrix. Unmapped bands and the ignore value end in the empty class.
+    empty_class_id = int(evaluation_config["empty_class_id"])
+    prediction_remap = {
+        int(source): int(target) for source, target in evaluation_config["prediction_remap"].items()
+    }
+    lut = np.full(band_count, empty_class_id, dtype=np.int64)
+    for band, target in band_mapping.items():
+        if target not in (ignore_value, CLASS_NODATA):
+            lut[band] = prediction_remap.get(target, empty_class_id)
+    return lut
+
+
+@dataclass(frozen=True)
+class SweepInputs:
+    probabilities: RasterSource
+    bands: ProbabilityBands
+    # Evaluation classes of the reference on `window` of the probability raster.
+    reference: np.ndarray
+    window: Window
+    lut: np.ndarray
+    config_weights: dict[int, float]
+    class_names: dict[int, str]
+
+
+def load_sweep_inputs(
+    probabilities: Path,
+    reference: RasterSource,
+    *,
+    matrix_config_path: Path = DEFAULT_MATRIX_CONFIG,
+    in_memory: bool = False,
+    memory_limit_mib: int = DEFAULT_MEMORY_LIMIT_MIB,
+) -> SweepInputs:
+    matrix_config_path = resolve_matrix_config_path(matrix_config_path)
+    config_weights, mapping, ignore_value = load_reweight_config(matrix_config_path)
+    evaluation_config = load_matrix_config(matrix_config_path)["evaluation"]
+    class_names = {
+        int(class_id): class_name
+        for class_id, class_name in evaluation_config["class_names"].items()
+    }
+    empty_class_id = int(evaluation_config["empty_class_id"])
+
+    with open_raster(reference) as reference_src, rasterio.open(probabilities) as probability_src:
+        bands = probability_bands(probability_src)
+        window, reference_window = overlap_windows(reference_src, probability_src)
+        reference_codes = read_reference_codes(
+            reference_src, probability_src, window, reference_window
+        )
+        source: RasterSource = probabilities
+        overlap_mib = (
+            probability_src.count
+            * int(window.width * window.height)
+            * np.dtype(probability_src.dtypes[0]).itemsize
+            / 2**20
+        )
+        if in_memory and overlap_mib > memory_limit_mib:
+            hint = (
+                "" if bands.is_store else " A probability store (probability_store.py) is smaller."
+            )
+            print(
+                f"The probability overlap takes {overlap_mib:.0f} MiB, more than the "
+                f"{memory_limit_mib} MiB limit, so it is read from disk for every pass.{hint}"
+            )
+        elif in_memory:
+            # Only the overlap is kept, in the stored data type.
+            source = RasterData(probability_src.read(window=window), {})
+            window = Window(0, 0, window.width, window.height)
+    reference_final = remap_classes(
+        reference_codes, evaluation_config["reference_remap"], empty_class_id
+    )
+    lut = prediction_lut(
+        bands.band_mapping(mapping), len(bands.class_ids), ignore_value, evaluation_config
+    )
+    return SweepInputs(source, bands, reference_final, window, lut, config_weights, class_names)
+
+
+def candidate_confusion_matrices(
+    inputs: SweepInputs,
+    candidates: Mapping[str, Mapping[int, float]],
+    *,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> dict[str, np.ndarray]:
+    band_weights = {
+        name: inputs.bands.band_weights({**inputs.config_weights, **weights})
+        for name, weights in candidates.items()
+    }
+    num_classes = len(inputs.class_names)
+    window = inputs.window
+    matrices = {name: np.zeros((num_classes, num_classes), dtype=np.int64) for name in candidates}
+    for top in range(0, int(window.height), block_size):
+        rows = min(block_size, int(window.height) - top)
+        block_window = Window(window.col_off, window.row_off + top, window.width, rows)
+        probs = read_probability_block(inputs.probabilities, block_window)
+        encoded_reference = inputs.reference[top : top + rows].astype(np.int64) * num_classes
+        weighted = np.empty_like(probs)
+        # Every candidate is evaluated on the block while it is in memory.
+        for name, weights in band_weights.items():
+            np.multiply(probs, weights[:, np.newaxis, np.newaxis], out=weighted)
+            encoded = encoded_reference + inputs.lut[np.argmax(weighted, axis=0)]
+            matrices[name] += np.bincount(
+                encoded.ravel(), minlength=num_classes * num_classes
+            ).reshape(num_classes, num_classes)
+    return matrices
+
+
+def evaluate_candidates(
+    inputs: SweepInputs,
+    candidates: Mapping[str, Mapping[int, float]],
+    *,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> list[dict[str, object]]:
+    matrices = candidate_confusion_matrices(inputs, candidates, block_size=block_size)
+    return [
+        {
+            "name": name,
+            "weights": dict(candidates[name]),
+            "confusion_matrix": matrices[name].tolist(),
+            **compute_metrics_from_confusion_matrix(matrices[name], inputs.class_names),
+        }
+        for name in candidates
+    ]
+
+
+def score(result: dict[str, object], objective: str) -> float:
+    value = result["summary"][objective]
+    return -math.inf if math.isnan(value) else value
+
+
+def search_weights(
+    inputs: SweepInputs,
+    start: Mapping[int, float],
+    classes: list[int],
+    *,
+    objective: str = "mean_iou",
+    step: float = 2.0,
+    min_step: float = 1.05,
+    max_rounds: int = 30,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> tuple[dict[str, object], list[dict[str, object]]]:
+    if step <= 1.0 or min_step <= 1.0:
+        raise ValueError("step and min_step must be greater than 1.")
+
+    # Each round multiplies and divides every searched weight by `step`, evaluating all the
+    # moves in one pass. The best move is taken; without improvement the step shrinks.
+    best = evaluate_candidates(inputs, {"start": dict(start)}, block_size=block_size)[0]
+    rounds: list[dict[str, object]] = []
+    while step >= min_step and len(rounds) < max_rounds:
+        candidates = {}
+        for class_id in classes:
+            for factor in (step, 1.0 / step):
+                weights = dict(best["weights"])
+                weights[class_id] = round(weights.get(class_id, 1.0) * factor, 6)
+                candidates[f"{class_id}x{factor:.4g}"] = weights
+        results = evaluate_candidates(inputs, candidates, block_size=block_size)
+        challenger = max(results, key=lambda result: score(result, objective))
+        improved = score(challenger, objective) > score(best, objective)
+        rounds.append(
+            {
+                "step": step,
+                "move": challenger["name"],
+                objective: challenger["summary"][objective],
+                "improved": improved,
+            }
+        )
+        print(
+            f"Round {len(rounds)}: step {step:.4g}, best move {challenger['name']} "
+            f"{objective}={challenger['summary'][objective]:.4f}"
+            f"{'' if improved else ' (no improvement)'}"
+        )
+        if improved:
+            best = challenger
+        else:
+            step = math.sqrt(step)
+    return best, rounds
+
+
+def format_weights(weights: Mapping[int, float]) -> str:
+    lines = ["flair:", "  reweight:", "    weights:"]
+    lines.extend(f"      {class_id}: {weights[class_id]:g}" for class_id in sorted(weights))
+    return "\n".join(lines)
+
+
+def main() -> None:
+    args = parse_args()
+    validate_positive_number(args.block_size, "block_size")
+    validate_positive_number(args.max_rounds, "max_rounds")
+    validate_positive_number(args.memory_limit_mib, "memory_limit_mib")
+    matrix_config_path = resolve_matrix_config_path(args.matrix_config)
+    config_weights, mapping, _ = load_reweight_config(matrix_config_path)
+
+    candidates = {"config": config_weights}
+    for config_path in args.candidate_config:
+        candidates[config_path.parent.name] = load_reweight_config(
+            resolve_matrix_config_path(config_path)
+        )[0]
+    if args.candidates is not None:
+        candidates.update(load_candidates(args.candidates))
+
+    # The search goes through the probabilities once per round, so it keeps them in memory when
+    # they fit in --memory-limit-mib; a probability store keeps that small.
+    inputs = load_sweep_inputs(
+        args.input,
+        args.reference,
+        matrix_config_path=matrix_config_path,
+        in_memory=args.search,
+        memory_limit_mib=args.memory_limit_mib,
+    )
+    results = evaluate_candidates(inputs, candidates, block_size=args.block_size)
+    print(f"{'Candidate':<30}" + "".join(f"{objective:>16}" for objective in OBJECTIVES))
+    for result in results:
+        print(
+            f"{result['name']:<30}"
+            + "".join(f"{result['summary'][objective]:>16.4f}" for objective in OBJECTIVES)
+        )
+    report: dict[str, object] = {"objective": args.objective, "candidates": results}
+
+    if args.search:
+        start = max(results, key=lambda result: score(result, args.objective))
+        classes = (
+            [int(class_id) for class_id in args.search_classes.split(",") if class_id.strip()]
+            if args.search_classes
+            else sorted(mapping)
+        )
+        best, rounds = search_weights(
+            inputs,
+            {**config_weights, **start["weights"]},
+            classes,
+            objective=args.objective,
+            step=args.step,
+            min_step=args.min_step,
+            max_rounds=args.max_rounds,
+            block_size=args.block_size,
+        )
+        report["search"] = {"start": start["name"], "rounds": rounds, "best": best}
+        print(f"\nBest {args.objective}: {best['summary'][args.objective]:.4f}")
+        print(format_weights(best["weights"]))
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    write_json(report, args.output)
+    print(f"Saved weight search report to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
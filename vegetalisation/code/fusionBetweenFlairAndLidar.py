@@ -1,12 +1,18 @@
 from __future__ import annotations
 
 import argparse
+from dataclasses import replace
 from pathlib import Path
 
 import numpy as np
-import rasterio
 
-from workflow_utils import align_array_to_shape
+from class_rasters import CLASS_DTYPE, CLASS_NODATA, class_profile, read_class_codes
+from classification_kernels import remap_classes
+from raster_alignment import dataset_grid
+from raster_products import RasterData, RasterSource, open_raster, write_raster
+
+LIDAR_CLASS_MAPPING = {1: 1, 2: 1, 3: 2, 4: 3}
+FLAIR_CLASS_MAPPING = {0: 0, 1: 1, 2: 2, 3: 3}
 
 
 def parse_args() -> argparse.Namespace:
@@ -26,12 +32,28 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
-def pad_to_match(arr: np.ndarray, target_shape: tuple[int, int]) -> np.ndarray:
-    return align_array_to_shape(arr, target_shape, fill_value=np.nan, allow_crop=False)
-
-
-def pad_or_crop_to_size(arr: np.ndarray, target_shape: tuple[int, int]) -> np.ndarray:
-    return align_array_to_shape(arr, target_shape, fill_value=np.nan, allow_crop=True)
+def fuse_class_sources(
+    lidar_raster: RasterSource,
+    flair_raster: RasterSource,
+    target_size: tuple[int, int] | None = None,
+) -> RasterData:
+    with open_raster(lidar_raster) as src1, open_raster(flair_raster) as src2:
+        # Both rasters are read onto the LiDAR pixel grid, extended or cropped from its top-left
+        # corner to target_size.
+        grid = dataset_grid(src1)
+        if target_size is not None:
+            grid = replace(grid, height=target_size[0], width=target_size[1])
+        lidar = read_class_codes(src1, grid)
+        flair = read_class_codes(src2, grid)
+        profile = class_profile(src1.profile)
+
+    options = {"fill_value": CLASS_NODATA, "dtype": CLASS_DTYPE}
+    lidar_reclass = remap_classes(lidar, LIDAR_CLASS_MAPPING, **options)
+    fused = remap_classes(flair, FLAIR_CLASS_MAPPING, **options)
+    np.copyto(fused, lidar_reclass, where=lidar_reclass != CLASS_NODATA)
+
+    profile.update(grid.profile())
+    return RasterData(fused, profile)
 
 
 def fusion_classes(
@@ -40,37 +62,8 @@ def fusion_classes(
     output_path: Path,
     target_size: tuple[int, int] | None = None,
 ) -> None:
-    with rasterio.open(lidar_raster_path) as src1, rasterio.open(flair_raster_path) as src2:
-        lidar = src1.read(1).astype(np.float32)
-        flair = src2.read(1).astype(np.float32)
-        profile = src1.profile.copy()
-
-    if lidar.shape != flair.shape:
-        flair = pad_to_match(flair, lidar.shape)
-
-    lidar_reclass = np.full_like(lidar, np.nan)
-    lidar_reclass[np.isin(lidar, [1, 2])] = 1
-    lidar_reclass[lidar == 3] = 2
-    lidar_reclass[lidar == 4] = 3
-
-    flair_reclass = np.full_like(flair, np.nan)
-    flair_reclass[flair == 0] = 0
-    flair_reclass[flair == 1] = 1
-    flair_reclass[flair == 2] = 2
-    flair_reclass[flair == 3] = 3
-
-    fused = np.where(~np.isnan(lidar_reclass), lidar_reclass, flair_reclass)
-
-    if target_size is not None:
-        fused = pad_or_crop_to_size(fused, target_size)
-        profile.update(height=target_size[0], width=target_size[1])
-    else:
-        profile.update(height=fused.shape[0], width=fused.shape[1])
-
-    profile.update(dtype="float32", count=1, nodata=np.nan, compress="lzw")
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    with rasterio.open(output_path, "w", **profile) as dst:
-        dst.write(fused.astype(np.float32), 1)
+    fused = fuse_class_sources(lidar_raster_path, flair_raster_path, target_size)
+    write_raster(fused, output_path)
 
     print(f"Saved fused raster to: {output_path}")
 
@@ -1,16 +1,24 @@
 from __future__ import annotations
 
 import argparse
+from contextlib import ExitStack
 from pathlib import Path
 
 import numpy as np
 import rasterio
 import yaml
+from rasterio.io import DatasetReader
+from rasterio.windows import Window
 
-from workflow_utils import align_array_to_shape, max_shape
+import classification_kernels
+from class_rasters import CLASS_DTYPE, CLASS_NODATA, class_profile, to_class_codes
+from raster_alignment import common_grid, read_aligned
+from raster_products import RasterData, RasterSource, open_raster, write_raster
+from workflow_utils import validate_positive_number
 
 DEFAULT_MATRIX_CONFIG = Path("configs/baseline/configs.yml")
 VALID_OUTPUT_CLASSES = (0, 1, 2)
+OUTPUT_NAMES = ("vegetation_map.tif", "second_remapped.tif", "final_fused.tif")
 
 
 def parse_args() -> argparse.Namespace:
@@ -33,30 +41,20 @@ def parse_args() -> argparse.Namespace:
         default=None,
         help="Only use Flair where LiDAR is invalid and Flair predicts class 0.",
     )
-    return parser.parse_args()
-
-
-def pad_to_match(arr: np.ndarray, target_shape: tuple[int, int]) -> np.ndarray:
-    return align_array_to_shape(
-        arr,
-        target_shape,
-        fill_value=np.nan if np.issubdtype(arr.dtype, np.floating) else 255,
-        allow_crop=False,
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=None,
+        help=(
+            "Fuse the rasters in full-width blocks of this many rows instead of loading them "
+            "whole. The outputs are identical."
+        ),
     )
+    return parser.parse_args()
 
 
-def load_tif(path: Path) -> tuple[np.ndarray, dict]:
-    with rasterio.open(path) as dataset:
-        return dataset.read(1), dataset.profile.copy()
-
-
-def save_tif(path: Path, arr: np.ndarray, profile: dict) -> None:
-    output = arr.astype(np.float32)
-    updated_profile = profile.copy()
-    updated_profile.update(dtype="float32", count=1, nodata=np.nan, compress="lzw")
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with rasterio.open(path, "w", **updated_profile) as dst:
-        dst.write(output, 1)
+def padding_value(dtype: str) -> float | int:
+    return np.nan if np.issubdtype(np.dtype(dtype), np.floating) else CLASS_NODATA
 
 
 def load_matrix_config(config_path: Path) -> dict:
@@ -94,12 +92,14 @@ def classify_heights(
     low_threshold = float(thresholds["low_to_medium"])
     medium_threshold = float(thresholds["medium_to_high"])
 
-    out[keep_mask & (height_map < low_threshold)] = 0
-    out[
-        keep_mask & (height_map >= low_threshold) & (height_map < medium_threshold)
-    ] = 1
-    out[keep_mask & (height_map >= medium_threshold)] = 2
-    return out
+    return classification_kernels.classify_thresholds(
+        height_map,
+        (low_threshold, medium_threshold),
+        (0, 1, 2),
+        fill_value=CLASS_NODATA,
+        where=keep_mask,
+        out=out,
+    )
 
 
 def create_vegetation_map(
@@ -120,22 +120,20 @@ def create_vegetation_map(
     )
     keep_mask = keep_vegetation | keep_class1 if keep_class_lidar1 else keep_vegetation
 
-    out_lidar = np.full(class_lidar_map.shape, np.nan, dtype=np.float32)
+    out_lidar = np.empty(class_lidar_map.shape, dtype=CLASS_DTYPE)
     classify_heights(out_lidar, keep_mask, height_lidar_map, lidar_config["height_thresholds"])
 
     if not modify_flair:
-        return out_lidar, flair_vege.astype(np.float32)
+        return out_lidar, to_class_codes(flair_vege)
 
     keep_flair = vege_mask != flair_config["mask_excluded_value"]
-    out_flair = np.full(flair_vege.shape, np.nan, dtype=np.float32)
+    out_flair = np.empty(flair_vege.shape, dtype=CLASS_DTYPE)
     classify_heights(out_flair, keep_flair, height_lidar_map, flair_config["height_thresholds"])
     return out_lidar, out_flair
 
 
 def remap_classes(arr: np.ndarray) -> np.ndarray:
-    out = arr.copy()
-    out[out == 3] = 2
-    return out
+    return classification_kernels.remap_classes(arr, {3: 2}, keep_unmapped=True, dtype=arr.dtype)
 
 
 def fuse_maps(
@@ -150,53 +148,136 @@ def fuse_maps(
     return out
 
 
-def validate_shapes(arrays: list[np.ndarray]) -> tuple[int, int]:
-    return max_shape(arrays)
-
-
-def main() -> None:
-    args = parse_args()
-    args.out_dir.mkdir(parents=True, exist_ok=True)
-
-    config_path = args.matrix_config
-    if not config_path.is_absolute():
-        config_path = Path(__file__).resolve().parent / config_path
-    matrix_config = load_matrix_config(config_path)
-    modify_flair, keep_class_lidar1, flair_only_herbaceous = resolve_fusion_options(
-        matrix_config, args
-    )
-
-    class_map, profile = load_tif(args.class_map)
-    height_map, _ = load_tif(args.height_map)
-    veg_mask, _ = load_tif(args.veg_mask)
-    second_map, _ = load_tif(args.second_map)
-
-    target_shape = validate_shapes([class_map, height_map, veg_mask, second_map])
-    class_map = pad_to_match(class_map, target_shape)
-    height_map = pad_to_match(height_map, target_shape)
-    veg_mask = pad_to_match(veg_mask, target_shape)
-    second_map = pad_to_match(second_map, target_shape)
-
+def fuse_arrays(
+    class_map: np.ndarray,
+    height_map: np.ndarray,
+    veg_mask: np.ndarray,
+    second_map: np.ndarray,
+    *,
+    config: dict,
+    modify_flair: bool,
+    keep_class_lidar1: bool,
+    flair_only_herbaceous: bool,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     vegetation_map_lidar, vegetation_map_flair = create_vegetation_map(
         class_map,
         height_map,
         veg_mask,
         second_map,
-        config=matrix_config,
+        config=config,
         modify_flair=modify_flair,
         keep_class_lidar1=keep_class_lidar1,
     )
-    save_tif(args.out_dir / "vegetation_map.tif", vegetation_map_lidar, profile)
-
     remapped = remap_classes(vegetation_map_flair)
-    save_tif(args.out_dir / "second_remapped.tif", remapped, profile)
-
     fused = fuse_maps(
         vegetation_map_lidar,
         vegetation_map_flair,
         use_flair_everywhere=not flair_only_herbaceous,
     )
-    save_tif(args.out_dir / "final_fused.tif", fused, profile)
+    return vegetation_map_lidar, remapped, fused
+
+
+def open_inputs(
+    sources: tuple[RasterSource, ...], stack: ExitStack
+) -> tuple[list[DatasetReader], list[int]]:
+    # run_workflow passes the reweighted raster as both the vegetation mask and the second map;
+    # every distinct path or in-memory raster is opened and read only once.
+    keys = [source.resolve() if isinstance(source, Path) else id(source) for source in sources]
+    unique_keys = list(dict.fromkeys(keys))
+    indices = [unique_keys.index(key) for key in keys]
+    datasets = [stack.enter_context(open_raster(sources[keys.index(key)])) for key in unique_keys]
+    return datasets, indices
+
+
+def fuse_sources(
+    sources: tuple[RasterSource, RasterSource, RasterSource, RasterSource],
+    **options: object,
+) -> dict[str, RasterData]:
+    with ExitStack() as stack:
+        datasets, indices = open_inputs(sources, stack)
+        # The outputs cover every input on the class-map pixel grid.
+        grid = common_grid([datasets[index] for index in indices])
+        profile = class_profile(datasets[indices[0]].profile)
+        profile.update(grid.profile())
+        arrays = [
+            read_aligned(dataset, grid, fill_value=padding_value(dataset.dtypes[0]))
+            for dataset in datasets
+        ]
+
+    outputs = fuse_arrays(*(arrays[index] for index in indices), **options)
+    return {
+        name: RasterData(output, profile)
+        for name, output in zip(OUTPUT_NAMES, outputs, strict=True)
+    }
+
+
+def fuse_rasters(
+    paths: tuple[Path, Path, Path, Path],
+    out_dir: Path,
+    **options: object,
+) -> None:
+    for name, output in fuse_sources(paths, **options).items():
+        write_raster(output, out_dir / name)
+
+
+def fuse_rasters_blocks(
+    sources: tuple[RasterSource, RasterSource, RasterSource, RasterSource],
+    out_dir: Path,
+    *,
+    block_size: int,
+    names: tuple[str, ...] = OUTPUT_NAMES,
+    **options: object,
+) -> None:
+    with ExitStack() as stack:
+        datasets, indices = open_inputs(sources, stack)
+        # Same grid as the whole-raster mode.
+        grid = common_grid([datasets[index] for index in indices])
+        profile = class_profile(datasets[indices[0]].profile)
+        profile.update(grid.profile())
+
+        out_dir.mkdir(parents=True, exist_ok=True)
+        outputs = {
+            name: stack.enter_context(rasterio.open(out_dir / name, "w", **profile))
+            for name in names
+        }
+        for top in range(0, grid.height, block_size):
+            window = Window(0, top, grid.width, min(block_size, grid.height - top))
+            blocks = [
+                read_aligned(
+                    dataset, grid, fill_value=padding_value(dataset.dtypes[0]), window=window
+                )
+                for dataset in datasets
+            ]
+            results = fuse_arrays(*(blocks[index] for index in indices), **options)
+            for name, result in zip(OUTPUT_NAMES, results, strict=True):
+                if name in outputs:
+                    outputs[name].write(result, 1, window=window)
+
+
+def main() -> None:
+    args = parse_args()
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+
+    config_path = args.matrix_config
+    if not config_path.is_absolute():
+        config_path = Path(__file__).resolve().parent / config_path
+    matrix_config = load_matrix_config(config_path)
+    modify_flair, keep_class_lidar1, flair_only_herbaceous = resolve_fusion_options(
+        matrix_config, args
+    )
+    paths = (args.class_map, args.height_map, args.veg_mask, args.second_map)
+    options = {
+        "config": matrix_config,
+        "modify_flair": modify_flair,
+        "keep_class_lidar1": keep_class_lidar1,
+        "flair_only_herbaceous": flair_only_herbaceous,
+    }
+
+    if args.block_size is None:
+        fuse_rasters(paths, args.out_dir, **options)
+    else:
+        validate_positive_number(args.block_size, "block_size")
+        fuse_rasters_blocks(paths, args.out_dir, block_size=args.block_size, **options)
 
     print(f"Generated outputs in: {args.out_dir}")
 
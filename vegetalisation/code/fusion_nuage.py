@@ -1,31 +1,91 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
+import json
+import multiprocessing
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, replace
+from functools import lru_cache
 from pathlib import Path
 
 import laspy
 import numpy as np
 import rasterio
-from rasterio.transform import from_origin
-from tqdm import tqdm
 
-from workflow_utils import validate_positive_number
+from extract_nuage import DEFAULT_TILE_SIZE_METERS, load_tiles, tile_footprints
+from gap_filling import GAP_FILL_METHODS, fill_gaps
+from lidar_rasterization import (
+    CELL_STATISTICS,
+    GROUND_EXCLUDED_CLASSES,
+    PERCENTILE_SAMPLES,
+    CellStatistics,
+    HeightSketch,
+    RasterAccumulator,
+    RasterGrid,
+    statistics_dimensions,
+)
+from point_cloud_index import intersect_bounds, iter_points_in_bounds
+from workflow_utils import file_sha256, peak_rss_mib, validate_positive_number, write_json
 
-GROUND_EXCLUDED_CLASSES = frozenset({1, 3, 4, 5, 8})
 WATER_CLASS = 9
-NEIGHBOR_OFFSETS = (
-    (-1, -1),
-    (-1, 0),
-    (-1, 1),
-    (0, -1),
-    (0, 1),
-    (1, -1),
-    (1, 0),
-    (1, 1),
+LAZ_BACKENDS = ("auto", "parallel", "single")
+FINGERPRINT_CODE_FILES = (
+    "fusion_nuage.py",
+    "lidar_rasterization.py",
+    "gap_filling.py",
+    "point_cloud_index.py",
 )
-
-
-def parse_args() -> argparse.Namespace:
+DIMENSION_DECOMPRESSION = {
+    "x": laspy.DecompressionSelection.XY_RETURNS_CHANNEL,
+    "y": laspy.DecompressionSelection.XY_RETURNS_CHANNEL,
+    "return_number": laspy.DecompressionSelection.XY_RETURNS_CHANNEL,
+    "number_of_returns": laspy.DecompressionSelection.XY_RETURNS_CHANNEL,
+    "z": laspy.DecompressionSelection.Z,
+    "classification": laspy.DecompressionSelection.CLASSIFICATION,
+    "intensity": laspy.DecompressionSelection.INTENSITY,
+}
+
+
+def parse_statistics(value: str) -> tuple[str, ...]:
+    statistics = tuple(name.strip() for name in value.split(",") if name.strip())
+    unknown = [name for name in statistics if name not in CELL_STATISTICS]
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            f"Unknown statistics {', '.join(unknown)}; choose from {', '.join(CELL_STATISTICS)}."
+        )
+    return statistics
+
+
+def parse_percentiles(value: str) -> tuple[float, ...]:
+    try:
+        percentiles = tuple(float(item) for item in value.split(",") if item.strip())
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f"Invalid percentile list: {value!r}.") from error
+    if any(not 0 <= percentile <= 100 for percentile in percentiles):
+        raise argparse.ArgumentTypeError("Percentiles must be between 0 and 100.")
+    return tuple(dict.fromkeys(percentiles))
+
+
+def parse_resolutions(value: str) -> tuple[float, ...]:
+    try:
+        resolutions = tuple(float(item) for item in value.split(",") if item.strip())
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f"Invalid resolution list: {value!r}.") from error
+    if not resolutions:
+        raise argparse.ArgumentTypeError("At least one resolution is required.")
+    return tuple(dict.fromkeys(resolutions))
+
+
+def resolution_folder(folder: Path, resolution: float, resolutions: tuple[float, ...]) -> Path:
+    if len(resolutions) == 1:
+        return folder
+    return folder / f"res_{resolution:g}m"
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Generate LiDAR height, class, MNS, and MNT rasters from LAZ tiles."
     )
@@ -45,8 +105,271 @@ def parse_args() -> argparse.Namespace:
         type=Path,
         default=Path("lidar_data_processed/mns_mnt"),
     )
-    parser.add_argument("--resolution", type=float, default=1)
-    return parser.parse_args()
+    parser.add_argument(
+        "--statistics-folder",
+        type=Path,
+        default=Path("lidar_data_processed/statistics"),
+    )
+    parser.add_argument(
+        "--resolution",
+        type=parse_resolutions,
+        default=(1.0,),
+        help=(
+            "Output resolution in meters, or a comma-separated list such as 0.5,1,2. Several "
+            "resolutions are produced from one read of each tile and written to res_<value>m "
+            "subfolders of the output folders."
+        ),
+    )
+    parser.add_argument(
+        "--statistics",
+        type=parse_statistics,
+        default=(),
+        help=(
+            "Comma-separated per-cell statistics computed in the same pass over the points and "
+            f"written as one multi-band GeoTIFF per tile ({', '.join(CELL_STATISTICS)})."
+        ),
+    )
+    parser.add_argument(
+        "--height-percentiles",
+        type=parse_percentiles,
+        default=(),
+        help=(
+            "Comma-separated percentiles of the point heights above the MNT, such as 50,90,95, "
+            "added as height_p<value> bands to the statistics raster."
+        ),
+    )
+    parser.add_argument(
+        "--percentile-samples",
+        type=int,
+        default=PERCENTILE_SAMPLES,
+        help=(
+            "Heights kept per cell to estimate the percentiles. Cells with fewer points are "
+            "exact to the centimetre; memory grows by 2 bytes per sample and cell."
+        ),
+    )
+    parser.add_argument(
+        "--chunk-points",
+        type=int,
+        default=None,
+        help=(
+            "Stream each LAZ tile in chunks of this many points instead of loading it whole. "
+            "Peak memory is then bounded by the output grid plus one chunk."
+        ),
+    )
+    parser.add_argument(
+        "--gap-fill",
+        choices=GAP_FILL_METHODS,
+        default="mean",
+        help=(
+            "How empty MNS/MNT cells are filled: 'mean' propagates the mean of valid neighbors "
+            "inward, 'nearest' copies the nearest valid cell."
+        ),
+    )
+    parser.add_argument(
+        "--snap-to-grid",
+        action="store_true",
+        help=(
+            "Snap every tile to a global grid whose origin is a multiple of the resolution, "
+            "so adjacent tiles line up pixel for pixel."
+        ),
+    )
+    parser.add_argument(
+        "--tile-inventory",
+        type=Path,
+        default=None,
+        help=(
+            "Optional LAZ inventory JSON (nuage.json). When provided, each tile uses its "
+            "inventory footprint as raster extent and points outside it are dropped."
+        ),
+    )
+    parser.add_argument("--tile-size", type=float, default=DEFAULT_TILE_SIZE_METERS)
+    parser.add_argument(
+        "--bbox",
+        type=float,
+        nargs=4,
+        metavar=("XMIN", "YMIN", "XMAX", "YMAX"),
+        default=None,
+        help=(
+            "Only rasterize points inside this area. LAZ files get a block index sidecar on "
+            "the first pass so later runs only decode the blocks overlapping the area."
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes used to rasterize tiles in parallel.",
+    )
+    parser.add_argument(
+        "--laz-backend",
+        choices=LAZ_BACKENDS,
+        default="auto",
+        help=(
+            "LAZ decoder: 'parallel' decompresses point chunks on several threads, 'single' uses "
+            "one thread. 'auto' picks 'parallel' with one worker process and 'single' otherwise."
+        ),
+    )
+    return parser.parse_args(argv)
+
+
+@dataclass(frozen=True)
+class RasterizationOptions:
+    chunk_points: int | None = None
+    gap_fill: str = "mean"
+    snap_to_grid: bool = False
+    tile_footprints: dict[str, tuple[float, float, float, float]] | None = None
+    bbox: tuple[float, float, float, float] | None = None
+    statistics: tuple[str, ...] = ()
+    height_percentiles: tuple[float, ...] = ()
+    percentile_samples: int = PERCENTILE_SAMPLES
+    laz_backend: str = "parallel"
+
+
+@dataclass(frozen=True)
+class TileOutputs:
+    mns: Path
+    mnt: Path
+    classes: Path
+    height: Path
+    statistics: Path | None = None
+    fingerprint: Path | None = None
+
+    def exist(self) -> bool:
+        return (
+            self.height.exists()
+            and self.classes.exists()
+            and (self.statistics is None or self.statistics.exists())
+        )
+
+    def remove(self) -> None:
+        for path in (
+            self.mns,
+            self.mnt,
+            self.classes,
+            self.height,
+            self.statistics,
+            self.fingerprint,
+        ):
+            if path is not None:
+                path.unlink(missing_ok=True)
+
+
+def build_tile_outputs(
+    base_name: str,
+    *,
+    height_folder: Path,
+    class_folder: Path,
+    mns_mnt_folder: Path,
+    statistics_folder: Path | None = None,
+) -> TileOutputs:
+    return TileOutputs(
+        mns=mns_mnt_folder / f"{base_name}_mns.tif",
+        mnt=mns_mnt_folder / f"{base_name}_mnt.tif",
+        classes=class_folder / f"{base_name}_class.tif",
+        height=height_folder / f"{base_name}_height.tif",
+        statistics=(
+            statistics_folder / f"{base_name}_stats.tif" if statistics_folder is not None else None
+        ),
+        fingerprint=height_folder / f"{base_name}_fingerprint.json",
+    )
+
+
+@lru_cache(maxsize=1)
+def code_version() -> str:
+    digest = hashlib.sha256()
+    code_dir = Path(__file__).resolve().parent
+    for name in FINGERPRINT_CODE_FILES:
+        digest.update((code_dir / name).read_bytes())
+    return digest.hexdigest()
+
+
+def tile_parameters(
+    laz_path: Path,
+    resolution: float,
+    options: RasterizationOptions,
+) -> dict[str, object]:
+    extent = options.tile_footprints.get(laz_path.name) if options.tile_footprints else None
+    return {
+        "resolution": resolution,
+        "ground_excluded_classes": sorted(GROUND_EXCLUDED_CLASSES),
+        "gap_fill": options.gap_fill,
+        "snap_to_grid": options.snap_to_grid,
+        "extent": list(extent) if extent is not None else None,
+        "bbox": list(options.bbox) if options.bbox is not None else None,
+        "statistics": list(options.statistics),
+        "height_percentiles": list(options.height_percentiles),
+        "percentile_samples": options.percentile_samples,
+        # Streaming reads take the grid extent from the LAS header instead of the points.
+        "streaming": options.chunk_points is not None,
+        "code_version": code_version(),
+    }
+
+
+def source_fingerprint(
+    laz_path: Path,
+    previous: dict[str, object] | None = None,
+) -> dict[str, object]:
+    stat = laz_path.stat()
+    if (
+        previous is not None
+        and previous.get("size") == stat.st_size
+        and previous.get("mtime_ns") == stat.st_mtime_ns
+        and isinstance(previous.get("sha256"), str)
+    ):
+        sha256 = previous["sha256"]
+    else:
+        sha256 = file_sha256(laz_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+
+
+def read_fingerprint(path: Path) -> dict[str, object] | None:
+    try:
+        with path.open("r", encoding="utf-8") as handle:
+            data = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def write_tile_fingerprint(
+    laz_path: Path,
+    outputs: TileOutputs,
+    resolution: float,
+    options: RasterizationOptions,
+) -> None:
+    if outputs.fingerprint is None:
+        return
+    write_json(
+        {
+            "source": source_fingerprint(laz_path),
+            "parameters": tile_parameters(laz_path, resolution, options),
+        },
+        outputs.fingerprint,
+    )
+
+
+def outputs_up_to_date(
+    laz_path: Path,
+    outputs: TileOutputs,
+    resolution: float,
+    options: RasterizationOptions,
+) -> bool:
+    if not outputs.exist() or outputs.fingerprint is None:
+        return False
+    stored = read_fingerprint(outputs.fingerprint)
+    if stored is None or stored.get("parameters") != tile_parameters(laz_path, resolution, options):
+        return False
+    stored_source = stored.get("source")
+    if not isinstance(stored_source, dict):
+        return False
+
+    # The file is only hashed again when its size or mtime moved, e.g. after a new download.
+    current_source = source_fingerprint(laz_path, stored_source)
+    if current_source["sha256"] != stored_source.get("sha256"):
+        return False
+    if current_source != stored_source:
+        write_json({**stored, "source": current_source}, outputs.fingerprint)
+    return True
 
 
 def write_raster(
@@ -72,26 +395,36 @@ def write_raster(
         dst.write(array, 1)
 
 
-def _iter_valid_neighbors(
-    array: np.ndarray,
-    row_index: int,
-    column_index: int,
-) -> list[float]:
-    height, width = array.shape
-    neighbors: list[float] = []
-
-    for row_offset, column_offset in NEIGHBOR_OFFSETS:
-        neighbor_row = row_index + row_offset
-        neighbor_column = column_index + column_offset
-        if 0 <= neighbor_row < height and 0 <= neighbor_column < width:
-            neighbor_value = array[neighbor_row, neighbor_column]
-            if not np.isnan(neighbor_value):
-                neighbors.append(float(neighbor_value))
-
-    return neighbors
+def write_multiband_raster(
+    output_path: Path,
+    bands: np.ndarray,
+    descriptions: list[str],
+    crs: rasterio.crs.CRS | None,
+    transform: rasterio.Affine,
+) -> None:
+    with rasterio.open(
+        output_path,
+        "w",
+        driver="GTiff",
+        height=bands.shape[1],
+        width=bands.shape[2],
+        count=bands.shape[0],
+        dtype=bands.dtype,
+        crs=crs,
+        transform=transform,
+        nodata=np.nan,
+        compress="lzw",
+    ) as dst:
+        dst.write(bands)
+        for band_index, description in enumerate(descriptions, start=1):
+            dst.set_band_description(band_index, description)
 
 
-def clean_mnt_mns(input_array: np.ndarray, input_class: np.ndarray) -> np.ndarray:
+def clean_mnt_mns(
+    input_array: np.ndarray,
+    input_class: np.ndarray,
+    method: str = "mean",
+) -> np.ndarray:
     cleaned = input_array.astype(np.float32, copy=True)
     valid_values = cleaned[~np.isnan(cleaned)]
     if valid_values.size == 0:
@@ -99,76 +432,267 @@ def clean_mnt_mns(input_array: np.ndarray, input_class: np.ndarray) -> np.ndarra
 
     fallback_value = float(valid_values.min())
     cleaned[input_class == WATER_CLASS] = fallback_value
+    cleaned = fill_gaps(cleaned, method=method)
+    cleaned[np.isnan(cleaned)] = fallback_value
+    return cleaned
 
-    while True:
-        nan_positions = np.argwhere(np.isnan(cleaned))
-        if nan_positions.size == 0:
-            break
 
-        next_cleaned = cleaned.copy()
-        replaced_count = 0
-        for row_index, column_index in nan_positions:
-            neighbors = _iter_valid_neighbors(cleaned, row_index, column_index)
-            if neighbors:
-                next_cleaned[row_index, column_index] = np.float32(np.mean(neighbors))
-                replaced_count += 1
+@dataclass(frozen=True)
+class GridProducts:
+    grid: RasterGrid
+    accumulator: RasterAccumulator
+    statistics: CellStatistics | None = None
+    heights: HeightSketch | None = None
 
-        cleaned = next_cleaned
-        if replaced_count == 0:
-            break
 
-    cleaned[np.isnan(cleaned)] = fallback_value
-    return cleaned
+@dataclass(frozen=True)
+class RasterizedTile:
+    products: list[GridProducts]
+    crs: rasterio.crs.CRS | None
+    decoded_points: int
+    decode_seconds: float
 
 
-def create_mns_mnt_class(
+def decompression_selection(dimensions: Iterable[str]) -> laspy.DecompressionSelection:
+    selection = laspy.DecompressionSelection.base()
+    for name in dimensions:
+        selection |= DIMENSION_DECOMPRESSION.get(name, laspy.DecompressionSelection.all())
+    return selection
+
+
+def select_laz_backends(mode: str) -> tuple[laspy.LazBackend, ...]:
+    available = laspy.LazBackend.detect_available()
+    if mode == "parallel" and laspy.LazBackend.LazrsParallel in available:
+        return (laspy.LazBackend.LazrsParallel,)
+    single_threaded = tuple(
+        backend for backend in available if backend != laspy.LazBackend.LazrsParallel
+    )
+    return single_threaded or available
+
+
+def _accumulate_points(
+    products: list[GridProducts],
+    points: laspy.ScaleAwarePointRecord | laspy.LasData,
+    *,
+    crop_to_grid: bool = False,
+) -> None:
+    x = np.asarray(points.x)
+    y = np.asarray(points.y)
+    dimensions = {"z": np.asarray(points.z), "classification": np.asarray(points.classification)}
+    for product in products:
+        if product.statistics is not None:
+            for name in product.statistics.dimensions - dimensions.keys():
+                dimensions[name] = np.asarray(points[name])
+
+    for product in products:
+        grid_x, grid_y, grid_dimensions = x, y, dimensions
+        if crop_to_grid:
+            inside = product.grid.contains(x, y)
+            grid_x, grid_y = x[inside], y[inside]
+            grid_dimensions = {name: values[inside] for name, values in dimensions.items()}
+        x_indices, y_indices = product.grid.cell_indices(grid_x, grid_y)
+        product.accumulator.update(
+            x_indices, y_indices, grid_dimensions["z"], grid_dimensions["classification"]
+        )
+        if product.statistics is not None:
+            product.statistics.update(x_indices, y_indices, grid_dimensions)
+        if product.heights is not None:
+            product.heights.update(x_indices, y_indices, grid_dimensions["z"])
+
+
+def laz_overlaps(path_in: Path, bbox: tuple[float, float, float, float]) -> bool:
+    try:
+        with laspy.open(path_in) as reader:
+            header_bounds = (*reader.header.mins[:2], *reader.header.maxs[:2])
+    except (OSError, laspy.LaspyException):
+        # Unreadable tiles are kept so the rasterization stage reports them as failures.
+        return True
+    return intersect_bounds(header_bounds, bbox) is not None
+
+
+def rasterize_laz(
     path_in: Path,
-    resolution: float,
-    out_mns: Path,
-    out_mnt: Path,
-    out_class: Path,
+    resolutions: tuple[float, ...],
+    *,
+    chunk_points: int | None = None,
+    snap_to_grid: bool = False,
+    extent: tuple[float, float, float, float] | None = None,
+    bbox: tuple[float, float, float, float] | None = None,
+    statistics: tuple[str, ...] = (),
+    height_percentiles: tuple[float, ...] = (),
+    percentile_samples: int = PERCENTILE_SAMPLES,
+    laz_backend: str = "parallel",
+) -> RasterizedTile:
+    def build_products(
+        bounds: tuple[float, float, float, float], zmin: float
+    ) -> list[GridProducts]:
+        products = []
+        for resolution in resolutions:
+            grid = RasterGrid.from_bounds(*bounds, resolution, snap=snap_to_grid)
+            products.append(
+                GridProducts(
+                    grid,
+                    RasterAccumulator(grid.shape, ground_excluded_classes=GROUND_EXCLUDED_CLASSES),
+                    CellStatistics(grid.shape, statistics, resolution=resolution)
+                    if statistics
+                    else None,
+                    HeightSketch(grid.shape, capacity=percentile_samples, z_origin=zmin)
+                    if height_percentiles
+                    else None,
+                )
+            )
+        return products
+
+    def accumulate_chunks(
+        products: list[GridProducts],
+        chunks: Iterator[laspy.ScaleAwarePointRecord],
+        *,
+        crop_to_grid: bool,
+    ) -> tuple[int, float]:
+        decoded_points = 0
+        decode_seconds = 0.0
+        while True:
+            decode_start = time.perf_counter()
+            points = next(chunks, None)
+            decode_seconds += time.perf_counter() - decode_start
+            if points is None:
+                return decoded_points, decode_seconds
+            decoded_points += len(points)
+            _accumulate_points(products, points, crop_to_grid=crop_to_grid)
+
+    # Every requested resolution is accumulated from the same decoded points, so extra grids
+    # only cost their scatter updates, not another pass over the LAZ file.
+    # Only the dimensions used by the requested products are decompressed; the others stay
+    # zero-filled in the returned points.
+    dimensions = {"x", "y", "z", "classification"} | statistics_dimensions(statistics)
+    reader_options = {
+        "laz_backend": select_laz_backends(laz_backend),
+        "decompression_selection": decompression_selection(dimensions),
+    }
+
+    if bbox is not None:
+        # Only the blocks overlapping the area are decoded once the block index of the LAZ file
+        # has been built by a previous pass.
+        with laspy.open(path_in) as reader:
+            header_bounds = (*reader.header.mins[:2], *reader.header.maxs[:2])
+            zmin = reader.header.mins[2]
+            crs = reader.header.parse_crs()
+        area = intersect_bounds(extent or header_bounds, bbox)
+        if area is None:
+            raise ValueError(f"{path_in.name} does not overlap the requested bbox.")
+        products = build_products(area, zmin)
+        read_bounds = (
+            min(product.grid.xmin for product in products),
+            min(product.grid.ymin for product in products),
+            max(product.grid.xmax for product in products),
+            max(product.grid.ymax for product in products),
+        )
+        decoded_points, decode_seconds = accumulate_chunks(
+            products,
+            iter_points_in_bounds(path_in, read_bounds, **reader_options),
+            crop_to_grid=True,
+        )
+    elif chunk_points is None:
+        decode_start = time.perf_counter()
+        las = laspy.read(path_in, **reader_options)
+        decode_seconds = time.perf_counter() - decode_start
+        decoded_points = len(las.points)
+        x = las.x
+        y = las.y
+        products = build_products(extent or (x.min(), y.min(), x.max(), y.max()), las.z.min())
+        _accumulate_points(products, las, crop_to_grid=extent is not None)
+        crs = las.header.parse_crs()
+    else:
+        # Streaming mode cannot scan the points before allocating the grid, so the extent
+        # comes from the LAS header bounds.
+        with laspy.open(path_in, **reader_options) as reader:
+            xmin, ymin, zmin = reader.header.mins
+            xmax, ymax, _ = reader.header.maxs
+            products = build_products(extent or (xmin, ymin, xmax, ymax), zmin)
+            decoded_points, decode_seconds = accumulate_chunks(
+                products,
+                reader.chunk_iterator(chunk_points),
+                crop_to_grid=extent is not None,
+            )
+            crs = reader.header.parse_crs()
+
+    return RasterizedTile(products, crs, decoded_points, decode_seconds)
+
+
+def write_grid_products(
+    product: GridProducts,
+    outputs: TileOutputs,
+    crs: rasterio.crs.CRS | None,
+    *,
+    gap_fill: str = "mean",
+    height_percentiles: tuple[float, ...] = (),
 ) -> None:
-    las = laspy.read(path_in)
-    x = las.x
-    y = las.y
-    z = las.z
-    classes = las.classification
-
-    xmin, ymin = x.min(), y.min()
-    xmax, ymax = x.max(), y.max()
-    width = int(np.ceil((xmax - xmin) / resolution))
-    height = int(np.ceil((ymax - ymin) / resolution))
-    transform = from_origin(xmin, ymax, resolution, resolution)
-
-    mns = np.full((height, width), np.nan, dtype=np.float32)
-    mnt = np.full((height, width), np.nan, dtype=np.float32)
-    class_raster = np.full((height, width), -1, dtype=np.int16)
-
-    x_indices = ((x - xmin) / resolution).astype(int)
-    y_indices = ((ymax - y) / resolution).astype(int)
-
-    x_indices = np.clip(x_indices, 0, width - 1)
-    y_indices = np.clip(y_indices, 0, height - 1)
-
-    for x_index, y_index, z_value, class_value in tqdm(
-        zip(x_indices, y_indices, z, classes, strict=True),
-        total=len(z),
-        desc=f"Processing {path_in.name}",
-    ):
-        if (
-            (np.isnan(mnt[y_index, x_index]) or z_value < mnt[y_index, x_index])
-            and class_value not in GROUND_EXCLUDED_CLASSES
-        ):
-            mnt[y_index, x_index] = z_value
+    accumulator = product.accumulator
+    transform = product.grid.transform
+    class_raster = accumulator.class_raster
+    mns = clean_mnt_mns(accumulator.mns, class_raster, method=gap_fill)
+    mnt = clean_mnt_mns(accumulator.mnt, class_raster, method=gap_fill)
+    write_raster(outputs.mns, mns, crs, transform, nodata=np.nan)
+    write_raster(outputs.mnt, mnt, crs, transform, nodata=np.nan)
+    write_raster(outputs.classes, class_raster, crs, transform, nodata=-1)
+    if outputs.statistics is None:
+        return
+    bands: list[np.ndarray] = []
+    descriptions: list[str] = []
+    if product.statistics is not None:
+        statistics_bands, descriptions = product.statistics.bands()
+        bands.append(statistics_bands)
+    if product.heights is not None and height_percentiles:
+        # Percentiles of z minus the cell's ground level are the percentiles of the heights
+        # above ground, so the sketch can keep raw z while the MNT is still being built.
+        bands.append(product.heights.percentiles(height_percentiles, mnt))
+        descriptions.extend(f"height_p{percentile:g}" for percentile in height_percentiles)
+    if bands:
+        write_multiband_raster(
+            outputs.statistics, np.concatenate(bands), descriptions, crs, transform
+        )
 
-        if np.isnan(mns[y_index, x_index]) or z_value > mns[y_index, x_index]:
-            mns[y_index, x_index] = z_value
-            class_raster[y_index, x_index] = class_value
 
-    crs = las.header.parse_crs()
-    write_raster(out_mns, clean_mnt_mns(mns, class_raster), crs, transform, nodata=np.nan)
-    write_raster(out_mnt, clean_mnt_mns(mnt, class_raster), crs, transform, nodata=np.nan)
-    write_raster(out_class, class_raster, crs, transform, nodata=-1)
+def create_mns_mnt_class(
+    path_in: Path,
+    outputs: dict[float, TileOutputs],
+    *,
+    chunk_points: int | None = None,
+    gap_fill: str = "mean",
+    snap_to_grid: bool = False,
+    extent: tuple[float, float, float, float] | None = None,
+    bbox: tuple[float, float, float, float] | None = None,
+    statistics: tuple[str, ...] = (),
+    height_percentiles: tuple[float, ...] = (),
+    percentile_samples: int = PERCENTILE_SAMPLES,
+    laz_backend: str = "parallel",
+) -> None:
+    tile = rasterize_laz(
+        path_in,
+        tuple(outputs),
+        chunk_points=chunk_points,
+        snap_to_grid=snap_to_grid,
+        extent=extent,
+        bbox=bbox,
+        statistics=statistics,
+        height_percentiles=height_percentiles,
+        percentile_samples=percentile_samples,
+        laz_backend=laz_backend,
+    )
+    throughput = tile.decoded_points / max(tile.decode_seconds, 1e-9) / 1e6
+    print(
+        f"Decoded {tile.decoded_points} point(s) from {path_in.name} in "
+        f"{tile.decode_seconds:.2f} s ({throughput:.2f} Mpoints/s)."
+    )
+    print(f"Rasterized {tile.products[0].accumulator.point_count} point(s) from {path_in.name}.")
+    for product, tile_outputs in zip(tile.products, outputs.values(), strict=True):
+        write_grid_products(
+            product,
+            tile_outputs,
+            tile.crs,
+            gap_fill=gap_fill,
+            height_percentiles=height_percentiles,
+        )
 
 
 def create_object_height_map(mnt_path: Path, mns_path: Path, out_path: Path) -> None:
@@ -196,34 +720,184 @@ def create_object_height_map(mnt_path: Path, mns_path: Path, out_path: Path) ->
         dst.write(height.astype(np.float32), 1)
 
 
-def main() -> None:
-    args = parse_args()
-    validate_positive_number(args.resolution, "resolution")
-    args.height_folder.mkdir(parents=True, exist_ok=True)
-    args.class_folder.mkdir(parents=True, exist_ok=True)
-    args.mns_mnt_folder.mkdir(parents=True, exist_ok=True)
+def process_tile(
+    laz_path: Path,
+    outputs: dict[float, TileOutputs],
+    options: RasterizationOptions,
+) -> float | None:
+    create_mns_mnt_class(
+        laz_path,
+        outputs,
+        chunk_points=options.chunk_points,
+        gap_fill=options.gap_fill,
+        snap_to_grid=options.snap_to_grid,
+        extent=options.tile_footprints.get(laz_path.name) if options.tile_footprints else None,
+        bbox=options.bbox,
+        statistics=options.statistics,
+        height_percentiles=options.height_percentiles,
+        percentile_samples=options.percentile_samples,
+        laz_backend=options.laz_backend,
+    )
+    for resolution, tile_outputs in outputs.items():
+        create_object_height_map(tile_outputs.mnt, tile_outputs.mns, tile_outputs.height)
+        write_tile_fingerprint(laz_path, tile_outputs, resolution, options)
+    return peak_rss_mib()
+
+
+def rasterize_tiles(
+    jobs: list[tuple[Path, dict[float, TileOutputs]]],
+    options: RasterizationOptions,
+    *,
+    workers: int = 1,
+) -> list[Path]:
+    failed: list[Path] = []
+    total = len(jobs)
+
+    def report(
+        index: int,
+        laz_path: Path,
+        outputs: dict[float, TileOutputs],
+        peak_rss: float | None,
+    ) -> None:
+        for tile_outputs in outputs.values():
+            print(f"[{index}/{total}] Generated height raster: {tile_outputs.height}")
+            print(f"[{index}/{total}] Generated class raster: {tile_outputs.classes}")
+            if tile_outputs.statistics is not None:
+                print(f"[{index}/{total}] Generated statistics raster: {tile_outputs.statistics}")
+        if peak_rss is not None:
+            print(f"Peak RSS after {laz_path.stem}: {peak_rss:.1f} MiB")
+
+    def record_failure(
+        index: int,
+        laz_path: Path,
+        outputs: dict[float, TileOutputs],
+        error: Exception,
+    ) -> None:
+        print(f"[{index}/{total}] Failed to rasterize {laz_path.name}: {error}")
+        for tile_outputs in outputs.values():
+            tile_outputs.remove()
+        failed.append(laz_path)
+
+    if workers == 1:
+        for index, (laz_path, outputs) in enumerate(jobs, start=1):
+            try:
+                peak_rss = process_tile(laz_path, outputs, options)
+            except Exception as error:
+                record_failure(index, laz_path, outputs, error)
+            else:
+                report(index, laz_path, outputs, peak_rss)
+        return failed
+
+    # Forked workers can deadlock on LAZ decoder state inherited from the parent process.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = {
+            executor.submit(process_tile, laz_path, outputs, options): (laz_path, outputs)
+            for laz_path, outputs in jobs
+        }
+        for index, future in enumerate(as_completed(futures), start=1):
+            laz_path, outputs = futures[future]
+            try:
+                peak_rss = future.result()
+            except Exception as error:
+                record_failure(index, laz_path, outputs, error)
+            else:
+                report(index, laz_path, outputs, peak_rss)
+    return sorted(failed)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    for resolution in args.resolution:
+        validate_positive_number(resolution, "resolution")
+    if args.chunk_points is not None:
+        validate_positive_number(args.chunk_points, "chunk_points")
+    validate_positive_number(args.workers, "workers")
+    output_folders = [args.height_folder, args.class_folder, args.mns_mnt_folder]
+    validate_positive_number(args.percentile_samples, "percentile_samples")
+    write_statistics = bool(args.statistics or args.height_percentiles)
+    if write_statistics:
+        output_folders.append(args.statistics_folder)
+    for resolution in args.resolution:
+        for folder in output_folders:
+            resolution_folder(folder, resolution, args.resolution).mkdir(
+                parents=True, exist_ok=True
+            )
 
     laz_files = sorted(args.laz_folder.glob("*.laz"))
     if not laz_files:
         raise FileNotFoundError(f"No LAZ file found in: {args.laz_folder}")
 
     print(f"{len(laz_files)} LAZ tile(s) found.")
+    bbox = None
+    if args.bbox is not None:
+        bbox = tuple(args.bbox)
+        if bbox[0] >= bbox[2] or bbox[1] >= bbox[3]:
+            raise ValueError("bbox must be XMIN YMIN XMAX YMAX with XMIN < XMAX and YMIN < YMAX.")
+        overlapping = [path for path in laz_files if laz_overlaps(path, bbox)]
+        print(f"{len(overlapping)} of {len(laz_files)} tile(s) overlap the requested bbox.")
+        laz_files = overlapping
+
+    footprints = None
+    if args.tile_inventory is not None:
+        validate_positive_number(args.tile_size, "tile_size")
+        footprints = tile_footprints(load_tiles(args.tile_inventory), args.tile_size)
+        missing = [path.name for path in laz_files if path.name not in footprints]
+        if missing:
+            print(f"No inventory footprint for {len(missing)} tile(s); using their point extent.")
+    options = RasterizationOptions(
+        chunk_points=args.chunk_points,
+        gap_fill=args.gap_fill,
+        snap_to_grid=args.snap_to_grid,
+        tile_footprints=footprints,
+        bbox=bbox,
+        statistics=args.statistics,
+        height_percentiles=args.height_percentiles,
+        percentile_samples=args.percentile_samples,
+    )
+
+    jobs: list[tuple[Path, dict[float, TileOutputs]]] = []
     for laz_path in laz_files:
-        base_name = laz_path.stem
-        out_mns = args.mns_mnt_folder / f"{base_name}_mns.tif"
-        out_mnt = args.mns_mnt_folder / f"{base_name}_mnt.tif"
-        out_class = args.class_folder / f"{base_name}_class.tif"
-        out_height = args.height_folder / f"{base_name}_height.tif"
-
-        if out_height.exists() and out_class.exists():
-            print(f"Skipping existing outputs for: {base_name}")
+        outputs = {
+            resolution: build_tile_outputs(
+                laz_path.stem,
+                height_folder=resolution_folder(args.height_folder, resolution, args.resolution),
+                class_folder=resolution_folder(args.class_folder, resolution, args.resolution),
+                mns_mnt_folder=resolution_folder(args.mns_mnt_folder, resolution, args.resolution),
+                statistics_folder=(
+                    resolution_folder(args.statistics_folder, resolution, args.resolution)
+                    if write_statistics
+                    else None
+                ),
+            )
+            for resolution in args.resolution
+        }
+        stale = {
+            resolution: tile_outputs
+            for resolution, tile_outputs in outputs.items()
+            if not outputs_up_to_date(laz_path, tile_outputs, resolution, options)
+        }
+        if not stale:
+            print(f"Skipping up-to-date outputs for: {laz_path.stem}")
             continue
-
-        create_mns_mnt_class(laz_path, args.resolution, out_mns, out_mnt, out_class)
-        create_object_height_map(out_mnt, out_mns, out_height)
-        print(f"Generated height raster: {out_height}")
-        print(f"Generated class raster: {out_class}")
-
+        jobs.append((laz_path, stale))
+
+    workers = min(args.workers, len(jobs)) if jobs else 1
+    laz_backend = args.laz_backend
+    if laz_backend == "auto":
+        # Parallel decoding inside several worker processes would oversubscribe the cores.
+        laz_backend = "parallel" if workers == 1 else "single"
+    options = replace(options, laz_backend=laz_backend)
+    if workers > 1:
+        print(f"Rasterizing {len(jobs)} tile(s) with {workers} worker processes.")
+    failed = rasterize_tiles(jobs, options, workers=workers)
+
+    if failed:
+        raise RuntimeError(
+            f"LiDAR raster generation failed for {len(failed)} of {len(jobs)} tile(s): "
+            + ", ".join(path.name for path in failed)
+            + ". Outputs of the other tiles were kept; rerun to retry the failed tiles."
+        )
     print("LiDAR raster generation completed.")
 
 
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import numpy as np
+
+GAP_FILL_METHODS = ("mean", "nearest")
+NEIGHBOR_OFFSETS = (
+    (-1, -1),
+    (-1, 0),
+    (-1, 1),
+    (0, -1),
+    (0, 1),
+    (1, -1),
+    (1, 0),
+    (1, 1),
+)
+
+
+def _neighbor_cells(cells: np.ndarray, shape: tuple[int, int]) -> tuple[np.ndarray, np.ndarray]:
+    height, width = shape
+    rows = cells // width
+    cols = cells % width
+    neighbors = np.empty((len(NEIGHBOR_OFFSETS), cells.size), dtype=np.int64)
+    inside = np.empty(neighbors.shape, dtype=bool)
+    for index, (row_offset, column_offset) in enumerate(NEIGHBOR_OFFSETS):
+        neighbor_rows = rows + row_offset
+        neighbor_cols = cols + column_offset
+        inside[index] = (
+            (neighbor_rows >= 0)
+            & (neighbor_rows < height)
+            & (neighbor_cols >= 0)
+            & (neighbor_cols < width)
+        )
+        neighbors[index] = neighbor_rows * width + neighbor_cols
+    neighbors[~inside] = 0
+    return neighbors, inside
+
+
+def _initial_frontier(valid: np.ndarray) -> np.ndarray:
+    padded = np.pad(valid, 1, constant_values=False)
+    height, width = valid.shape
+    touches_valid = np.zeros_like(valid)
+    for row_offset, column_offset in NEIGHBOR_OFFSETS:
+        touches_valid |= padded[
+            1 + row_offset : 1 + row_offset + height,
+            1 + column_offset : 1 + column_offset + width,
+        ]
+    return np.flatnonzero(~valid & touches_valid)
+
+
+def _neighbor_mean(neighbor_values: np.ndarray, neighbor_valid: np.ndarray) -> np.ndarray:
+    # Match np.mean over the list of valid neighbors bit for bit: it sums fewer than eight
+    # values left to right and a full set of eight values pairwise.
+    values = np.where(neighbor_valid, neighbor_values, 0.0)
+    counts = neighbor_valid.sum(axis=0)
+    sequential = np.zeros(values.shape[1], dtype=np.float64)
+    for row in values:
+        sequential += row
+    pairwise = ((values[0] + values[1]) + (values[2] + values[3])) + (
+        (values[4] + values[5]) + (values[6] + values[7])
+    )
+    sums = np.where(counts == len(NEIGHBOR_OFFSETS), pairwise, sequential)
+    return (sums / counts).astype(np.float32)
+
+
+def _nearest_neighbor(neighbor_values: np.ndarray, neighbor_valid: np.ndarray) -> np.ndarray:
+    first_valid = np.argmax(neighbor_valid, axis=0)
+    return neighbor_values[first_valid, np.arange(neighbor_values.shape[1])].astype(np.float32)
+
+
+def fill_gaps(array: np.ndarray, method: str = "mean") -> np.ndarray:
+    if method not in GAP_FILL_METHODS:
+        raise ValueError(f"method must be one of {GAP_FILL_METHODS}, got {method!r}.")
+    reduce_neighbors = _neighbor_mean if method == "mean" else _nearest_neighbor
+
+    filled = np.array(array, dtype=np.float32, copy=True)
+    flat = filled.reshape(-1)
+    frontier = _initial_frontier(~np.isnan(filled))
+
+    # Each pass fills the NaN cells touching a valid cell from the values of the previous
+    # pass, so the work only visits every gap pixel once instead of rescanning the raster.
+    while frontier.size:
+        neighbors, inside = _neighbor_cells(frontier, filled.shape)
+        neighbor_values = flat[neighbors].astype(np.float64)
+        neighbor_valid = inside & ~np.isnan(neighbor_values)
+        flat[frontier] = reduce_neighbors(neighbor_values, neighbor_valid)
+
+        candidates = neighbors[inside]
+        frontier = np.unique(candidates[np.isnan(flat[candidates])])
+
+    return filled
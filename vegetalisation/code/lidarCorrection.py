@@ -1,12 +1,20 @@
 from __future__ import annotations
 
 import argparse
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
 import rasterio
+from rasterio.windows import Window
 
-from workflow_utils import validate_odd_positive_integer
+from raster_products import RasterData, RasterSource, open_raster, write_raster
+from workflow_utils import validate_odd_positive_integer, validate_positive_number
+
+# Window values gathered at once while filling, which bounds the temporary arrays.
+FILL_BATCH_VALUES = 4_000_000
 
 
 def parse_args() -> argparse.Namespace:
@@ -25,26 +33,101 @@ def parse_args() -> argparse.Namespace:
         default=3,
         help="Odd-sized moving window used to fill NaN values.",
     )
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=None,
+        help=(
+            "Process the raster in full-width blocks of this many rows instead of loading it "
+            "whole. Results are identical; peak memory is bounded by the block size."
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Threads reading and writing blocks while the current block is filled.",
+    )
     return parser.parse_args()
 
 
+def _window_offsets(offset: int) -> tuple[list[tuple[int, int]], list[tuple[int, int]]]:
+    earlier = []
+    later = []
+    for row_offset in range(-offset, offset + 1):
+        for column_offset in range(-offset, offset + 1):
+            if (row_offset, column_offset) < (0, 0):
+                earlier.append((row_offset, column_offset))
+            elif (row_offset, column_offset) > (0, 0):
+                later.append((row_offset, column_offset))
+    return earlier, later
+
+
+def _fill_in_raster_order(filled: np.ndarray, fillable: np.ndarray, window_size: int) -> None:
+    # The historical loop fills NaN pixels in raster order, and a filled pixel counts as valid
+    # for the windows after it, while NaN pixels later in raster order are still empty. A pixel
+    # therefore depends on the NaN pixels before it in its window. Pixels are filled in waves:
+    # each wave takes every pixel whose earlier NaN neighbors are all final, so its window sum
+    # and valid count are the ones the loop saw. `fillable` pixels must lie at least
+    # window_size // 2 pixels away from the array edges.
+    offset = window_size // 2
+    rows, cols = filled.shape
+    earlier, later = _window_offsets(offset)
+    inside = (slice(offset, rows - offset), slice(offset, cols - offset))
+    gaps = np.isnan(filled)
+    pending = np.zeros(filled.shape, dtype=np.int32)
+    for row_offset, column_offset in earlier:
+        pending[inside] += fillable[
+            offset + row_offset : rows - offset + row_offset,
+            offset + column_offset : cols - offset + column_offset,
+        ]
+
+    flat = filled.reshape(-1)
+    gap_flat = gaps.reshape(-1)
+    pending_flat = pending.reshape(-1)
+    fillable_flat = fillable.reshape(-1)
+    earlier_steps = np.array([row * cols + column for row, column in earlier])
+    later_steps = np.array([row * cols + column for row, column in later])
+
+    batch_pixels = max(1, FILL_BATCH_VALUES // window_size**2)
+    ready = np.flatnonzero(fillable_flat & (pending_flat == 0))
+    while ready.size:
+        released_batches = []
+        for start in range(0, ready.size, batch_pixels):
+            batch = ready[start : start + batch_pixels]
+            earlier_values = flat[batch[:, None] + earlier_steps].astype(np.float64)
+            later_positions = batch[:, None] + later_steps
+            later_values = flat[later_positions].astype(np.float64)
+            # Later NaN pixels may already be filled by a previous wave; the loop had not
+            # reached them yet.
+            later_values[gap_flat[later_positions]] = np.nan
+            window = np.concatenate([earlier_values, later_values], axis=1)
+            valid = ~np.isnan(window)
+            sums = np.where(valid, window, 0.0).sum(axis=1)
+            counts = valid.sum(axis=1)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                flat[batch] = np.where(counts > 0, sums / counts, np.nan)
+            released_batches.append(later_positions[fillable_flat[later_positions]])
+
+        dependents, released = np.unique(np.concatenate(released_batches), return_counts=True)
+        pending_flat[dependents] -= released
+        ready = dependents[pending_flat[dependents] == 0]
+
+
 def fill_nan_with_neighbors(img: np.ndarray, window_size: int = 3) -> np.ndarray:
     validate_odd_positive_integer(window_size, "window_size")
 
     filled = img.copy()
     offset = window_size // 2
     rows, cols = img.shape
+    if offset == 0 or rows <= 2 * offset or cols <= 2 * offset:
+        return filled
 
-    for row in range(offset, rows - offset):
-        for col in range(offset, cols - offset):
-            if np.isnan(filled[row, col]):
-                window = filled[
-                    row - offset : row + offset + 1,
-                    col - offset : col + offset + 1,
-                ]
-                valid = window[~np.isnan(window)]
-                if valid.size > 0:
-                    filled[row, col] = float(np.mean(valid))
+    # Border pixels are never filled.
+    fillable = np.zeros(img.shape, dtype=bool)
+    inside = (slice(offset, rows - offset), slice(offset, cols - offset))
+    fillable[inside] = np.isnan(img[inside])
+    _fill_in_raster_order(filled, fillable, window_size)
     return filled
 
 
@@ -54,8 +137,94 @@ def replace_nan_by_zero(img: np.ndarray) -> np.ndarray:
     return output
 
 
-def process_raster(input_path: Path, output_path: Path, window_size: int = 3) -> None:
+def _read_rows(input_path: Path, first_row: int, last_row: int) -> np.ndarray:
     with rasterio.open(input_path) as src:
+        window = Window(0, first_row, src.width, last_row - first_row)
+        return src.read(1, window=window).astype(np.float32)
+
+
+def process_raster_blocks(
+    input_path: Path,
+    output_path: Path,
+    window_size: int = 3,
+    *,
+    block_size: int,
+    workers: int = 1,
+) -> None:
+    offset = window_size // 2
+    with rasterio.open(input_path) as src:
+        profile = src.profile.copy()
+        height, width = src.height, src.width
+    profile.update(dtype="float32", count=1, nodata=0, compress="lzw", BIGTIFF="IF_SAFER")
+
+    # Blocks span the full width: a NaN pixel depends on the pixels filled before it in raster
+    # order, which reach every column of the rows above, so only row blocks keep the historical
+    # results. Each block is read with the `offset` original rows below it and the last
+    # `offset` filled rows of the previous block above it.
+    blocks = [(top, min(top + block_size, height)) for top in range(0, height, block_size)]
+    in_place = output_path.resolve() == input_path.resolve()
+    target_path = output_path.with_name(output_path.name + ".tmp") if in_place else output_path
+
+    def read_block(index: int) -> np.ndarray:
+        top, bottom = blocks[index]
+        return _read_rows(input_path, top, min(bottom + offset, height))
+
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    reads: deque[Future[np.ndarray]] = deque()
+    pending_write: Future[None] | None = None
+    filled_above = np.empty((0, width), dtype=np.float32)
+    try:
+        with rasterio.open(target_path, "w", **profile) as dst:
+            if executor is not None:
+                # Up to `workers` blocks are read ahead while the current one is filled.
+                reads.extend(
+                    executor.submit(read_block, index) for index in range(min(workers, len(blocks)))
+                )
+            for index, (top, bottom) in enumerate(blocks):
+                if executor is None:
+                    rows = read_block(index)
+                else:
+                    rows = reads.popleft().result()
+                    if index + workers < len(blocks):
+                        reads.append(executor.submit(read_block, index + workers))
+
+                block = np.concatenate([filled_above, rows])
+                core = slice(filled_above.shape[0], filled_above.shape[0] + bottom - top)
+                fillable = np.zeros(block.shape, dtype=bool)
+                first_row = max(top, offset) - top + core.start
+                last_row = min(bottom, height - offset) - top + core.start
+                if offset > 0 and first_row < last_row and width > 2 * offset:
+                    fillable[first_row:last_row, offset : width - offset] = np.isnan(
+                        block[first_row:last_row, offset : width - offset]
+                    )
+                    _fill_in_raster_order(block, fillable, window_size)
+                filled_core = block[core]
+                filled_above = np.concatenate([filled_above, filled_core])[
+                    max(0, filled_above.shape[0] + filled_core.shape[0] - offset) :
+                ]
+
+                output = replace_nan_by_zero(filled_core)
+                window = Window(0, top, width, bottom - top)
+                if executor is None:
+                    dst.write(output, 1, window=window)
+                    continue
+                # One write in flight: a dataset must not be written from two threads.
+                if pending_write is not None:
+                    pending_write.result()
+                pending_write = executor.submit(dst.write, output, 1, window=window)
+            if pending_write is not None:
+                pending_write.result()
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    if in_place:
+        os.replace(target_path, output_path)
+    print(f"Saved corrected raster to: {output_path} ({len(blocks)} block(s))")
+
+
+def correct_raster(source: RasterSource, window_size: int = 3) -> RasterData:
+    with open_raster(source) as src:
         img = src.read(1).astype(np.float32)
         profile = src.profile.copy()
 
@@ -63,10 +232,14 @@ def process_raster(input_path: Path, output_path: Path, window_size: int = 3) ->
     img = replace_nan_by_zero(img)
 
     profile.update(dtype="float32", count=1, nodata=0, compress="lzw")
-    with rasterio.open(output_path, "w", **profile) as dst:
-        dst.write(img.astype(np.float32), 1)
+    return RasterData(img, profile)
 
-    remaining_nan = int(np.isnan(img).sum())
+
+def process_raster(input_path: Path, output_path: Path, window_size: int = 3) -> None:
+    corrected = correct_raster(input_path, window_size)
+    write_raster(corrected, output_path)
+
+    remaining_nan = int(np.isnan(corrected.array).sum())
     if remaining_nan == 0:
         print(f"Saved corrected raster to: {output_path}")
     else:
@@ -76,8 +249,19 @@ def process_raster(input_path: Path, output_path: Path, window_size: int = 3) ->
 def main() -> None:
     args = parse_args()
     validate_odd_positive_integer(args.window_size, "window_size")
+    validate_positive_number(args.workers, "workers")
     output_path = args.output or args.input
-    process_raster(args.input, output_path, window_size=args.window_size)
+    if args.block_size is None:
+        process_raster(args.input, output_path, window_size=args.window_size)
+        return
+    validate_positive_number(args.block_size, "block_size")
+    process_raster_blocks(
+        args.input,
+        output_path,
+        window_size=args.window_size,
+        block_size=args.block_size,
+        workers=args.workers,
+    )
 
 
 if __name__ == "__main__":
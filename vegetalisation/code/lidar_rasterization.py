@@ -0,0 +1,414 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+from rasterio import Affine
+from rasterio.transform import from_origin
+
+GROUND_EXCLUDED_CLASSES = frozenset({1, 3, 4, 5, 8})
+CELL_STATISTICS = (
+    "density",
+    "class_counts",
+    "intensity_mean",
+    "returns_mean",
+    "first_return_max",
+)
+COUNTED_CLASSES = (1, 2, 3, 4, 5, 6, 9)
+# Heights kept per cell for the percentile products. Cells with fewer points keep all of them
+# and their percentiles are exact to the centimetre. Each cell costs 2 bytes per sample plus a
+# 4-byte count, 36 bytes by default against 4 bytes for the MNS.
+PERCENTILE_SAMPLES = 16
+# Heights are stored as centimetres above the sketch origin; the largest value marks an empty
+# slot.
+HEIGHT_SCALE = 100.0
+EMPTY_HEIGHT = np.iinfo(np.uint16).max
+# Cells sorted at once when the percentiles are read, so the sort never copies the whole sketch.
+PERCENTILE_CHUNK_CELLS = 1 << 18
+
+
+def compute_grid_shape(
+    xmin: float,
+    ymin: float,
+    xmax: float,
+    ymax: float,
+    resolution: float,
+) -> tuple[int, int]:
+    width = int(np.ceil((xmax - xmin) / resolution))
+    height = int(np.ceil((ymax - ymin) / resolution))
+    return height, width
+
+
+def compute_cell_indices(
+    x: np.ndarray,
+    y: np.ndarray,
+    *,
+    xmin: float,
+    ymax: float,
+    resolution: float,
+    shape: tuple[int, int],
+) -> tuple[np.ndarray, np.ndarray]:
+    height, width = shape
+    x_indices = ((x - xmin) / resolution).astype(int)
+    y_indices = ((ymax - y) / resolution).astype(int)
+    x_indices = np.clip(x_indices, 0, width - 1)
+    y_indices = np.clip(y_indices, 0, height - 1)
+    return x_indices, y_indices
+
+
+@dataclass(frozen=True)
+class RasterGrid:
+    xmin: float
+    ymax: float
+    resolution: float
+    shape: tuple[int, int]
+
+    @classmethod
+    def from_bounds(
+        cls,
+        xmin: float,
+        ymin: float,
+        xmax: float,
+        ymax: float,
+        resolution: float,
+        *,
+        snap: bool = False,
+    ) -> RasterGrid:
+        if not snap:
+            shape = compute_grid_shape(xmin, ymin, xmax, ymax, resolution)
+            return cls(xmin, ymax, resolution, shape)
+
+        # Origins are whole multiples of the resolution, so every tile snapped this way lands on
+        # the same global grid and adjacent tiles differ by an integer number of pixels.
+        first_column = int(np.floor(xmin / resolution))
+        last_column = max(int(np.ceil(xmax / resolution)), first_column + 1)
+        bottom_row = int(np.floor(ymin / resolution))
+        top_row = max(int(np.ceil(ymax / resolution)), bottom_row + 1)
+        return cls(
+            first_column * resolution,
+            top_row * resolution,
+            resolution,
+            (top_row - bottom_row, last_column - first_column),
+        )
+
+    @property
+    def xmax(self) -> float:
+        return self.xmin + self.shape[1] * self.resolution
+
+    @property
+    def ymin(self) -> float:
+        return self.ymax - self.shape[0] * self.resolution
+
+    @property
+    def transform(self) -> Affine:
+        return from_origin(self.xmin, self.ymax, self.resolution, self.resolution)
+
+    def contains(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        return (x >= self.xmin) & (x <= self.xmax) & (y >= self.ymin) & (y <= self.ymax)
+
+    def cell_indices(self, x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        return compute_cell_indices(
+            x,
+            y,
+            xmin=self.xmin,
+            ymax=self.ymax,
+            resolution=self.resolution,
+            shape=self.shape,
+        )
+
+
+class RasterAccumulator:
+    def __init__(
+        self,
+        shape: tuple[int, int],
+        *,
+        ground_excluded_classes: frozenset[int] = GROUND_EXCLUDED_CLASSES,
+    ) -> None:
+        self.shape = shape
+        self.ground_excluded_classes = ground_excluded_classes
+        cell_count = shape[0] * shape[1]
+        self._mns = np.full(cell_count, np.nan, dtype=np.float32)
+        self._mnt = np.full(cell_count, np.nan, dtype=np.float32)
+        self._class = np.full(cell_count, -1, dtype=np.int16)
+        self.point_count = 0
+
+    @property
+    def mns(self) -> np.ndarray:
+        return self._mns.reshape(self.shape)
+
+    @property
+    def mnt(self) -> np.ndarray:
+        return self._mnt.reshape(self.shape)
+
+    @property
+    def class_raster(self) -> np.ndarray:
+        return self._class.reshape(self.shape)
+
+    def update(
+        self,
+        x_indices: np.ndarray,
+        y_indices: np.ndarray,
+        z: np.ndarray,
+        classes: np.ndarray,
+    ) -> None:
+        z = np.asarray(z, dtype=np.float64)
+        classes = np.asarray(classes)
+        if z.size == 0:
+            return
+        rows = np.asarray(y_indices, dtype=np.int64)
+        cells = rows * self.shape[1] + np.asarray(x_indices, dtype=np.int64)
+        self._update_mnt(cells, z, classes)
+        self._update_mns_and_class(cells, z, classes)
+        self.point_count += int(z.size)
+
+    # Only the cells touched by the chunk are reduced and updated, so a chunk costs memory and
+    # time in proportion to its points rather than to the grid.
+    def _update_mnt(self, cells: np.ndarray, z: np.ndarray, classes: np.ndarray) -> None:
+        ground = ~np.isin(classes, list(self.ground_excluded_classes))
+        if not ground.any():
+            return
+        touched, inverse = np.unique(cells[ground], return_inverse=True)
+        chunk_min = np.full(touched.size, np.inf, dtype=np.float64)
+        np.minimum.at(chunk_min, inverse, z[ground])
+        # Float32 rounding is monotonic, so the running minimum can be kept in float32.
+        self._mnt[touched] = np.fmin(self._mnt[touched], chunk_min)
+
+    def _update_mns_and_class(self, cells: np.ndarray, z: np.ndarray, classes: np.ndarray) -> None:
+        touched, inverse = np.unique(cells, return_inverse=True)
+        chunk_max = np.full(touched.size, -np.inf, dtype=np.float64)
+        np.maximum.at(chunk_max, inverse, z)
+        previous = self._mns[touched]
+        stored_max = np.fmax(previous, chunk_max).astype(np.float32)
+
+        # The historical per-point loop compared each float64 height with the float32 value
+        # already stored in the cell, so the class of the highest point is the one of the first
+        # point rounding to the cell maximum, unless a later point is strictly above that
+        # float32 value. The value kept from previous chunks acts as a point placed before the
+        # chunk (position -1), which keeps chunked and single-pass outputs bit-identical.
+        point_max = stored_max[inverse]
+        candidate_positions = np.flatnonzero(z.astype(np.float32) == point_max)
+        candidate_cells = inverse[candidate_positions]
+
+        first_candidate = np.full(touched.size, np.iinfo(np.int64).max, dtype=np.int64)
+        first_candidate[previous == stored_max] = -1
+        np.minimum.at(first_candidate, candidate_cells, candidate_positions)
+
+        above_stored = z[candidate_positions] > point_max[candidate_positions]
+        last_update = np.full(touched.size, -1, dtype=np.int64)
+        np.maximum.at(last_update, candidate_cells[above_stored], candidate_positions[above_stored])
+
+        winner = np.maximum(first_candidate, last_update)
+        from_chunk = ~np.isnan(stored_max) & (winner >= 0)
+        self._class[touched[from_chunk]] = classes[winner[from_chunk]]
+        self._mns[touched] = stored_max
+
+
+def statistics_dimensions(statistics: tuple[str, ...]) -> frozenset[str]:
+    needed = {"classification"} if "class_counts" in statistics else set()
+    if "intensity_mean" in statistics:
+        needed.add("intensity")
+    if "returns_mean" in statistics:
+        needed.add("number_of_returns")
+    if "first_return_max" in statistics:
+        needed.update({"z", "return_number"})
+    return frozenset(needed)
+
+
+class CellStatistics:
+    def __init__(
+        self,
+        shape: tuple[int, int],
+        statistics: tuple[str, ...],
+        *,
+        resolution: float,
+        counted_classes: tuple[int, ...] = COUNTED_CLASSES,
+    ) -> None:
+        unknown = [name for name in statistics if name not in CELL_STATISTICS]
+        if unknown:
+            raise ValueError(f"Unknown cell statistics {unknown}; expected {CELL_STATISTICS}.")
+        self.shape = shape
+        self.statistics = tuple(dict.fromkeys(statistics))
+        self.resolution = resolution
+        self.counted_classes = counted_classes
+        cell_count = shape[0] * shape[1]
+        # Only the accumulators of the requested statistics are allocated.
+        counted = {"density", "intensity_mean", "returns_mean"} & set(self.statistics)
+        self._count = np.zeros(cell_count, dtype=np.int64) if counted else None
+        self._class_counts = (
+            np.zeros((len(counted_classes), cell_count), dtype=np.int64)
+            if "class_counts" in self.statistics
+            else None
+        )
+        self._intensity_sum = (
+            np.zeros(cell_count, dtype=np.float64) if "intensity_mean" in self.statistics else None
+        )
+        self._returns_sum = (
+            np.zeros(cell_count, dtype=np.float64) if "returns_mean" in self.statistics else None
+        )
+        self._first_return_max = (
+            np.full(cell_count, np.nan, dtype=np.float32)
+            if "first_return_max" in self.statistics
+            else None
+        )
+
+    @property
+    def dimensions(self) -> frozenset[str]:
+        return statistics_dimensions(self.statistics)
+
+    def update(
+        self,
+        x_indices: np.ndarray,
+        y_indices: np.ndarray,
+        dimensions: dict[str, np.ndarray],
+    ) -> None:
+        cells = np.asarray(y_indices, dtype=np.int64) * self.shape[1] + np.asarray(
+            x_indices, dtype=np.int64
+        )
+        if cells.size == 0:
+            return
+        # As in RasterAccumulator, the chunk is reduced over the cells it touches only.
+        touched, inverse = np.unique(cells, return_inverse=True)
+        if self._count is not None:
+            self._count[touched] += np.bincount(inverse, minlength=touched.size)
+        if self._class_counts is not None:
+            classes = np.asarray(dimensions["classification"])
+            for band, class_code in enumerate(self.counted_classes):
+                selected = inverse[classes == class_code]
+                self._class_counts[band, touched] += np.bincount(selected, minlength=touched.size)
+        if self._intensity_sum is not None:
+            self._intensity_sum[touched] += np.bincount(
+                inverse,
+                weights=np.asarray(dimensions["intensity"], dtype=np.float64),
+                minlength=touched.size,
+            )
+        if self._returns_sum is not None:
+            self._returns_sum[touched] += np.bincount(
+                inverse,
+                weights=np.asarray(dimensions["number_of_returns"], dtype=np.float64),
+                minlength=touched.size,
+            )
+        if self._first_return_max is not None:
+            first = np.asarray(dimensions["return_number"]) == 1
+            chunk_max = np.full(touched.size, -np.inf, dtype=np.float64)
+            np.maximum.at(
+                chunk_max, inverse[first], np.asarray(dimensions["z"], dtype=np.float64)[first]
+            )
+            self._first_return_max[touched] = np.fmax(
+                self._first_return_max[touched], np.where(np.isinf(chunk_max), np.nan, chunk_max)
+            )
+
+    def bands(self) -> tuple[np.ndarray, list[str]]:
+        bands: list[np.ndarray] = []
+        descriptions: list[str] = []
+        empty = self._count == 0 if self._count is not None else None
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for name in self.statistics:
+                if name == "density":
+                    bands.append(self._count / self.resolution**2)
+                    descriptions.append("density")
+                elif name == "class_counts":
+                    bands.extend(self._class_counts)
+                    descriptions.extend(f"class_{code}_count" for code in self.counted_classes)
+                elif name == "intensity_mean":
+                    bands.append(np.where(empty, np.nan, self._intensity_sum / self._count))
+                    descriptions.append("intensity_mean")
+                elif name == "returns_mean":
+                    bands.append(np.where(empty, np.nan, self._returns_sum / self._count))
+                    descriptions.append("returns_mean")
+                else:
+                    bands.append(self._first_return_max)
+                    descriptions.append("first_return_max")
+        stacked = np.stack([band.astype(np.float32) for band in bands])
+        return stacked.reshape(len(bands), *self.shape), descriptions
+
+
+class HeightSketch:
+    def __init__(
+        self,
+        shape: tuple[int, int],
+        *,
+        capacity: int = PERCENTILE_SAMPLES,
+        z_origin: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        if capacity < 1:
+            raise ValueError("capacity must be strictly positive.")
+        self.shape = shape
+        self.capacity = capacity
+        # Heights below the origin, or more than 655 m above it, are clipped.
+        self.z_origin = float(z_origin)
+        cell_count = shape[0] * shape[1]
+        self._count = np.zeros(cell_count, dtype=np.uint32)
+        self._samples = np.full((cell_count, capacity), EMPTY_HEIGHT, dtype=np.uint16)
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, x_indices: np.ndarray, y_indices: np.ndarray, z: np.ndarray) -> None:
+        cells = np.asarray(y_indices, dtype=np.int64) * self.shape[1] + np.asarray(
+            x_indices, dtype=np.int64
+        )
+        if cells.size == 0:
+            return
+        # One draw per point in stream order, so chunked and single-pass reads keep the same
+        # samples.
+        draws = self._rng.random(cells.size)
+
+        # Reservoir sampling per cell: the first `capacity` heights are kept as is, then the
+        # n-th height replaces a random slot with probability capacity / n.
+        order = np.argsort(cells, kind="stable")
+        sorted_cells = cells[order]
+        group_starts = np.flatnonzero(np.r_[True, sorted_cells[1:] != sorted_cells[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, sorted_cells.size])
+        rank = np.arange(sorted_cells.size) - np.repeat(group_starts, group_sizes)
+        seen = self._count[sorted_cells].astype(np.int64) + rank + 1
+        slots = np.where(
+            seen <= self.capacity,
+            seen - 1,
+            (draws[order] * seen).astype(np.int64),
+        )
+        kept = slots < self.capacity
+
+        # Later points overwrite earlier ones drawing the same slot of the same cell.
+        keys = sorted_cells[kept] * self.capacity + slots[kept]
+        _, last = np.unique(keys[::-1], return_index=True)
+        last = keys.size - 1 - last
+        z_sorted = np.asarray(z, dtype=np.float64)[order][kept][last]
+        heights = np.rint((z_sorted - self.z_origin) * HEIGHT_SCALE)
+        self._samples.reshape(-1)[keys[last]] = np.clip(heights, 0, EMPTY_HEIGHT - 1)
+        self._count[sorted_cells[group_starts]] += group_sizes.astype(np.uint32)
+
+    def percentiles(self, percentiles: tuple[float, ...], ground: np.ndarray) -> np.ndarray:
+        ground = np.asarray(ground, dtype=np.float64).reshape(-1)
+        bands = np.empty((len(percentiles), self._count.size), dtype=np.float32)
+        step = max(1, PERCENTILE_CHUNK_CELLS // self.shape[1]) * self.shape[1]
+        for start in range(0, self._count.size, step):
+            stop = start + step
+            # Empty slots hold the largest value, so they sort after the kept heights.
+            samples = np.sort(self._samples[start:stop], axis=1).astype(np.float64)
+            kept = np.minimum(self._count[start:stop], self.capacity).astype(np.int64)
+            empty = kept == 0
+            last_sample = np.maximum(kept - 1, 0)
+            base = self.z_origin - ground[start:stop]
+            for band, percentile in enumerate(percentiles):
+                # Linear interpolation between the closest ranks, as in np.percentile.
+                position = last_sample * (percentile / 100.0)
+                lower = np.floor(position).astype(np.int64)
+                upper = np.minimum(lower + 1, last_sample)
+                lower_value = np.take_along_axis(samples, lower[:, None], axis=1)[:, 0]
+                upper_value = np.take_along_axis(samples, upper[:, None], axis=1)[:, 0]
+                value = lower_value + (upper_value - lower_value) * (position - lower)
+                bands[band, start:stop] = np.where(empty, np.nan, base + value / HEIGHT_SCALE)
+        return bands.reshape(len(percentiles), *self.shape)
+
+
+def rasterize_points(
+    x_indices: np.ndarray,
+    y_indices: np.ndarray,
+    z: np.ndarray,
+    classes: np.ndarray,
+    shape: tuple[int, int],
+    *,
+    ground_excluded_classes: frozenset[int] = GROUND_EXCLUDED_CLASSES,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    accumulator = RasterAccumulator(shape, ground_excluded_classes=ground_excluded_classes)
+    accumulator.update(x_indices, y_indices, z, classes)
+    return accumulator.mns, accumulator.mnt, accumulator.class_raster
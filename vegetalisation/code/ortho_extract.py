@@ -23,7 +23,7 @@ CHUNK_SIZE = 8192
 REQUEST_TIMEOUT_SECONDS = 60
 
 
-def parse_args() -> argparse.Namespace:
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Download orthophoto tiles and resample them from 5 cm to 0.8 m."
     )
@@ -51,7 +51,7 @@ def parse_args() -> argparse.Namespace:
         default=TARGET_RESOLUTION,
         help="Output orthophoto pixel size in meters.",
     )
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
 def load_tiles(json_file: Path) -> list[dict[str, Any]]:
@@ -131,8 +131,8 @@ def resample_raster(
         dst.write(data)
 
 
-def main() -> None:
-    args = parse_args()
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
     validate_bbox(args.xmin_start, args.xmin_end, args.ymin_start, args.ymin_end)
     if args.source_resolution is not None:
         validate_positive_number(args.source_resolution, "source_resolution")
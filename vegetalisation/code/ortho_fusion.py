@@ -1,13 +1,20 @@
 from __future__ import annotations
 
 import argparse
+import math
 from pathlib import Path
 
+import numpy as np
 import rasterio
+from rasterio import Affine
 from rasterio.merge import merge
+from rasterio.windows import Window
 
+MOSAIC_BAND_ROWS = 1024
+ALIGNMENT_TOLERANCE_PIXELS = 1e-6
 
-def parse_args() -> argparse.Namespace:
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Merge GeoTIFF rasters from a directory into a single mosaic."
     )
@@ -23,7 +30,115 @@ def parse_args() -> argparse.Namespace:
         default=Path("heights.tif"),
         help="Merged GeoTIFF output path.",
     )
-    return parser.parse_args()
+    return parser.parse_args(argv)
+
+
+def _pixel_offset(distance: float, resolution: float) -> int | None:
+    offset = distance / resolution
+    rounded = round(offset)
+    if abs(offset - rounded) > ALIGNMENT_TOLERANCE_PIXELS:
+        return None
+    return int(rounded)
+
+
+def aligned_mosaic_layout(
+    datasets: list[rasterio.io.DatasetReader],
+) -> tuple[Affine, int, int, list[tuple[int, int]]] | None:
+    first = datasets[0]
+    res_x, res_y = first.res
+    for dataset in datasets:
+        transform = dataset.transform
+        if (
+            dataset.crs != first.crs
+            or dataset.res != first.res
+            or dataset.count != first.count
+            or dataset.dtypes != first.dtypes
+            or transform.b != 0
+            or transform.d != 0
+            or transform.a <= 0
+            or transform.e >= 0
+        ):
+            return None
+
+    left = min(dataset.bounds.left for dataset in datasets)
+    top = max(dataset.bounds.top for dataset in datasets)
+    right = max(dataset.bounds.right for dataset in datasets)
+    bottom = min(dataset.bounds.bottom for dataset in datasets)
+
+    offsets = []
+    for dataset in datasets:
+        column_offset = _pixel_offset(dataset.bounds.left - left, res_x)
+        row_offset = _pixel_offset(top - dataset.bounds.top, res_y)
+        if column_offset is None or row_offset is None:
+            return None
+        offsets.append((row_offset, column_offset))
+
+    width = int(round((right - left) / res_x))
+    height = int(round((top - bottom) / res_y))
+    transform = Affine.translation(left, top) * Affine.scale(res_x, -res_y)
+    return transform, width, height, offsets
+
+
+def _mosaic_fill_value(dtype: str, nodata: float | None) -> float | None:
+    if nodata is None:
+        return None
+    if math.isnan(nodata) or math.isinf(nodata):
+        return nodata if np.issubdtype(dtype, np.floating) else None
+    info = np.iinfo(dtype) if np.issubdtype(dtype, np.integer) else np.finfo(dtype)
+    return nodata if info.min <= nodata <= info.max else None
+
+
+def write_aligned_mosaic(
+    datasets: list[rasterio.io.DatasetReader],
+    output_file: Path,
+    layout: tuple[Affine, int, int, list[tuple[int, int]]],
+) -> None:
+    transform, width, height, offsets = layout
+    first = datasets[0]
+    dtype = first.dtypes[0]
+    nodata = first.nodatavals[0]
+    fill_value = _mosaic_fill_value(dtype, nodata)
+    # Same conventions as rasterio.merge with method="first": the first tile holding a valid
+    # pixel wins, and output pixels still equal to the nodata value can be overwritten.
+    mask_value = 0 if nodata is None else nodata
+
+    out_meta = first.meta.copy()
+    out_meta.update(height=height, width=width, transform=transform, compress="lzw")
+    with rasterio.open(output_file, "w", **out_meta) as dst:
+        for band_top in range(0, height, MOSAIC_BAND_ROWS):
+            band_height = min(MOSAIC_BAND_ROWS, height - band_top)
+            band = np.zeros((first.count, band_height, width), dtype=dtype)
+            if fill_value is not None:
+                band.fill(fill_value)
+
+            for dataset, (row_offset, column_offset) in zip(datasets, offsets, strict=True):
+                first_row = max(row_offset, band_top)
+                last_row = min(row_offset + dataset.height, band_top + band_height)
+                if first_row >= last_row:
+                    continue
+                data = dataset.read(
+                    window=Window(0, first_row - row_offset, dataset.width, last_row - first_row),
+                    masked=True,
+                )
+                region = band[
+                    :,
+                    first_row - band_top : last_row - band_top,
+                    column_offset : column_offset + dataset.width,
+                ]
+                if isinstance(mask_value, float) and math.isnan(mask_value):
+                    region_empty = np.isnan(region)
+                elif np.issubdtype(region.dtype, np.integer):
+                    region_empty = region == mask_value
+                else:
+                    region_empty = np.isclose(region, mask_value)
+                np.copyto(
+                    region,
+                    data.data,
+                    where=region_empty & ~np.ma.getmaskarray(data),
+                    casting="unsafe",
+                )
+
+            dst.write(band, window=Window(0, band_top, width, band_height))
 
 
 def merge_tiffs(input_dir: Path, output_file: Path) -> None:
@@ -35,17 +150,22 @@ def merge_tiffs(input_dir: Path, output_file: Path) -> None:
     output_file.parent.mkdir(parents=True, exist_ok=True)
     datasets = [rasterio.open(path) for path in tif_files]
     try:
-        mosaic, transform = merge(datasets)
-        out_meta = datasets[0].meta.copy()
-        out_meta.update(
-            height=mosaic.shape[1],
-            width=mosaic.shape[2],
-            transform=transform,
-            compress="lzw",
-        )
-
-        with rasterio.open(output_file, "w", **out_meta) as dst:
-            dst.write(mosaic)
+        layout = aligned_mosaic_layout(datasets)
+        if layout is not None:
+            # Tiles rasterized on a shared grid only need to be copied into place.
+            write_aligned_mosaic(datasets, output_file, layout)
+        else:
+            mosaic, transform = merge(datasets)
+            out_meta = datasets[0].meta.copy()
+            out_meta.update(
+                height=mosaic.shape[1],
+                width=mosaic.shape[2],
+                transform=transform,
+                compress="lzw",
+            )
+
+            with rasterio.open(output_file, "w", **out_meta) as dst:
+                dst.write(mosaic)
     finally:
         for dataset in datasets:
             dataset.close()
@@ -53,8 +173,8 @@ def merge_tiffs(input_dir: Path, output_file: Path) -> None:
     print(f"Mosaic created at: {output_file}")
 
 
-def main() -> None:
-    args = parse_args()
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
     merge_tiffs(args.input_dir, args.output_file)
 
 
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import json
+from collections.abc import Iterator
+from pathlib import Path
+
+import laspy
+import numpy as np
+
+# Default LASzip chunk size: a seek inside a LAZ file restarts decoding at the start of the
+# enclosing chunk, so index blocks aligned on it never decode a point twice.
+INDEX_BLOCK_POINTS = 50_000
+INDEX_SUFFIX = ".index.json"
+
+
+def intersect_bounds(
+    first: tuple[float, float, float, float],
+    second: tuple[float, float, float, float],
+) -> tuple[float, float, float, float] | None:
+    xmin = max(first[0], second[0])
+    ymin = max(first[1], second[1])
+    xmax = min(first[2], second[2])
+    ymax = min(first[3], second[3])
+    if xmin > xmax or ymin > ymax:
+        return None
+    return xmin, ymin, xmax, ymax
+
+
+def block_index_path(laz_path: Path) -> Path:
+    return laz_path.with_name(laz_path.name + INDEX_SUFFIX)
+
+
+def _source_fingerprint(laz_path: Path) -> dict[str, int]:
+    stat = laz_path.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_block_index(laz_path: Path, block_points: int = INDEX_BLOCK_POINTS) -> np.ndarray | None:
+    index_path = block_index_path(laz_path)
+    if not index_path.exists():
+        return None
+    try:
+        data = json.loads(index_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if (
+        data.get("source") != _source_fingerprint(laz_path)
+        or data.get("block_points") != block_points
+    ):
+        return None
+    return np.asarray(data["blocks"], dtype=np.float64).reshape(-1, 4)
+
+
+def write_block_index(laz_path: Path, blocks: np.ndarray, block_points: int) -> None:
+    data = {
+        "source": _source_fingerprint(laz_path),
+        "block_points": block_points,
+        "blocks": np.asarray(blocks, dtype=np.float64).tolist(),
+    }
+    index_path = block_index_path(laz_path)
+    # The index only speeds up later runs, so a read-only or shared LAZ folder must not fail
+    # a tile whose points have already been decoded.
+    try:
+        index_path.write_text(json.dumps(data), encoding="utf-8")
+    except OSError as error:
+        print(f"Could not write LAZ block index {index_path}: {error}")
+
+
+def iter_points_in_bounds(
+    laz_path: Path,
+    bounds: tuple[float, float, float, float],
+    *,
+    laz_backend: tuple[laspy.LazBackend, ...] | None = None,
+    decompression_selection: laspy.DecompressionSelection = laspy.DecompressionSelection.all(),
+    block_points: int = INDEX_BLOCK_POINTS,
+) -> Iterator[laspy.ScaleAwarePointRecord]:
+    # Chunks may still hold points outside the bounds; callers clip them point by point.
+    # COPC files are LAZ files too and go through the same block index.
+    blocks = load_block_index(laz_path, block_points)
+    with laspy.open(
+        laz_path,
+        laz_backend=laz_backend,
+        decompression_selection=decompression_selection,
+    ) as reader:
+        if blocks is None:
+            # First visit: decode every block once and record its bounds so later runs can
+            # seek straight to the blocks overlapping their area.
+            block_bounds = []
+            for points in reader.chunk_iterator(block_points):
+                x = np.asarray(points.x)
+                y = np.asarray(points.y)
+                block_bounds.append((x.min(), y.min(), x.max(), y.max()))
+                yield points
+            write_block_index(laz_path, np.array(block_bounds).reshape(-1, 4), block_points)
+            return
+
+        point_count = reader.header.point_count
+        for block, block_bounds in enumerate(blocks):
+            if intersect_bounds(tuple(block_bounds), bounds) is None:
+                continue
+            start = block * block_points
+            reader.seek(start)
+            yield reader.read_points(min(block_points, point_count - start))
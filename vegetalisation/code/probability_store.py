@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import argparse
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import rasterio
+import yaml
+from rasterio.io import DatasetReader
+from rasterio.windows import Window
+
+from workflow_utils import validate_positive_number
+
+DEFAULT_MATRIX_CONFIG = Path("configs/baseline/configs.yml")
+STORE_DTYPES = ("uint8", "uint16")
+# Class id of the band holding the highest probability among the classes that are not kept.
+OTHER_CLASSES = -1
+STORE_TILE_SIZE = 256
+STORE_BLOCK_ROWS = 4 * STORE_TILE_SIZE
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Convert a FLAIR class-probability raster into a quantized store with only the "
+            "classes used downstream."
+        )
+    )
+    parser.add_argument("--input", "-i", type=Path, required=True, help="Input probability GeoTIFF")
+    parser.add_argument("--output", "-o", type=Path, required=True, help="Output store GeoTIFF")
+    parser.add_argument("--matrix-config", type=Path, default=DEFAULT_MATRIX_CONFIG)
+    parser.add_argument(
+        "--classes",
+        type=str,
+        default=None,
+        help=(
+            "Comma-separated class bands kept individually. Defaults to the mapped classes of "
+            "flair.reweight and those with a weight other than 1; the other classes are merged "
+            "into one band."
+        ),
+    )
+    parser.add_argument("--dtype", choices=STORE_DTYPES, default="uint8")
+    parser.add_argument("--block-size", type=int, default=STORE_BLOCK_ROWS)
+    return parser.parse_args()
+
+
+def resolve_matrix_config_path(config_path: Path) -> Path:
+    if config_path.is_absolute():
+        return config_path
+    return Path(__file__).resolve().parent / config_path
+
+
+def load_store_classes(config_path: Path) -> list[int]:
+    # Mapped and reweighted classes keep their own band; the others all have weight 1.
+    with config_path.open("r", encoding="utf-8") as handle:
+        config = yaml.safe_load(handle)
+    if not isinstance(config, dict):
+        raise ValueError(f"Invalid matrix config: {config_path}")
+    reweight_config = config["flair"]["reweight"]
+    return sorted(
+        {int(class_id) for class_id in reweight_config["mapping"]}
+        | {
+            int(class_id)
+            for class_id, weight in reweight_config["weights"].items()
+            if float(weight) != 1.0
+        }
+    )
+
+
+@dataclass(frozen=True)
+class ProbabilityBands:
+    class_ids: tuple[int, ...]
+    other_classes: tuple[int, ...] = ()
+    # Integer value of a probability of 1 in a store, None for a plain probability raster.
+    scale: int | None = None
+
+    @property
+    def is_store(self) -> bool:
+        return self.scale is not None
+
+    def band_weights(self, weights: dict[int, float]) -> np.ndarray:
+        known = set(self.class_ids) | set(self.other_classes)
+        missing_classes = [class_id for class_id in weights if class_id not in known]
+        if missing_classes:
+            raise ValueError(
+                f"Weight(s) defined for missing class band(s): {missing_classes}. "
+                f"Input only contains {len(known)} class band(s)."
+            )
+        # The merged band can only be reweighted when its classes share one weight.
+        other_weights = {weights.get(class_id, 1.0) for class_id in self.other_classes}
+        if len(other_weights) > 1:
+            raise ValueError(
+                f"Classes {list(self.other_classes)} share one band of the probability store but "
+                "have different weights. Rebuild the store with --classes including the classes "
+                "weighted differently."
+            )
+        other_weight = other_weights.pop() if other_weights else 1.0
+        return np.array(
+            [
+                other_weight if class_id == OTHER_CLASSES else weights.get(class_id, 1.0)
+                for class_id in self.class_ids
+            ],
+            dtype=np.float32,
+        )
+
+    def band_mapping(self, mapping: dict[int, int]) -> dict[int, int]:
+        return {
+            band: mapping[class_id]
+            for band, class_id in enumerate(self.class_ids)
+            if class_id in mapping
+        }
+
+
+def _parse_ids(value: str) -> tuple[int, ...]:
+    return tuple(int(item) for item in value.split(",") if item.strip())
+
+
+def probability_bands(dataset: DatasetReader) -> ProbabilityBands:
+    tags = dataset.tags()
+    if "PROBABILITY_CLASSES" not in tags:
+        return ProbabilityBands(tuple(range(dataset.count)))
+    return ProbabilityBands(
+        _parse_ids(tags["PROBABILITY_CLASSES"]),
+        _parse_ids(tags.get("PROBABILITY_OTHER_CLASSES", "")),
+        int(tags["PROBABILITY_SCALE"]),
+    )
+
+
+def quantize(probabilities: np.ndarray, dtype: str) -> np.ndarray:
+    # Probabilities in [0, 1] map to 0..max of the integer type; NaN becomes 0.
+    scale = np.iinfo(dtype).max
+    np.nan_to_num(probabilities, copy=False, nan=0.0)
+    np.clip(probabilities, 0.0, 1.0, out=probabilities)
+    probabilities *= scale
+    np.rint(probabilities, out=probabilities)
+    return probabilities.astype(dtype)
+
+
+def write_probability_store(
+    input_path: Path,
+    output_path: Path,
+    classes: list[int],
+    *,
+    dtype: str = "uint8",
+    block_size: int = STORE_BLOCK_ROWS,
+) -> ProbabilityBands:
+    if dtype not in STORE_DTYPES:
+        raise ValueError(f"dtype must be one of {STORE_DTYPES}, got {dtype!r}.")
+    with rasterio.open(input_path) as src:
+        if probability_bands(src).is_store:
+            raise ValueError(f"Input is already a probability store: {input_path}")
+        kept = sorted(set(classes))
+        missing_classes = [class_id for class_id in kept if not 0 <= class_id < src.count]
+        if missing_classes:
+            raise ValueError(
+                f"Class band(s) {missing_classes} not found. "
+                f"Input only contains {src.count} band(s)."
+            )
+        others = [class_id for class_id in range(src.count) if class_id not in kept]
+        bands = ProbabilityBands(
+            tuple(kept) + ((OTHER_CLASSES,) if others else ()),
+            tuple(others),
+            int(np.iinfo(dtype).max),
+        )
+        source_dtype = np.dtype(src.dtypes[0])
+        # Integer probability rasters are read as fractions of their type's maximum.
+        source_scale = (
+            None if np.issubdtype(source_dtype, np.floating) else np.iinfo(source_dtype).max
+        )
+
+        profile = src.profile.copy()
+        profile.update(
+            driver="GTiff",
+            count=len(bands.class_ids),
+            dtype=dtype,
+            nodata=None,
+            compress="lzw",
+            predictor=2,
+            tiled=True,
+            blockxsize=STORE_TILE_SIZE,
+            blockysize=STORE_TILE_SIZE,
+            interleave="pixel",
+            BIGTIFF="IF_SAFER",
+        )
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with rasterio.open(output_path, "w", **profile) as dst:
+            for top in range(0, src.height, block_size):
+                window = Window(0, top, src.width, min(block_size, src.height - top))
+                probabilities = src.read(window=window).astype(np.float32)
+                if source_scale is not None:
+                    probabilities /= source_scale
+                stack = np.empty((len(bands.class_ids), *probabilities.shape[1:]), np.float32)
+                stack[: len(kept)] = probabilities[kept]
+                if others:
+                    np.max(probabilities[others], axis=0, out=stack[-1])
+                dst.write(quantize(stack, dtype), window=window)
+            dst.update_tags(
+                PROBABILITY_CLASSES=",".join(str(class_id) for class_id in bands.class_ids),
+                PROBABILITY_OTHER_CLASSES=",".join(str(class_id) for class_id in others),
+                PROBABILITY_SCALE=str(bands.scale),
+            )
+            for band, class_id in enumerate(bands.class_ids, start=1):
+                dst.set_band_description(
+                    band, "other_classes" if class_id == OTHER_CLASSES else f"class_{class_id}"
+                )
+    return bands
+
+
+def main() -> None:
+    args = parse_args()
+    validate_positive_number(args.block_size, "block_size")
+    classes = (
+        list(_parse_ids(args.classes))
+        if args.classes
+        else load_store_classes(resolve_matrix_config_path(args.matrix_config))
+    )
+    bands = write_probability_store(
+        args.input, args.output, classes, dtype=args.dtype, block_size=args.block_size
+    )
+    print(
+        f"Saved probability store with {len(bands.class_ids)} band(s) "
+        f"({', '.join(str(class_id) for class_id in bands.class_ids)}) to: {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import math
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window
+
+from raster_products import RasterDataset, gdal_dataset
+
+# Grid offsets closer than this to a whole pixel count as aligned.
+PIXEL_TOLERANCE = 1e-6
+GRID_EXTENTS = ("union", "reference")
+
+
+@dataclass(frozen=True)
+class RasterGrid:
+    transform: Affine
+    width: int
+    height: int
+    crs: CRS | None = None
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.height, self.width
+
+    def profile(self) -> dict[str, Any]:
+        return {
+            "transform": self.transform,
+            "width": self.width,
+            "height": self.height,
+            "crs": self.crs,
+        }
+
+
+def dataset_grid(dataset: RasterDataset) -> RasterGrid:
+    return RasterGrid(dataset.transform, dataset.width, dataset.height, dataset.crs)
+
+
+def _snap(value: float, rounding: Callable[[float], float]) -> int:
+    nearest = round(value)
+    if abs(value - nearest) < PIXEL_TOLERANCE:
+        return int(nearest)
+    return int(rounding(value))
+
+
+def _same_crs(first: CRS | None, second: CRS | None) -> bool:
+    # Rasters without a CRS are assumed to share the frame of the others.
+    return first is None or second is None or first == second
+
+
+def common_grid(
+    datasets: Sequence[RasterDataset],
+    *,
+    reference: int = 0,
+    extent: str = "union",
+) -> RasterGrid:
+    if extent not in GRID_EXTENTS:
+        raise ValueError(f"extent must be one of {GRID_EXTENTS}, got {extent!r}.")
+    base = datasets[reference]
+    transform = base.transform
+    if transform.b != 0 or transform.d != 0:
+        raise ValueError(f"Rotated rasters are not supported: {base.name}")
+    if extent == "reference":
+        return dataset_grid(base)
+
+    # The grid keeps the pixel size and pixel origin of the reference raster and grows to cover
+    # every input.
+    first_col, first_row, last_col, last_row = 0, 0, base.width, base.height
+    inverse = ~transform
+    for dataset in datasets:
+        bounds = tuple(dataset.bounds)
+        if not _same_crs(dataset.crs, base.crs):
+            bounds = transform_bounds(dataset.crs, base.crs, *bounds)
+        left, bottom, right, top = bounds
+        col_a, row_a = inverse * (left, top)
+        col_b, row_b = inverse * (right, bottom)
+        first_col = min(first_col, _snap(min(col_a, col_b), math.floor))
+        first_row = min(first_row, _snap(min(row_a, row_b), math.floor))
+        last_col = max(last_col, _snap(max(col_a, col_b), math.ceil))
+        last_row = max(last_row, _snap(max(row_a, row_b), math.ceil))
+    return RasterGrid(
+        transform * Affine.translation(first_col, first_row),
+        last_col - first_col,
+        last_row - first_row,
+        base.crs,
+    )
+
+
+def _grid_offset(dataset: RasterDataset, grid: RasterGrid) -> tuple[int, int] | None:
+    # Row and column of the grid origin in the dataset, when both share the same pixels.
+    source, target = dataset.transform, grid.transform
+    if not _same_crs(dataset.crs, grid.crs) or source.b != 0 or source.d != 0:
+        return None
+    if not (math.isclose(source.a, target.a) and math.isclose(source.e, target.e)):
+        return None
+    col, row = ~source * (target.c, target.f)
+    if abs(col - round(col)) >= PIXEL_TOLERANCE or abs(row - round(row)) >= PIXEL_TOLERANCE:
+        return None
+    return round(row), round(col)
+
+
+def read_aligned(
+    dataset: RasterDataset,
+    grid: RasterGrid,
+    *,
+    fill_value: float | int,
+    window: Window | None = None,
+    band: int = 1,
+    dtype: np.dtype | type | str | None = None,
+    resampling: Resampling = Resampling.nearest,
+) -> np.ndarray:
+    if window is None:
+        window = Window(0, 0, grid.width, grid.height)
+    rows, cols = int(window.height), int(window.width)
+    dtype = np.dtype(dtype or dataset.dtypes[band - 1])
+
+    offset = _grid_offset(dataset, grid)
+    if offset is None:
+        with WarpedVRT(
+            gdal_dataset(dataset),
+            crs=grid.crs,
+            transform=grid.transform,
+            width=grid.width,
+            height=grid.height,
+            resampling=resampling,
+            dtype=dtype.name,
+            nodata=fill_value,
+        ) as vrt:
+            return vrt.read(band, window=window)
+
+    # Same pixel grid: read the overlapping part straight into the output, without padding.
+    top = offset[0] + int(window.row_off)
+    left = offset[1] + int(window.col_off)
+    first_row, last_row = max(top, 0), min(top + rows, dataset.height)
+    first_col, last_col = max(left, 0), min(left + cols, dataset.width)
+    covered = (first_row, last_row, first_col, last_col) == (top, top + rows, left, left + cols)
+    output = (
+        np.empty((rows, cols), dtype=dtype) if covered else np.full((rows, cols), fill_value, dtype)
+    )
+    if first_row < last_row and first_col < last_col:
+        read = output[first_row - top : last_row - top, first_col - left : last_col - left]
+        dataset.read(
+            band,
+            window=Window(first_col, first_row, last_col - first_col, last_row - first_row),
+            out=read,
+        )
+        # The warped read turns source nodata into fill_value; do the same here so both paths
+        # agree, e.g. when a uint8 raster is read as float32 with NaN padding.
+        nodata = dataset.nodata
+        if nodata is not None and not math.isnan(nodata) and nodata != fill_value:
+            read[read == nodata] = fill_value
+    return output
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio import windows
+from rasterio.coords import BoundingBox
+from rasterio.io import DatasetReader, MemoryFile
+from rasterio.transform import array_bounds
+from rasterio.windows import Window
+
+# Creation options skipped for in-memory rasters; the block layout is kept so profiles read
+# back from them match the files.
+_COMPRESSION_OPTIONS = ("compress", "predictor", "zlevel", "zstd_level")
+
+
+@dataclass(frozen=True)
+class RasterData:
+    array: np.ndarray
+    profile: dict[str, Any]
+
+    @property
+    def bands(self) -> np.ndarray:
+        return self.array if self.array.ndim == 3 else self.array[np.newaxis]
+
+    def file_profile(self) -> dict[str, Any]:
+        profile = self.profile.copy()
+        profile.update(
+            driver="GTiff",
+            count=self.bands.shape[0],
+            height=self.bands.shape[1],
+            width=self.bands.shape[2],
+            dtype=self.array.dtype.name,
+        )
+        return profile
+
+
+# A stage input is either a raster already in memory or a GeoTIFF that is opened when needed.
+RasterSource = Path | RasterData
+
+
+class InMemoryDataset:
+    # The parts of the DatasetReader interface the stages use, over a RasterData. Reads of whole
+    # pixels of the raster are served from its array; reads that resample, and warps, go through
+    # an uncompressed /vsimem GeoTIFF written the first time one of them needs it.
+    name = "<in-memory raster>"
+
+    def __init__(self, raster: RasterData) -> None:
+        self._bands = raster.bands
+        self.profile = raster.file_profile()
+        for key in _COMPRESSION_OPTIONS:
+            self.profile.pop(key, None)
+        self.count = self.profile["count"]
+        self.height = self.profile["height"]
+        self.width = self.profile["width"]
+        self.transform = self.profile.setdefault("transform", Affine.identity())
+        self.crs = self.profile.setdefault("crs", None)
+        self.nodata = self.profile.setdefault("nodata", None)
+        self.dtypes = (self._bands.dtype.name,) * self.count
+        self._memory_file: MemoryFile | None = None
+        self._dataset: DatasetReader | None = None
+
+    @property
+    def bounds(self) -> BoundingBox:
+        return BoundingBox(*array_bounds(self.height, self.width, self.transform))
+
+    @property
+    def block_shapes(self) -> list[tuple[int, int]]:
+        if self.profile.get("tiled"):
+            shape = (self.profile.get("blockysize", 256), self.profile.get("blockxsize", 256))
+        else:
+            shape = (self.profile.get("blockysize", 1), self.width)
+        return [shape] * self.count
+
+    def overviews(self, band: int) -> list[int]:
+        return []
+
+    def window_transform(self, window: Window) -> Affine:
+        return windows.transform(window, self.transform)
+
+    def window_bounds(self, window: Window) -> tuple[float, float, float, float]:
+        return windows.bounds(window, self.transform)
+
+    def read(
+        self,
+        indexes: int | list[int] | None = None,
+        *,
+        window: Window | None = None,
+        out: np.ndarray | None = None,
+        out_shape: tuple[int, ...] | None = None,
+        **options: Any,
+    ) -> np.ndarray:
+        window = window or Window(0, 0, self.width, self.height)
+        offsets = (window.col_off, window.row_off, window.width, window.height)
+        inside = (
+            all(float(value).is_integer() for value in offsets)
+            and window.col_off >= 0
+            and window.row_off >= 0
+            and window.col_off + window.width <= self.width
+            and window.row_off + window.height <= self.height
+        )
+        shape = (int(window.height), int(window.width))
+        if indexes is None:
+            bands = slice(None)
+        elif isinstance(indexes, int):
+            bands = indexes - 1
+        else:
+            bands = [index - 1 for index in indexes]
+        data = self._bands[(bands, *window.toslices())] if inside else None
+        if (
+            data is None
+            or (out_shape is not None and tuple(out_shape[-2:]) != shape)
+            or (out is not None and not np.can_cast(data.dtype, out.dtype))
+            or set(options) - {"resampling"}
+        ):
+            return self.gdal_dataset().read(
+                indexes, window=window, out=out, out_shape=out_shape, **options
+            )
+        if out is None:
+            return data.copy()
+        np.copyto(out, data)
+        return out
+
+    def gdal_dataset(self) -> DatasetReader:
+        # For GDAL calls that need a real dataset, such as warps.
+        if self._dataset is None:
+            self._memory_file = MemoryFile()
+            with self._memory_file.open(**self.profile) as dst:
+                dst.write(self._bands)
+            self._dataset = self._memory_file.open()
+        return self._dataset
+
+    def close(self) -> None:
+        if self._dataset is not None:
+            self._dataset.close()
+            self._memory_file.close()
+            self._dataset = self._memory_file = None
+
+
+# What open_raster yields: a file dataset, or the view of an in-memory raster.
+RasterDataset = DatasetReader | InMemoryDataset
+
+
+def gdal_dataset(dataset: RasterDataset) -> DatasetReader:
+    return dataset.gdal_dataset() if isinstance(dataset, InMemoryDataset) else dataset
+
+
+@contextmanager
+def open_raster(source: RasterSource) -> Iterator[RasterDataset]:
+    if not isinstance(source, RasterData):
+        with rasterio.open(source) as dataset:
+            yield dataset
+        return
+
+    # In-memory rasters are read in place rather than copied to a GeoTIFF up front.
+    dataset = InMemoryDataset(source)
+    try:
+        yield dataset
+    finally:
+        dataset.close()
+
+
+def read_raster(source: RasterSource) -> RasterData:
+    if isinstance(source, RasterData):
+        return source
+    with rasterio.open(source) as dataset:
+        array = dataset.read(1) if dataset.count == 1 else dataset.read()
+        return RasterData(array, dataset.profile.copy())
+
+
+def write_raster(raster: RasterData, path: Path) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with rasterio.open(path, "w", **raster.file_profile()) as dst:
+        dst.write(raster.bands)
+    return path
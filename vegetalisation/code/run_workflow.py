@@ -5,16 +5,37 @@ import os
 import shutil
 import subprocess
 import sys
+from collections.abc import Callable
+from functools import partial
 from pathlib import Path
 from typing import Any
 
+import rasterio
 import requests
 import yaml
-from huggingface_hub import hf_hub_download
 
+import extract_nuage
+import fusion_nuage
+import ortho_extract
+from calculateVegetationFromLidar import lidar_vegetation
+from confusionMatrix import evaluate_prediction
+from flair_probs_reweight import load_reweight_config, reweight_probabilities
+from fusion_lidar_flair import OUTPUT_NAMES, fuse_rasters_blocks, fuse_sources
+from fusionBetweenFlairAndLidar import fuse_class_sources
+from lidarCorrection import correct_raster
+from ortho_fusion import merge_tiffs
+from probability_store import (
+    STORE_DTYPES,
+    load_store_classes,
+    probability_bands,
+    write_probability_store,
+)
+from raster_products import RasterData, RasterSource
+from workflow_stages import Stage, run_stages
 from workflow_utils import (
     build_run_manifest,
     collect_runtime_versions,
+    import_torch,
     validate_bbox,
     validate_positive_number,
     write_json,
@@ -30,11 +51,6 @@ DEFAULT_MODEL_REVISION = "336bd84"
 DEFAULT_FLAIR_HUB_REPO_URL = "https://github.com/IGNF/FLAIR-HUB.git"
 INVENTORY_DOWNLOAD_TIMEOUT_SECONDS = 60
 
-try:
-    import torch
-except ImportError:  # pragma: no cover - optional dependency outside runtime images
-    torch = None
-
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
@@ -72,6 +88,77 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--ymin-start", type=int, required=True)
     parser.add_argument("--ymin-end", type=int, required=True)
     parser.add_argument("--resolution", type=float, default=None)
+    parser.add_argument(
+        "--lidar-chunk-points",
+        type=int,
+        default=None,
+        help="Stream LAZ tiles in chunks of this many points to bound LiDAR rasterization memory.",
+    )
+    parser.add_argument(
+        "--lidar-gap-fill",
+        choices=["mean", "nearest"],
+        default=None,
+        help="How empty LiDAR MNS/MNT cells are filled before computing heights.",
+    )
+    parser.add_argument(
+        "--lidar-workers",
+        type=int,
+        default=None,
+        help="Number of worker processes used to rasterize LAZ tiles in parallel.",
+    )
+    parser.add_argument(
+        "--lidar-laz-backend",
+        choices=["auto", "parallel", "single"],
+        default=None,
+        help="LAZ decoder used by fusion_nuage.py (multi-threaded 'parallel' or 'single').",
+    )
+    parser.add_argument(
+        "--lidar-statistics",
+        type=str,
+        default=None,
+        help=(
+            "Comma-separated per-cell LiDAR statistics written as multi-band rasters "
+            "(density, class_counts, intensity_mean, returns_mean, first_return_max)."
+        ),
+    )
+    parser.add_argument(
+        "--lidar-height-percentiles",
+        type=str,
+        default=None,
+        help=(
+            "Comma-separated percentiles of the point heights above ground, such as 50,90,95, "
+            "added to the LiDAR statistics rasters."
+        ),
+    )
+    parser.add_argument(
+        "--lidar-percentile-samples",
+        type=int,
+        default=None,
+        help=(
+            "Heights kept per cell to estimate the height percentiles "
+            "(2 bytes per sample and cell)."
+        ),
+    )
+    parser.add_argument(
+        "--lidar-bbox",
+        type=float,
+        nargs=4,
+        metavar=("XMIN", "YMIN", "XMAX", "YMAX"),
+        default=None,
+        help="Only rasterize LiDAR points inside this area (meters, same CRS as the tiles).",
+    )
+    parser.add_argument(
+        "--lidar-snap-to-grid",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="Snap LiDAR tiles to a global grid so mosaics are assembled by direct placement.",
+    )
+    parser.add_argument(
+        "--lidar-tile-footprints",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="Use the LiDAR inventory tile footprints as raster extents.",
+    )
     parser.add_argument("--batch-size", type=int, default=None)
     parser.add_argument("--num-worker", type=int, default=None)
     parser.add_argument("--img-pixels-detection", type=int, default=None)
@@ -129,6 +216,57 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--flair-only-herbaceous", action=argparse.BooleanOptionalAction, default=None
     )
+    parser.add_argument(
+        "--fusion-block-size",
+        type=int,
+        default=None,
+        help="Rows per block when fusing the LiDAR and Flair rasters (whole rasters if unset).",
+    )
+    parser.add_argument(
+        "--reweight-block-size",
+        type=int,
+        default=None,
+        help="Rows per block when reweighting the FLAIR probabilities (whole raster if unset).",
+    )
+    parser.add_argument(
+        "--reweight-workers",
+        type=int,
+        default=None,
+        help="Threads reweighting probability blocks in parallel with --reweight-block-size.",
+    )
+    parser.add_argument(
+        "--evaluation-block-size",
+        type=int,
+        default=None,
+        help="Rows per block when evaluating against --reference-raster (whole overlap if unset).",
+    )
+    parser.add_argument(
+        "--evaluation-workers",
+        type=int,
+        default=None,
+        help="Processes evaluating blocks in parallel with --evaluation-block-size.",
+    )
+    parser.add_argument(
+        "--evaluation-tile-size",
+        type=int,
+        default=None,
+        help="Pixels per side of the tiles of the per-tile evaluation GeoTIFF and GeoJSON.",
+    )
+    parser.add_argument(
+        "--evaluation-bootstrap",
+        type=int,
+        default=None,
+        help="Bootstrap samples of the evaluation tiles for confidence intervals (0 disables).",
+    )
+    parser.add_argument(
+        "--probability-store",
+        choices=STORE_DTYPES,
+        default=None,
+        help=(
+            "Convert the FLAIR probabilities to a quantized store with only the reweighted and "
+            "mapped classes before reweighting."
+        ),
+    )
     parser.add_argument(
         "--apply-lidar-correction",
         action=argparse.BooleanOptionalAction,
@@ -141,6 +279,15 @@ def parse_args() -> argparse.Namespace:
         default=None,
         help="Also run the legacy LiDAR vegetation derivation and the historical LiDAR+Flair fusion.",
     )
+    parser.add_argument(
+        "--write-intermediates",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help=(
+            "Also write the intermediate rasters (vegetation_map.tif, second_remapped.tif and the "
+            "legacy LiDAR rasters). They are otherwise only passed between stages in memory."
+        ),
+    )
     parser.add_argument(
         "--reference-raster",
         type=Path,
@@ -250,6 +397,9 @@ def resolve_model(args: argparse.Namespace, model_dir: Path) -> Path:
         "Downloading model from Hugging Face:",
         f"{args.model_repo}@{args.model_revision}/{args.model_filename}",
     )
+    # Imported here so the spawned workers that re-import this module do not load it.
+    from huggingface_hub import hf_hub_download
+
     downloaded = hf_hub_download(
         repo_id=args.model_repo,
         filename=args.model_filename,
@@ -263,6 +413,7 @@ def resolve_model(args: argparse.Namespace, model_dir: Path) -> Path:
 def ensure_cuda_available_if_requested(use_gpu: bool) -> None:
     if not use_gpu:
         return
+    torch = import_torch()
     if torch is None:
         raise RuntimeError(
             "GPU inference was requested, but PyTorch is not installed in this environment. "
@@ -322,6 +473,9 @@ def resolve_workflow_settings(
     workflow_config = matrix_config.get("workflow", {})
     orthophoto_config = workflow_config.get("orthophoto", {})
     fusion_config = workflow_config.get("fusion", {})
+    lidar_config = workflow_config.get("lidar", {})
+    reweight_config = workflow_config.get("reweight", {})
+    evaluation_config = workflow_config.get("evaluation", {})
     legacy_config = workflow_config.get("legacy", {})
 
     def choose(cli_value: Any, config_value: Any, fallback: Any) -> Any:
@@ -335,6 +489,28 @@ def resolve_workflow_settings(
         "resolution": float(
             choose(args.resolution, runtime_template_config.get("output_px_meters"), 1.0)
         ),
+        "lidar_chunk_points": choose(
+            args.lidar_chunk_points, lidar_config.get("chunk_points"), None
+        ),
+        "lidar_workers": int(choose(args.lidar_workers, lidar_config.get("workers"), 1)),
+        "lidar_gap_fill": str(choose(args.lidar_gap_fill, lidar_config.get("gap_fill"), "mean")),
+        "lidar_laz_backend": str(
+            choose(args.lidar_laz_backend, lidar_config.get("laz_backend"), "auto")
+        ),
+        "lidar_statistics": choose(args.lidar_statistics, lidar_config.get("statistics"), []),
+        "lidar_height_percentiles": choose(
+            args.lidar_height_percentiles, lidar_config.get("height_percentiles"), []
+        ),
+        "lidar_percentile_samples": choose(
+            args.lidar_percentile_samples, lidar_config.get("percentile_samples"), None
+        ),
+        "lidar_bbox": choose(args.lidar_bbox, lidar_config.get("bbox"), None),
+        "lidar_snap_to_grid": bool(
+            choose(args.lidar_snap_to_grid, lidar_config.get("snap_to_grid"), False)
+        ),
+        "lidar_tile_footprints": bool(
+            choose(args.lidar_tile_footprints, lidar_config.get("tile_footprints"), False)
+        ),
         "batch_size": int(choose(args.batch_size, runtime_template_config.get("batch_size"), 1)),
         "num_worker": int(choose(args.num_worker, runtime_template_config.get("num_worker"), 0)),
         "img_pixels_detection": int(
@@ -359,15 +535,68 @@ def resolve_workflow_settings(
                 False,
             )
         ),
+        "fusion_block_size": choose(args.fusion_block_size, fusion_config.get("block_size"), None),
+        "reweight_block_size": choose(
+            args.reweight_block_size, reweight_config.get("block_size"), None
+        ),
+        "reweight_workers": int(choose(args.reweight_workers, reweight_config.get("workers"), 1)),
+        "evaluation_block_size": choose(
+            args.evaluation_block_size, evaluation_config.get("block_size"), None
+        ),
+        "evaluation_workers": int(
+            choose(args.evaluation_workers, evaluation_config.get("workers"), 1)
+        ),
+        "evaluation_tile_size": choose(
+            args.evaluation_tile_size, evaluation_config.get("tile_size"), None
+        ),
+        "evaluation_bootstrap": int(
+            choose(args.evaluation_bootstrap, evaluation_config.get("bootstrap_samples"), 0)
+        ),
+        "probability_store": choose(
+            args.probability_store, reweight_config.get("probability_store"), None
+        ),
         "run_legacy_fusion": bool(
             choose(args.run_legacy_fusion, legacy_config.get("run_legacy_fusion"), False)
         ),
         "apply_lidar_correction": bool(
             choose(args.apply_lidar_correction, legacy_config.get("apply_lidar_correction"), False)
         ),
+        "write_intermediates": bool(
+            choose(args.write_intermediates, workflow_config.get("write_intermediates"), False)
+        ),
     }
     if settings["ortho_source_resolution"] is not None:
         settings["ortho_source_resolution"] = float(settings["ortho_source_resolution"])
+    if settings["lidar_chunk_points"] is not None:
+        settings["lidar_chunk_points"] = int(settings["lidar_chunk_points"])
+    if settings["fusion_block_size"] is not None:
+        settings["fusion_block_size"] = int(settings["fusion_block_size"])
+    if settings["reweight_block_size"] is not None:
+        settings["reweight_block_size"] = int(settings["reweight_block_size"])
+    if settings["evaluation_block_size"] is not None:
+        settings["evaluation_block_size"] = int(settings["evaluation_block_size"])
+    if settings["evaluation_tile_size"] is not None:
+        settings["evaluation_tile_size"] = int(settings["evaluation_tile_size"])
+    if settings["probability_store"] is not None:
+        settings["probability_store"] = str(settings["probability_store"])
+        if settings["probability_store"] not in STORE_DTYPES:
+            raise ValueError(f"workflow.reweight.probability_store must be one of {STORE_DTYPES}.")
+    if settings["lidar_bbox"] is not None:
+        settings["lidar_bbox"] = [float(value) for value in settings["lidar_bbox"]]
+        if len(settings["lidar_bbox"]) != 4:
+            raise ValueError("workflow.lidar.bbox must be [xmin, ymin, xmax, ymax].")
+    if isinstance(settings["lidar_statistics"], str):
+        settings["lidar_statistics"] = settings["lidar_statistics"].split(",")
+    settings["lidar_statistics"] = [
+        str(name).strip() for name in settings["lidar_statistics"] if str(name).strip()
+    ]
+    if isinstance(settings["lidar_height_percentiles"], str):
+        settings["lidar_height_percentiles"] = settings["lidar_height_percentiles"].split(",")
+    settings["lidar_height_percentiles"] = [
+        float(value) for value in settings["lidar_height_percentiles"] if str(value).strip()
+    ]
+    if settings["lidar_percentile_samples"] is not None:
+        settings["lidar_percentile_samples"] = int(settings["lidar_percentile_samples"])
     return settings
 
 
@@ -420,6 +649,203 @@ def stage_matching_tiles(source_dir: Path, target_dir: Path, pattern: str) -> in
     return count
 
 
+def cli_stage(
+    entry_point: Callable[[list[str]], None],
+    argv: list[str],
+    results: dict[str, Path],
+    *dependencies: object,
+) -> dict[str, Path]:
+    # Runs a script entry point in this process; `dependencies` only order the stage.
+    print(f">>> {entry_point.__module__} {' '.join(argv)}")
+    entry_point(argv)
+    return results
+
+
+def lidar_mosaic_stage(
+    lidar_tiles: object,
+    *,
+    mosaic_dir: Path,
+    mns_mnt_tiles_dir: Path,
+    mosaics: dict[str, tuple[Path, Path]],
+) -> dict[str, Path]:
+    mns_count = stage_matching_tiles(mns_mnt_tiles_dir, mosaic_dir / "mns_tiles_only", "*_mns.tif")
+    if not mns_count:
+        raise FileNotFoundError(f"No MNS tiles found in: {mns_mnt_tiles_dir}")
+    mnt_count = stage_matching_tiles(mns_mnt_tiles_dir, mosaic_dir / "mnt_tiles_only", "*_mnt.tif")
+    if not mnt_count:
+        raise FileNotFoundError(f"No MNT tiles found in: {mns_mnt_tiles_dir}")
+
+    for input_dir, output_file in mosaics.values():
+        merge_tiffs(input_dir, output_file)
+    return {product: output_file for product, (_, output_file) in mosaics.items()}
+
+
+def orthophoto_mosaic_stage(ortho_tiles: Path, *, output_file: Path) -> dict[str, Path]:
+    merge_tiffs(ortho_tiles, output_file)
+    return {"orthophoto": output_file}
+
+
+def flair_stage(
+    orthophoto: Path,
+    *,
+    args: argparse.Namespace,
+    workflow_settings: dict[str, Any],
+    paths: dict[str, Path],
+) -> dict[str, Path]:
+    # FLAIR-HUB runs from its own source tree, so inference stays in a separate interpreter.
+    model_path = resolve_model(args, paths["model_dir"])
+    flair_hub_src = ensure_flair_hub_source(
+        paths["flair_hub_source_root"],
+        repo_url=args.flair_hub_repo_url,
+        ref=args.flair_hub_ref,
+    )
+    write_runtime_config(
+        paths["config_template"],
+        paths["runtime_config"],
+        model_path=model_path,
+        orthophoto_mosaic=orthophoto,
+        flair_output_dir=paths["flair_probability_dir"],
+        run_name=args.run_name,
+        use_gpu=workflow_settings["use_gpu"],
+        batch_size=workflow_settings["batch_size"],
+        num_worker=workflow_settings["num_worker"],
+        img_pixels_detection=workflow_settings["img_pixels_detection"],
+        margin=workflow_settings["margin"],
+        output_px_meters=workflow_settings["resolution"],
+    )
+    flair_env = os.environ.copy()
+    existing_pythonpath = flair_env.get("PYTHONPATH")
+    flair_env["PYTHONPATH"] = (
+        f"{flair_hub_src}{os.pathsep}{existing_pythonpath}"
+        if existing_pythonpath
+        else str(flair_hub_src)
+    )
+    run_command(
+        [
+            sys.executable,
+            "-m",
+            "flair_zonal_detection.main",
+            "--config",
+            str(paths["runtime_config"]),
+        ],
+        cwd=paths["code_dir"],
+        env=flair_env,
+    )
+    try:
+        probability_raster = find_latest_raster(paths["flair_probability_dir"])
+    except FileNotFoundError as exc:
+        raise RuntimeError(
+            "FLAIR inference finished without producing a probability GeoTIFF. "
+            "Check the inference logs above. A common cause is requesting GPU inference "
+            "in a CPU-only environment."
+        ) from exc
+    return {"flair_probabilities": probability_raster}
+
+
+def probability_store_stage(
+    flair_probabilities: Path, *, matrix_config_path: Path, dtype: str, output_file: Path
+) -> dict[str, Path]:
+    with rasterio.open(flair_probabilities) as src:
+        if probability_bands(src).is_store:
+            print(f"Reusing probability store: {flair_probabilities}")
+            return {"flair_store": flair_probabilities}
+    bands = write_probability_store(
+        flair_probabilities,
+        output_file,
+        load_store_classes(matrix_config_path),
+        dtype=dtype,
+    )
+    print(f"Saved {dtype} probability store with {len(bands.class_ids)} band(s) to: {output_file}")
+    return {"flair_store": output_file}
+
+
+def reweight_stage(
+    flair_probabilities: RasterSource,
+    *,
+    matrix_config_path: Path,
+    block_size: int | None,
+    workers: int,
+) -> dict[str, RasterData]:
+    weights, mapping, ignore_value = load_reweight_config(matrix_config_path)
+    reweighted = reweight_probabilities(
+        flair_probabilities,
+        weights,
+        mapping,
+        ignore_value,
+        block_size=block_size,
+        workers=workers,
+    )
+    return {"reweighted": reweighted}
+
+
+def fusion_stage(
+    lidar_class: RasterSource,
+    lidar_height: RasterSource,
+    reweighted: RasterSource,
+    *,
+    products: tuple[str, ...],
+    block_size: int | None,
+    out_dir: Path,
+    options: dict[str, Any],
+) -> dict[str, RasterSource]:
+    # The reweighted raster is both the vegetation mask and the second map.
+    sources = (lidar_class, lidar_height, reweighted, reweighted)
+    names = {Path(name).stem: name for name in OUTPUT_NAMES}
+    if block_size is None:
+        outputs = fuse_sources(sources, **options)
+        return {product: outputs[names[product]] for product in products}
+    # Block mode streams its outputs straight into the GeoTIFFs.
+    written = tuple(names[product] for product in products)
+    fuse_rasters_blocks(sources, out_dir, block_size=block_size, names=written, **options)
+    return {product: out_dir / names[product] for product in products}
+
+
+def lidar_correction_stage(lidar_mns: RasterSource) -> dict[str, RasterData]:
+    return {"lidar_mns_corrected": correct_raster(lidar_mns)}
+
+
+def legacy_lidar_stage(
+    max_height: RasterSource,
+    lidar_mnt: RasterSource,
+    lidar_class: RasterSource,
+    reweighted: RasterSource,
+) -> dict[str, RasterData]:
+    height, classes = lidar_vegetation(max_height, lidar_mnt, lidar_class, reweighted)
+    return {"legacy_lidar_height": height, "legacy_lidar_classes": classes}
+
+
+def legacy_fusion_stage(
+    legacy_lidar_classes: RasterSource, reweighted: RasterSource
+) -> dict[str, RasterData]:
+    return {"legacy_fused": fuse_class_sources(legacy_lidar_classes, reweighted)}
+
+
+def evaluation_stage(
+    prediction: RasterSource,
+    *,
+    reference: Path,
+    output_dir: Path,
+    matrix_config_path: Path,
+    use_gpu: bool,
+    block_size: int | None,
+    workers: int,
+    tile_size: int | None,
+    bootstrap_samples: int,
+) -> dict[str, dict[str, object]]:
+    metrics = evaluate_prediction(
+        reference,
+        prediction,
+        output_dir,
+        matrix_config_path=matrix_config_path,
+        use_gpu=use_gpu,
+        block_size=block_size,
+        workers=workers,
+        tile_size=tile_size,
+        bootstrap_samples=bootstrap_samples,
+    )
+    return {"metrics": metrics}
+
+
 def main() -> None:
     args = parse_args()
     validate_bbox(args.xmin_start, args.xmin_end, args.ymin_start, args.ymin_end)
@@ -436,6 +862,7 @@ def main() -> None:
     lidar_height_tiles_dir = lidar_tiles_dir / "heights"
     lidar_class_tiles_dir = lidar_tiles_dir / "class"
     lidar_mns_mnt_tiles_dir = lidar_tiles_dir / "mns_mnt"
+    lidar_statistics_tiles_dir = lidar_tiles_dir / "statistics"
     lidar_mosaic_dir = run_dir / "lidar" / "mosaic"
 
     ortho_temp_dir = run_dir / "ortho" / "temp_5cm"
@@ -450,9 +877,11 @@ def main() -> None:
     lidar_class_mosaic = lidar_mosaic_dir / "lidar_class.tif"
     lidar_mns_mosaic = lidar_mosaic_dir / "lidar_mns.tif"
     lidar_mnt_mosaic = lidar_mosaic_dir / "lidar_mnt.tif"
+    lidar_statistics_mosaic = lidar_mosaic_dir / "lidar_statistics.tif"
     lidar_mns_corrected = lidar_mosaic_dir / "lidar_mns_corrected.tif"
     orthophoto_mosaic = ortho_mosaic_dir / "orthophoto_mosaic.tif"
     runtime_config = flair_dir / "runtime_config.yaml"
+    probability_store = flair_dir / "probability_store.tif"
     reweighted_raster = args.reweighted_raster or (flair_dir / "flair_vegetation_reweighted.tif")
     legacy_lidar_height = fusion_dir / "legacy_lidar_height.tif"
     legacy_lidar_classes = fusion_dir / "legacy_lidar_classes.tif"
@@ -506,6 +935,35 @@ def main() -> None:
             workflow_settings["ortho_source_resolution"], "ortho_source_resolution"
         )
     validate_positive_number(workflow_settings["ortho_output_resolution"], "ortho_output_resolution")
+    if workflow_settings["lidar_chunk_points"] is not None:
+        validate_positive_number(workflow_settings["lidar_chunk_points"], "lidar_chunk_points")
+    validate_positive_number(workflow_settings["lidar_workers"], "lidar_workers")
+    if workflow_settings["fusion_block_size"] is not None:
+        validate_positive_number(workflow_settings["fusion_block_size"], "fusion_block_size")
+    if workflow_settings["reweight_block_size"] is not None:
+        validate_positive_number(workflow_settings["reweight_block_size"], "reweight_block_size")
+    validate_positive_number(workflow_settings["reweight_workers"], "reweight_workers")
+    if workflow_settings["evaluation_block_size"] is not None:
+        validate_positive_number(
+            workflow_settings["evaluation_block_size"], "evaluation_block_size"
+        )
+    validate_positive_number(workflow_settings["evaluation_workers"], "evaluation_workers")
+    if workflow_settings["evaluation_tile_size"] is not None:
+        validate_positive_number(workflow_settings["evaluation_tile_size"], "evaluation_tile_size")
+    if workflow_settings["evaluation_bootstrap"] < 0:
+        raise ValueError("evaluation_bootstrap must not be negative.")
+    if (
+        workflow_settings["evaluation_bootstrap"]
+        and workflow_settings["evaluation_tile_size"] is None
+    ):
+        raise ValueError("evaluation_bootstrap requires evaluation_tile_size.")
+    if workflow_settings["lidar_percentile_samples"] is not None:
+        validate_positive_number(
+            workflow_settings["lidar_percentile_samples"], "lidar_percentile_samples"
+        )
+    lidar_statistics_requested = bool(
+        workflow_settings["lidar_statistics"] or workflow_settings["lidar_height_percentiles"]
+    )
     if workflow_settings["batch_size"] <= 0:
         raise ValueError("batch_size must be strictly positive.")
     if workflow_settings["num_worker"] < 0:
@@ -516,6 +974,13 @@ def main() -> None:
         raise ValueError("margin must be greater than or equal to 0.")
     ensure_cuda_available_if_requested(workflow_settings["use_gpu"])
 
+    # Products are GeoTIFF paths or rasters held in memory. Only the ones in `persist` are written
+    # to disk; the others are handed to the next stages and released once consumed.
+    stages: list[Stage] = []
+    products: dict[str, Any] = {}
+    persist: dict[str, Path] = {}
+    write_intermediates = workflow_settings["write_intermediates"]
+
     if not args.skip_download:
         ensure_inventory_file(
             nuage_json,
@@ -530,29 +995,29 @@ def main() -> None:
             download_missing=args.download_missing_inventories,
         )
 
-        run_command(
-            [
-                sys.executable,
-                "extract_nuage.py",
-                "--json-file",
-                str(nuage_json),
-                "--output-dir",
-                str(laz_dir),
-                "--xmin-start",
-                str(args.xmin_start),
-                "--xmin-end",
-                str(args.xmin_end),
-                "--ymin-start",
-                str(args.ymin_start),
-                "--ymin-end",
-                str(args.ymin_end),
-            ],
-            cwd=code_dir,
+        extract_nuage_argv = [
+            "--json-file",
+            str(nuage_json),
+            "--output-dir",
+            str(laz_dir),
+            "--xmin-start",
+            str(args.xmin_start),
+            "--xmin-end",
+            str(args.xmin_end),
+            "--ymin-start",
+            str(args.ymin_start),
+            "--ymin-end",
+            str(args.ymin_end),
+        ]
+        stages.append(
+            Stage(
+                "download_lidar",
+                partial(cli_stage, extract_nuage.main, extract_nuage_argv, {"laz_tiles": laz_dir}),
+                outputs=("laz_tiles",),
+            )
         )
 
-        ortho_extract_command = [
-            sys.executable,
-            "ortho_extract.py",
+        ortho_extract_argv = [
             "--json-file",
             str(ortho_json),
             "--output-dir",
@@ -571,260 +1036,275 @@ def main() -> None:
             str(workflow_settings["ortho_output_resolution"]),
         ]
         if workflow_settings["ortho_source_resolution"] is not None:
-            ortho_extract_command.extend(
+            ortho_extract_argv.extend(
                 ["--source-resolution", str(workflow_settings["ortho_source_resolution"])]
             )
-        run_command(ortho_extract_command, cwd=code_dir)
-
-    if args.reuse_derived_rasters:
-        require_existing_file(lidar_height_mosaic, label="LiDAR height mosaic")
-        require_existing_file(lidar_class_mosaic, label="LiDAR class mosaic")
-        require_existing_file(lidar_mns_mosaic, label="LiDAR MNS mosaic")
-        require_existing_file(lidar_mnt_mosaic, label="LiDAR MNT mosaic")
-        require_existing_file(orthophoto_mosaic, label="orthophoto mosaic")
-    else:
-        run_command(
-            [
-                sys.executable,
-                "fusion_nuage.py",
-                "--laz-folder",
-                str(laz_dir),
-                "--height-folder",
-                str(lidar_height_tiles_dir),
-                "--class-folder",
-                str(lidar_class_tiles_dir),
-                "--mns-mnt-folder",
-                str(lidar_mns_mnt_tiles_dir),
-                "--resolution",
-                str(workflow_settings["resolution"]),
-            ],
-            cwd=code_dir,
-        )
-
-        run_command(
-            [
-                sys.executable,
-                "ortho_fusion.py",
-                "--input-dir",
-                str(lidar_height_tiles_dir),
-                "--output-file",
-                str(lidar_height_mosaic),
-            ],
-            cwd=code_dir,
+        stages.append(
+            Stage(
+                "download_orthophotos",
+                partial(
+                    cli_stage,
+                    ortho_extract.main,
+                    ortho_extract_argv,
+                    {"ortho_tiles": ortho_tiles_dir},
+                ),
+                outputs=("ortho_tiles",),
+            )
         )
+    else:
+        products.update(laz_tiles=laz_dir, ortho_tiles=ortho_tiles_dir)
 
-        mns_tiles_only_dir = lidar_mosaic_dir / "mns_tiles_only"
-        mnt_tiles_only_dir = lidar_mosaic_dir / "mnt_tiles_only"
-        mns_count = stage_matching_tiles(lidar_mns_mnt_tiles_dir, mns_tiles_only_dir, "*_mns.tif")
-        mnt_count = stage_matching_tiles(lidar_mns_mnt_tiles_dir, mnt_tiles_only_dir, "*_mnt.tif")
+    lidar_mosaics = {
+        "lidar_height": (lidar_height_tiles_dir, lidar_height_mosaic),
+        "lidar_mns": (lidar_mosaic_dir / "mns_tiles_only", lidar_mns_mosaic),
+        "lidar_mnt": (lidar_mosaic_dir / "mnt_tiles_only", lidar_mnt_mosaic),
+        "lidar_class": (lidar_class_tiles_dir, lidar_class_mosaic),
+    }
+    if lidar_statistics_requested:
+        lidar_mosaics["lidar_statistics"] = (lidar_statistics_tiles_dir, lidar_statistics_mosaic)
 
-        if mns_count:
-            run_command(
-                [
-                    sys.executable,
-                    "ortho_fusion.py",
-                    "--input-dir",
-                    str(mns_tiles_only_dir),
-                    "--output-file",
-                    str(lidar_mns_mosaic),
-                ],
-                cwd=code_dir,
+    if args.reuse_derived_rasters:
+        products.update(
+            lidar_height=require_existing_file(lidar_height_mosaic, label="LiDAR height mosaic"),
+            lidar_class=require_existing_file(lidar_class_mosaic, label="LiDAR class mosaic"),
+            lidar_mns=require_existing_file(lidar_mns_mosaic, label="LiDAR MNS mosaic"),
+            lidar_mnt=require_existing_file(lidar_mnt_mosaic, label="LiDAR MNT mosaic"),
+            orthophoto=require_existing_file(orthophoto_mosaic, label="orthophoto mosaic"),
+        )
+    else:
+        lidar_raster_argv = [
+            "--laz-folder",
+            str(laz_dir),
+            "--height-folder",
+            str(lidar_height_tiles_dir),
+            "--class-folder",
+            str(lidar_class_tiles_dir),
+            "--mns-mnt-folder",
+            str(lidar_mns_mnt_tiles_dir),
+            "--resolution",
+            str(workflow_settings["resolution"]),
+            "--workers",
+            str(workflow_settings["lidar_workers"]),
+            "--gap-fill",
+            workflow_settings["lidar_gap_fill"],
+            "--laz-backend",
+            workflow_settings["lidar_laz_backend"],
+        ]
+        if workflow_settings["lidar_chunk_points"] is not None:
+            lidar_raster_argv.extend(
+                ["--chunk-points", str(workflow_settings["lidar_chunk_points"])]
+            )
+        if workflow_settings["lidar_statistics"]:
+            lidar_raster_argv.extend(
+                ["--statistics", ",".join(workflow_settings["lidar_statistics"])]
             )
-        else:
-            raise FileNotFoundError(f"No MNS tiles found in: {lidar_mns_mnt_tiles_dir}")
-        if mnt_count:
-            run_command(
+        if workflow_settings["lidar_height_percentiles"]:
+            lidar_raster_argv.extend(
                 [
-                    sys.executable,
-                    "ortho_fusion.py",
-                    "--input-dir",
-                    str(mnt_tiles_only_dir),
-                    "--output-file",
-                    str(lidar_mnt_mosaic),
-                ],
-                cwd=code_dir,
+                    "--height-percentiles",
+                    ",".join(
+                        f"{value:g}" for value in workflow_settings["lidar_height_percentiles"]
+                    ),
+                ]
             )
-        else:
-            raise FileNotFoundError(f"No MNT tiles found in: {lidar_mns_mnt_tiles_dir}")
-
-        run_command(
-            [
-                sys.executable,
-                "ortho_fusion.py",
-                "--input-dir",
-                str(lidar_class_tiles_dir),
-                "--output-file",
-                str(lidar_class_mosaic),
-            ],
-            cwd=code_dir,
-        )
+            if workflow_settings["lidar_percentile_samples"] is not None:
+                lidar_raster_argv.extend(
+                    ["--percentile-samples", str(workflow_settings["lidar_percentile_samples"])]
+                )
+        if lidar_statistics_requested:
+            lidar_raster_argv.extend(["--statistics-folder", str(lidar_statistics_tiles_dir)])
+        if workflow_settings["lidar_bbox"] is not None:
+            lidar_raster_argv.extend(
+                ["--bbox", *(str(value) for value in workflow_settings["lidar_bbox"])]
+            )
+        if workflow_settings["lidar_snap_to_grid"]:
+            lidar_raster_argv.append("--snap-to-grid")
+        if workflow_settings["lidar_tile_footprints"] and nuage_json.exists():
+            lidar_raster_argv.extend(["--tile-inventory", str(nuage_json)])
 
-        run_command(
+        stages.extend(
             [
-                sys.executable,
-                "ortho_fusion.py",
-                "--input-dir",
-                str(ortho_tiles_dir),
-                "--output-file",
-                str(orthophoto_mosaic),
-            ],
-            cwd=code_dir,
+                Stage(
+                    "rasterize_lidar",
+                    partial(
+                        cli_stage,
+                        fusion_nuage.main,
+                        lidar_raster_argv,
+                        {"lidar_tiles": lidar_tiles_dir},
+                    ),
+                    inputs=("laz_tiles",),
+                    outputs=("lidar_tiles",),
+                ),
+                Stage(
+                    "mosaic_lidar",
+                    partial(
+                        lidar_mosaic_stage,
+                        mosaic_dir=lidar_mosaic_dir,
+                        mns_mnt_tiles_dir=lidar_mns_mnt_tiles_dir,
+                        mosaics=lidar_mosaics,
+                    ),
+                    inputs=("lidar_tiles",),
+                    outputs=tuple(lidar_mosaics),
+                ),
+                Stage(
+                    "mosaic_orthophoto",
+                    partial(orthophoto_mosaic_stage, output_file=orthophoto_mosaic),
+                    inputs=("ortho_tiles",),
+                    outputs=("orthophoto",),
+                ),
+            ]
         )
 
-    probability_raster = args.flair_probability_raster
     if not args.skip_flair:
-        model_path = resolve_model(args, model_dir)
-        flair_hub_src = ensure_flair_hub_source(
-            flair_hub_source_root,
-            repo_url=args.flair_hub_repo_url,
-            ref=args.flair_hub_ref,
-        )
-        write_runtime_config(
-            config_template,
-            runtime_config,
-            model_path=model_path,
-            orthophoto_mosaic=orthophoto_mosaic,
-            flair_output_dir=flair_probability_dir,
-            run_name=args.run_name,
-            use_gpu=workflow_settings["use_gpu"],
-            batch_size=workflow_settings["batch_size"],
-            num_worker=workflow_settings["num_worker"],
-            img_pixels_detection=workflow_settings["img_pixels_detection"],
-            margin=workflow_settings["margin"],
-            output_px_meters=workflow_settings["resolution"],
-        )
-        flair_env = os.environ.copy()
-        existing_pythonpath = flair_env.get("PYTHONPATH")
-        flair_env["PYTHONPATH"] = (
-            f"{flair_hub_src}{os.pathsep}{existing_pythonpath}"
-            if existing_pythonpath
-            else str(flair_hub_src)
+        flair_paths = {
+            "code_dir": code_dir,
+            "model_dir": model_dir,
+            "flair_hub_source_root": flair_hub_source_root,
+            "config_template": config_template,
+            "runtime_config": runtime_config,
+            "flair_probability_dir": flair_probability_dir,
+        }
+        stages.append(
+            Stage(
+                "flair",
+                partial(
+                    flair_stage,
+                    args=args,
+                    workflow_settings=workflow_settings,
+                    paths=flair_paths,
+                ),
+                inputs=("orthophoto",),
+                outputs=("flair_probabilities",),
+            )
         )
-        run_command(
-            [sys.executable, "-m", "flair_zonal_detection.main", "--config", str(runtime_config)],
-            cwd=code_dir,
-            env=flair_env,
+    else:
+        products["flair_probabilities"] = args.flair_probability_raster or find_latest_raster(
+            flair_probability_dir
         )
-        try:
-            probability_raster = find_latest_raster(flair_probability_dir)
-        except FileNotFoundError as exc:
-            raise RuntimeError(
-                "FLAIR inference finished without producing a probability GeoTIFF. "
-                "Check the inference logs above. A common cause is requesting GPU inference "
-                "in a CPU-only environment."
-            ) from exc
-    elif probability_raster is None:
-        probability_raster = find_latest_raster(flair_probability_dir)
 
     if not args.skip_reweight:
-        reweight_command = [
-            sys.executable,
-            "flair_probs_reweight.py",
-            "--input",
-            str(probability_raster),
-            "--output",
-            str(reweighted_raster),
-            "--matrix-config",
-            str(matrix_config_path),
-        ]
-        run_command(reweight_command, cwd=code_dir)
+        probabilities_product = "flair_probabilities"
+        if workflow_settings["probability_store"] is not None:
+            stages.append(
+                Stage(
+                    "probability_store",
+                    partial(
+                        probability_store_stage,
+                        matrix_config_path=matrix_config_path,
+                        dtype=workflow_settings["probability_store"],
+                        output_file=probability_store,
+                    ),
+                    inputs=("flair_probabilities",),
+                    outputs=("flair_store",),
+                )
+            )
+            probabilities_product = "flair_store"
+        stages.append(
+            Stage(
+                "reweight",
+                partial(
+                    reweight_stage,
+                    matrix_config_path=matrix_config_path,
+                    block_size=workflow_settings["reweight_block_size"],
+                    workers=workflow_settings["reweight_workers"],
+                ),
+                inputs=(probabilities_product,),
+                outputs=("reweighted",),
+            )
+        )
+        persist["reweighted"] = reweighted_raster
     elif not reweighted_raster.exists():
         raise FileNotFoundError(f"Missing reweighted raster: {reweighted_raster}")
+    else:
+        products["reweighted"] = reweighted_raster
 
-    fusion_command = [
-        sys.executable,
-        "fusion_lidar_flair.py",
-        "--class-map",
-        str(lidar_class_mosaic),
-        "--height-map",
-        str(lidar_height_mosaic),
-        "--veg-mask",
-        str(reweighted_raster),
-        "--second-map",
-        str(reweighted_raster),
-        "--out-dir",
-        str(fusion_dir),
-        "--matrix-config",
-        str(matrix_config_path),
-    ]
-    if workflow_settings["modify_flair"]:
-        fusion_command.append("--modify-flair")
-    if workflow_settings["keep_class_lidar1"]:
-        fusion_command.append("--keep-class-lidar1")
-    if workflow_settings["flair_only_herbaceous"]:
-        fusion_command.append("--flair-only-herbaceous")
-
-    run_command(fusion_command, cwd=code_dir)
+    fusion_products = (
+        ("vegetation_map", "second_remapped", "final_fused")
+        if write_intermediates
+        else ("final_fused",)
+    )
+    stages.append(
+        Stage(
+            "fusion",
+            partial(
+                fusion_stage,
+                products=fusion_products,
+                block_size=workflow_settings["fusion_block_size"],
+                out_dir=fusion_dir,
+                options={
+                    "config": matrix_config,
+                    "modify_flair": workflow_settings["modify_flair"],
+                    "keep_class_lidar1": workflow_settings["keep_class_lidar1"],
+                    "flair_only_herbaceous": workflow_settings["flair_only_herbaceous"],
+                },
+            ),
+            inputs=("lidar_class", "lidar_height", "reweighted"),
+            outputs=fusion_products,
+        )
+    )
+    persist.update({product: fusion_dir / f"{product}.tif" for product in fusion_products})
 
     if workflow_settings["run_legacy_fusion"]:
-        legacy_mns_input = lidar_mns_mosaic
+        legacy_mns_input = "lidar_mns"
         if workflow_settings["apply_lidar_correction"]:
-            run_command(
-                [
-                    sys.executable,
-                    "lidarCorrection.py",
-                    "--input",
-                    str(lidar_mns_mosaic),
-                    "--output",
-                    str(lidar_mns_corrected),
-                ],
-                cwd=code_dir,
+            stages.append(
+                Stage(
+                    "lidar_correction",
+                    lidar_correction_stage,
+                    inputs=("lidar_mns",),
+                    outputs=("lidar_mns_corrected",),
+                )
             )
-            legacy_mns_input = lidar_mns_corrected
-
-        run_command(
-            [
-                sys.executable,
-                "calculateVegetationFromLidar.py",
-                "--lidar-max-height",
-                str(legacy_mns_input),
-                "--lidar-min-height",
-                str(lidar_mnt_mosaic),
-                "--lidar-class",
-                str(lidar_class_mosaic),
-                "--mask-raster",
-                str(reweighted_raster),
-                "--height-output",
-                str(legacy_lidar_height),
-                "--class-output",
-                str(legacy_lidar_classes),
-            ],
-            cwd=code_dir,
-        )
+            legacy_mns_input = "lidar_mns_corrected"
 
-        run_command(
+        stages.extend(
             [
-                sys.executable,
-                "fusionBetweenFlairAndLidar.py",
-                "--lidar-raster",
-                str(legacy_lidar_classes),
-                "--flair-raster",
-                str(reweighted_raster),
-                "--output",
-                str(legacy_fused_raster),
-            ],
-            cwd=code_dir,
+                Stage(
+                    "legacy_lidar_vegetation",
+                    legacy_lidar_stage,
+                    inputs=(legacy_mns_input, "lidar_mnt", "lidar_class", "reweighted"),
+                    outputs=("legacy_lidar_height", "legacy_lidar_classes"),
+                ),
+                Stage(
+                    "legacy_fusion",
+                    legacy_fusion_stage,
+                    inputs=("legacy_lidar_classes", "reweighted"),
+                    outputs=("legacy_fused",),
+                ),
+            ]
         )
+        persist["legacy_fused"] = legacy_fused_raster
+        if write_intermediates:
+            persist.update(
+                lidar_mns_corrected=lidar_mns_corrected,
+                legacy_lidar_height=legacy_lidar_height,
+                legacy_lidar_classes=legacy_lidar_classes,
+            )
 
     if args.reference_raster:
-        prediction_for_eval = (
-            legacy_fused_raster if workflow_settings["run_legacy_fusion"] else fusion_dir / "final_fused.tif"
+        stages.append(
+            Stage(
+                "evaluation",
+                partial(
+                    evaluation_stage,
+                    reference=args.reference_raster.resolve(),
+                    output_dir=evaluation_dir,
+                    matrix_config_path=matrix_config_path,
+                    use_gpu=workflow_settings["use_gpu"],
+                    block_size=workflow_settings["evaluation_block_size"],
+                    workers=workflow_settings["evaluation_workers"],
+                    tile_size=workflow_settings["evaluation_tile_size"],
+                    bootstrap_samples=workflow_settings["evaluation_bootstrap"],
+                ),
+                inputs=(
+                    "legacy_fused" if workflow_settings["run_legacy_fusion"] else "final_fused",
+                ),
+                outputs=("metrics",),
+            )
         )
-        evaluation_command = [
-            sys.executable,
-            "confusionMatrix.py",
-            "--reference",
-            str(args.reference_raster.resolve()),
-            "--prediction",
-            str(prediction_for_eval),
-            "--output-dir",
-            str(evaluation_dir),
-            "--matrix-config",
-            str(matrix_config_path),
-        ]
-        if workflow_settings["use_gpu"]:
-            evaluation_command.append("--use-gpu")
-        run_command(evaluation_command, cwd=code_dir)
+
+    products = run_stages(stages, products, persist=persist)
+    probability_raster = products["flair_probabilities"]
 
     print("\nWorkflow completed successfully.")
     print(f"Orthophoto mosaic: {orthophoto_mosaic}")
@@ -832,11 +1312,16 @@ def main() -> None:
     print(f"LiDAR height mosaic: {lidar_height_mosaic}")
     print(f"LiDAR MNS mosaic: {lidar_mns_mosaic}")
     print(f"LiDAR MNT mosaic: {lidar_mnt_mosaic}")
+    if lidar_statistics_requested:
+        print(f"LiDAR statistics mosaic: {lidar_statistics_mosaic}")
     print(f"FLAIR probability raster: {probability_raster}")
+    if "flair_store" in products:
+        print(f"FLAIR probability store: {products['flair_store']}")
     print(f"Reweighted vegetation raster: {reweighted_raster}")
     print(f"Final fusion directory: {fusion_dir}")
     if workflow_settings["run_legacy_fusion"]:
-        print(f"Legacy LiDAR classes: {legacy_lidar_classes}")
+        if write_intermediates:
+            print(f"Legacy LiDAR classes: {legacy_lidar_classes}")
         print(f"Legacy fused raster: {legacy_fused_raster}")
     if args.reference_raster:
         print(f"Evaluation outputs: {evaluation_dir}")
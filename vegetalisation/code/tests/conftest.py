@@ -3,14 +3,21 @@ from __future__ import annotations
 import shutil
 import sys
 import uuid
+from collections.abc import Callable
 from pathlib import Path
 
+import numpy as np
 import pytest
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
 
 ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
+from raster_products import RasterData, write_raster  # noqa: E402
+
 
 @pytest.fixture
 def workspace_tmp_path() -> Path:
@@ -22,3 +29,23 @@ def workspace_tmp_path() -> Path:
         yield path
     finally:
         shutil.rmtree(path, ignore_errors=True)
+
+
+@pytest.fixture
+def write_geotiff() -> Callable[..., Path]:
+    def write(
+        path: Path,
+        array: np.ndarray,
+        *,
+        transform: Affine | None = None,
+        crs: CRS | str | None = None,
+        nodata: float | None = None,
+    ) -> Path:
+        # A 2-D array is written as one band, a 3-D array as a band stack. The default grid has
+        # 1 m pixels and its top-left corner at (0, height).
+        if transform is None:
+            transform = from_origin(0, array.shape[-2], 1, 1)
+        profile = {"transform": transform, "crs": crs, "nodata": nodata}
+        return write_raster(RasterData(array, profile), Path(path))
+
+    return write
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import csv
+import os
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+from batch_evaluation import evaluate_batch, write_comparison_table
+from confusionMatrix import compute_confusion_percent_with_empty
+
+SHIFTED_LAMBERT = (
+    "+proj=lcc +lat_0=46.5 +lon_0=3 +lat_1=49 +lat_2=44 +x_0=700000.7 "
+    "+y_0=6600000 +ellps=GRS80 +units=m +no_defs"
+)
+
+
+def test_batch_matches_single_evaluations_and_reuses_the_cache(
+    workspace_tmp_path, write_geotiff
+) -> None:
+    rng = np.random.default_rng(9)
+    # A finer reference in a CRS shifted by 0.7 m is reprojected onto each prediction grid.
+    reference_path = write_geotiff(
+        workspace_tmp_path / "reference.tif",
+        rng.choice(np.arange(7, dtype=np.uint8), (70, 60)),
+        transform=from_origin(842002.3, 6519040.1, 0.4, 0.4),
+        crs=SHIFTED_LAMBERT,
+        nodata=0,
+    )
+    predictions = []
+    for run, origin in (("run_a", 842000), ("run_b", 842000), ("run_c", 842005)):
+        run_dir = workspace_tmp_path / "runs" / run
+        run_dir.mkdir(parents=True)
+        predictions.append(
+            write_geotiff(
+                run_dir / "final_fused.tif",
+                rng.choice(np.array([0, 1, 2, 3, np.nan], dtype=np.float32), (31, 27)),
+                transform=from_origin(origin, 6519036, 1, 1),
+                crs="EPSG:2154",
+            )
+        )
+
+    cache_dir = workspace_tmp_path / "cache"
+    results = evaluate_batch(reference_path, predictions, cache_dir=cache_dir, block_size=7)
+    assert [result["name"] for result in results] == [
+        "run_a/final_fused",
+        "run_b/final_fused",
+        "run_c/final_fused",
+    ]
+    for result, prediction in zip(results, predictions, strict=True):
+        expected = compute_confusion_percent_with_empty(reference_path, prediction)[0]
+        assert np.array_equal(result["confusion_matrix"], expected)
+    # run_a and run_b share a grid, so they share one aligned reference.
+    assert results[0]["reference_cache"] == results[1]["reference_cache"]
+    assert results[0]["reference_cache"] != results[2]["reference_cache"]
+    assert len(list(cache_dir.glob("reference_*.tif"))) == 2
+
+    cached = {path: path.stat().st_mtime_ns for path in cache_dir.glob("reference_*.tif")}
+    assert evaluate_batch(reference_path, predictions, cache_dir=cache_dir) == results
+    assert {path: path.stat().st_mtime_ns for path in cached} == cached
+
+    # A new reference replaces the cached one.
+    with rasterio.open(reference_path, "r+") as dst:
+        dst.write(np.full((70, 60), 5, dtype=np.uint8), 1)
+    stat = reference_path.stat()
+    os.utime(reference_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    results = evaluate_batch(reference_path, predictions[:1], cache_dir=cache_dir)
+    assert np.array_equal(
+        results[0]["confusion_matrix"],
+        compute_confusion_percent_with_empty(reference_path, predictions[0])[0],
+    )
+
+    table_path = workspace_tmp_path / "comparison.csv"
+    write_comparison_table(results, table_path)
+    with table_path.open(encoding="utf-8", newline="") as handle:
+        rows = list(csv.DictReader(handle))
+    assert rows[0]["name"] == "final_fused"
+    assert float(rows[0]["mean_iou"]) == results[0]["summary"]["mean_iou"]
+    assert float(rows[0]["iou_Tree"]) == results[0]["per_class"][2]["iou"]
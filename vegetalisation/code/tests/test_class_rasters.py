@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import numpy as np
+import rasterio
+
+from class_rasters import CLASS_NODATA, read_class_codes, to_class_codes
+from confusionMatrix import compute_confusion_percent_with_empty
+from fusionBetweenFlairAndLidar import fusion_classes
+
+
+def test_to_class_codes_maps_nan_nodata_and_invalid_values() -> None:
+    legacy = np.array([[0.0, 1.0, np.nan], [3.0, 2.5, 300.0], [-1.0, 254.0, 4.0]], np.float32)
+
+    codes = to_class_codes(legacy, nodata=4.0)
+
+    expected = np.array([[0, 1, 255], [3, 255, 255], [255, 254, 255]], dtype=np.uint8)
+    assert codes.dtype == np.uint8
+    assert np.array_equal(codes, expected)
+
+    stored = np.array([[0, 1], [2, 255]], dtype=np.uint8)
+    assert to_class_codes(stored, nodata=CLASS_NODATA) is stored
+    assert np.array_equal(to_class_codes(stored, nodata=0), [[255, 1], [2, 255]])
+
+
+def test_legacy_float_and_uint8_class_rasters_read_the_same(
+    workspace_tmp_path, write_geotiff
+) -> None:
+    classes = np.array([[1, 2, 3], [4, CLASS_NODATA, 2]], dtype=np.uint8)
+    legacy = np.where(classes == CLASS_NODATA, np.nan, classes).astype(np.float32)
+    legacy_path = write_geotiff(workspace_tmp_path / "legacy.tif", legacy, nodata=np.nan)
+    class_path = write_geotiff(workspace_tmp_path / "classes.tif", classes, nodata=CLASS_NODATA)
+    flair_path = write_geotiff(
+        workspace_tmp_path / "flair.tif", np.array([[0, 0, 0], [3, 1, 255]], dtype=np.uint8)
+    )
+
+    with rasterio.open(legacy_path) as legacy_src, rasterio.open(class_path) as class_src:
+        assert np.array_equal(read_class_codes(legacy_src), read_class_codes(class_src))
+
+    outputs = []
+    for name, lidar_path in (("legacy", legacy_path), ("classes", class_path)):
+        output_path = workspace_tmp_path / f"fused_{name}.tif"
+        fusion_classes(lidar_path, flair_path, output_path)
+        with rasterio.open(output_path) as fused:
+            assert fused.dtypes[0] == "uint8"
+            assert fused.nodata == CLASS_NODATA
+            outputs.append(fused.read(1))
+    assert np.array_equal(outputs[0], [[1, 1, 2], [3, 1, 1]])
+    assert np.array_equal(outputs[0], outputs[1])
+
+    reference_path = write_geotiff(
+        workspace_tmp_path / "reference.tif", np.array([[1, 2, 4], [5, 0, 2]], dtype=np.uint8)
+    )
+    legacy_cm = compute_confusion_percent_with_empty(reference_path, legacy_path)[0]
+    class_cm = compute_confusion_percent_with_empty(reference_path, class_path)[0]
+    assert np.array_equal(legacy_cm, class_cm)
+    assert int(class_cm.sum()) == 6
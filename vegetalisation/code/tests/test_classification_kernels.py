@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+import classification_kernels
+from classification_kernels import classify_thresholds, remap_classes
+
+
+def remap_classes_masks(array: np.ndarray, mapping: dict[int, int]) -> np.ndarray:
+    result = np.full(array.shape, np.nan, dtype=np.float32)
+    for source_class, target_class in mapping.items():
+        result[array == source_class] = target_class
+    return result
+
+
+def test_remap_classes_matches_mask_chain_on_float_classes(monkeypatch) -> None:
+    monkeypatch.setattr(classification_kernels, "CHUNK_PIXELS", 97)
+    rng = np.random.default_rng(0)
+    array = rng.integers(-3, 12, (40, 50)).astype(np.float32)
+    array[rng.random(array.shape) < 0.1] = np.nan
+    array[0, :5] = [0.5, 2.25, -0.0, np.inf, -np.inf]
+    mapping = {-2: 7, 1: 0, 2: 1, 3: 1, 4: 2, 5: 2, 40: 3}
+
+    result = remap_classes(array, mapping)
+
+    assert result.dtype == np.float32
+    assert np.array_equal(result, remap_classes_masks(array, mapping), equal_nan=True)
+
+
+def test_remap_classes_indexes_unsigned_rasters_directly() -> None:
+    prediction = np.arange(256, dtype=np.uint8).reshape(16, 16)
+    mapping = {8: 0, 14: 1, 12: 2, 13: 3}
+
+    result = remap_classes(prediction, mapping, fill_value=255, dtype=np.uint8)
+
+    expected = np.full(prediction.shape, 255, dtype=np.uint8)
+    for source_class, target_class in mapping.items():
+        expected[prediction == source_class] = target_class
+    assert result.dtype == np.uint8
+    assert np.array_equal(result, expected)
+
+
+def test_remap_classes_can_keep_unmapped_values_and_write_into_out() -> None:
+    array = np.array([[0.0, 3.0, np.nan], [2.5, 3.0, 9.0], [-4.0, 1.0, np.inf]], dtype=np.float32)
+    out = np.empty((3, 3), dtype=np.float32, order="F")
+
+    result = remap_classes(array, {3: 2}, keep_unmapped=True, out=out)
+
+    assert result is out
+    expected = np.array(
+        [[0.0, 2.0, np.nan], [2.5, 2.0, 9.0], [-4.0, 1.0, np.inf]], dtype=np.float32
+    )
+    assert np.array_equal(result, expected, equal_nan=True)
+
+
+def test_classify_thresholds_matches_comparisons_and_skips_masked_cells(monkeypatch) -> None:
+    monkeypatch.setattr(classification_kernels, "CHUNK_PIXELS", 97)
+    rng = np.random.default_rng(1)
+    heights = rng.uniform(-1.0, 20.0, (30, 30)).astype(np.float32)
+    heights[rng.random(heights.shape) < 0.1] = np.nan
+    heights[0, :4] = [0.3, 5.0, np.float32(0.3) - np.float32(1e-7), np.inf]
+    keep = rng.random(heights.shape) < 0.8
+
+    result = classify_thresholds(heights, (0.3, 5.0), (0, 1, 2), where=keep)
+
+    expected = np.full(heights.shape, np.nan, dtype=np.float32)
+    expected[keep & (heights < 0.3)] = 0
+    expected[keep & (heights >= 0.3) & (heights < 5.0)] = 1
+    expected[keep & (heights >= 5.0)] = 2
+    assert np.array_equal(result, expected, equal_nan=True)
+
+
+def test_classify_thresholds_rejects_inconsistent_bins() -> None:
+    values = np.zeros((2, 2), dtype=np.float32)
+    with pytest.raises(ValueError, match="one more entry"):
+        classify_thresholds(values, (1.0, 2.0), (0, 1))
+    with pytest.raises(ValueError, match="strictly increasing"):
+        classify_thresholds(values, (2.0, 1.0), (0, 1, 2))
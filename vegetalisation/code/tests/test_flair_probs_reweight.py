@@ -1,10 +1,12 @@
 from __future__ import annotations
 
 import numpy as np
+import pytest
 import rasterio
 from rasterio.transform import from_origin
 
-from flair_probs_reweight import reweight_and_filter
+from flair_probs_reweight import reweight_and_filter, reweight_probabilities
+from raster_products import RasterData
 
 
 def test_reweight_and_filter_applies_weights_and_mapping(workspace_tmp_path) -> None:
@@ -66,3 +68,54 @@ def test_reweight_and_filter_rejects_missing_band_weights(workspace_tmp_path) ->
         assert "missing class band" in str(exc)
     else:
         raise AssertionError("Expected ValueError for missing class band weight.")
+
+
+def test_block_reweighting_matches_whole_raster(workspace_tmp_path) -> None:
+    input_path = workspace_tmp_path / "probs.tif"
+    probabilities = np.random.default_rng(3).random((19, 11, 6), dtype=np.float32)
+    with rasterio.open(
+        input_path,
+        "w",
+        driver="GTiff",
+        height=11,
+        width=6,
+        count=19,
+        dtype="float32",
+        transform=from_origin(0, 11, 1, 1),
+    ) as dst:
+        dst.write(probabilities)
+    weights = {8: 1.0, 14: 2.5, 12: 1.5}
+    mapping = {8: 0, 14: 1, 12: 2}
+
+    whole_path = workspace_tmp_path / "whole.tif"
+    reweight_and_filter(input_path, whole_path, weights=weights, mapping=mapping)
+    with rasterio.open(whole_path) as src:
+        expected = src.read(1)
+        expected_profile = src.profile
+    assert set(np.unique(expected)) <= {0, 1, 2, 255}
+
+    in_memory = RasterData(probabilities, {"transform": from_origin(0, 11, 1, 1)})
+    for block_size, workers in ((1, 1), (4, 3), (64, 2)):
+        output_path = workspace_tmp_path / f"blocks_{block_size}_{workers}.tif"
+        reweight_and_filter(
+            input_path,
+            output_path,
+            weights=weights,
+            mapping=mapping,
+            block_size=block_size,
+            workers=workers,
+        )
+        with rasterio.open(output_path) as src:
+            assert src.profile == expected_profile
+            assert np.array_equal(src.read(1), expected)
+
+        for source in (input_path, in_memory):
+            result = reweight_probabilities(
+                source, weights, mapping, 255, block_size=block_size, workers=workers
+            )
+            assert np.array_equal(result.array, expected)
+    # Blocks from an in-memory stack are reweighted on copies.
+    assert np.array_equal(in_memory.array, probabilities)
+
+    with pytest.raises(ValueError, match="missing class band"):
+        reweight_probabilities(input_path, {19: 1.0}, mapping, 255, block_size=4)
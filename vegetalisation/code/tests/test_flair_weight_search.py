@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+import yaml
+from rasterio.transform import from_origin
+
+from confusionMatrix import compute_confusion_percent_with_empty
+from flair_probs_reweight import reweight_and_filter
+from flair_weight_search import (
+    candidate_confusion_matrices,
+    evaluate_candidates,
+    load_sweep_inputs,
+    search_weights,
+)
+from probability_store import write_probability_store
+from raster_products import RasterData
+
+MATRIX_CONFIG = {
+    "flair": {
+        "reweight": {
+            "weights": {0: 1, 1: 1, 2: 1, 3: 1, 4: 1},
+            "mapping": {1: 0, 2: 1, 4: 2},
+            "ignore_value": 255,
+        }
+    },
+    "evaluation": {
+        "reference_remap": {1: 0, 2: 1, 3: 2},
+        "prediction_remap": {0: 0, 1: 1, 2: 2},
+        "class_names": {0: "Grass", 1: "Bush", 2: "Tree", 3: "Other"},
+        "empty_class_id": 3,
+    },
+}
+
+
+@pytest.fixture
+def sweep_files(workspace_tmp_path, write_geotiff):
+    rng = np.random.default_rng(11)
+    config_path = workspace_tmp_path / "configs.yml"
+    config_path.write_text(yaml.safe_dump(MATRIX_CONFIG), encoding="utf-8")
+    probabilities = rng.random((5, 12, 9), dtype=np.float32)
+    probabilities_path = write_geotiff(workspace_tmp_path / "probs.tif", probabilities)
+    # The reference is shifted by two rows, so only part of it overlaps the probabilities.
+    reference = rng.choice(np.arange(5, dtype=np.uint8), (1, 12, 9))
+    reference_path = write_geotiff(
+        workspace_tmp_path / "reference.tif", reference, transform=from_origin(0, 10.0, 1, 1)
+    )
+    return config_path, probabilities, probabilities_path, reference_path
+
+
+def test_sweep_matches_reweighting_then_evaluating_each_candidate(
+    workspace_tmp_path, sweep_files
+) -> None:
+    config_path, _, probabilities_path, reference_path = sweep_files
+    store_path = workspace_tmp_path / "store.tif"
+    write_probability_store(probabilities_path, store_path, [1, 2, 4], dtype="uint16")
+    candidates = {"config": {}, "bush": {2: 2.5}, "mixed": {1: 0.5, 4: 1.7}}
+
+    expected = {}
+    for name, weights in candidates.items():
+        reweighted_path = workspace_tmp_path / f"{name}.tif"
+        reweight_and_filter(
+            probabilities_path,
+            reweighted_path,
+            weights={**MATRIX_CONFIG["flair"]["reweight"]["weights"], **weights},
+            matrix_config_path=config_path,
+        )
+        expected[name] = compute_confusion_percent_with_empty(
+            reference_path, reweighted_path, matrix_config_path=config_path
+        )[0]
+
+    # With no room in memory, the probabilities are read from disk.
+    for in_memory, memory_limit_mib in ((False, 2048), (True, 2048), (True, 0)):
+        inputs = load_sweep_inputs(
+            probabilities_path,
+            reference_path,
+            matrix_config_path=config_path,
+            in_memory=in_memory,
+            memory_limit_mib=memory_limit_mib,
+        )
+        assert isinstance(inputs.probabilities, RasterData) == (in_memory and memory_limit_mib > 0)
+        for block_size in (1, 4, 512):
+            matrices = candidate_confusion_matrices(inputs, candidates, block_size=block_size)
+            for name in candidates:
+                assert np.array_equal(matrices[name], expected[name])
+    assert int(matrices["config"].sum()) == 10 * 9
+
+    # uint16 quantization leaves these decisions unchanged.
+    inputs = load_sweep_inputs(
+        store_path, reference_path, matrix_config_path=config_path, in_memory=True
+    )
+    results = evaluate_candidates(inputs, candidates)
+    assert [result["name"] for result in results] == list(candidates)
+    for result in results:
+        assert np.array_equal(result["confusion_matrix"], expected[result["name"]])
+        assert set(result["summary"]) == {"mean_iou", "mean_precision", "mean_recall", "mean_dice"}
+
+    with pytest.raises(ValueError, match="share one band"):
+        candidate_confusion_matrices(inputs, {"bad": {0: 2.0}})
+
+
+def test_search_improves_the_objective(workspace_tmp_path, sweep_files, write_geotiff) -> None:
+    config_path, probabilities, probabilities_path, _ = sweep_files
+    # The reference is what weighting class 2 by 3 predicts.
+    weighted = probabilities * np.array([1, 1, 3, 1, 1], dtype=np.float32)[:, None, None]
+    winner = np.argmax(weighted, axis=0)
+    reference = np.select([winner == 1, winner == 2, winner == 4], [1, 2, 3], 0).astype(np.uint8)
+    reference_path = write_geotiff(workspace_tmp_path / "target.tif", reference[np.newaxis])
+
+    inputs = load_sweep_inputs(
+        probabilities_path, reference_path, matrix_config_path=config_path, in_memory=True
+    )
+    start = MATRIX_CONFIG["flair"]["reweight"]["weights"]
+    start_iou = evaluate_candidates(inputs, {"start": start})[0]["summary"]["mean_iou"]
+    best, rounds = search_weights(inputs, start, [1, 2, 4], max_rounds=20)
+
+    assert rounds[0]["improved"]
+    assert best["summary"]["mean_iou"] > start_iou
+    assert best["summary"]["mean_iou"] > 0.95
+    assert best["weights"][2] > best["weights"][1]
@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import laspy
+import numpy as np
+import pytest
+import rasterio
+
+from fusion_nuage import (
+    RasterizationOptions,
+    build_tile_outputs,
+    decompression_selection,
+    outputs_up_to_date,
+    rasterize_laz,
+    rasterize_tiles,
+)
+
+
+def write_laz(
+    path: Path,
+    *,
+    seed: int,
+    origin: tuple[float, float] = (1845000.0, 5175000.0),
+) -> None:
+    rng = np.random.default_rng(seed)
+    count = 2000
+    header = laspy.LasHeader(point_format=6, version="1.4")
+    header.scales = np.array([0.01, 0.01, 0.01])
+    header.offsets = np.array([origin[0], origin[1], 0.0])
+    las = laspy.LasData(header)
+    las.x = origin[0] + rng.uniform(0.0, 20.0, count)
+    las.y = origin[1] + rng.uniform(0.0, 20.0, count)
+    las.z = 170.0 + rng.gamma(2.0, 3.0, count)
+    las.classification = rng.choice(np.array([1, 2, 3, 5, 6], dtype=np.uint8), count)
+    las.intensity = rng.integers(0, 4000, count)
+    las.number_of_returns = rng.integers(1, 4, count)
+    las.return_number = np.minimum(rng.integers(1, 4, count), las.number_of_returns)
+    las.write(path)
+
+
+def build_jobs(laz_folder: Path, output_root: Path, resolution: float) -> list:
+    return [
+        (
+            laz_path,
+            {
+                resolution: build_tile_outputs(
+                    laz_path.stem,
+                    height_folder=output_root / "heights",
+                    class_folder=output_root / "class",
+                    mns_mnt_folder=output_root / "mns_mnt",
+                )
+            },
+        )
+        for laz_path in sorted(laz_folder.glob("*.laz"))
+    ]
+
+
+def prepare_folders(output_root: Path) -> None:
+    for name in ("heights", "class", "mns_mnt"):
+        (output_root / name).mkdir(parents=True, exist_ok=True)
+
+
+def test_rasterize_tiles_keeps_other_tiles_when_one_fails(workspace_tmp_path) -> None:
+    laz_folder = workspace_tmp_path / "laz"
+    laz_folder.mkdir()
+    write_laz(laz_folder / "1845_5175.laz", seed=1)
+    (laz_folder / "1845_5176.laz").write_bytes(b"not a laz file")
+    output_root = workspace_tmp_path / "out"
+    prepare_folders(output_root)
+    jobs = build_jobs(laz_folder, output_root, 1.0)
+
+    failed = rasterize_tiles(jobs, RasterizationOptions(), workers=2)
+
+    assert failed == [laz_folder / "1845_5176.laz"]
+    good_outputs = jobs[0][1][1.0]
+    bad_outputs = jobs[1][1][1.0]
+    assert good_outputs.exist()
+    assert good_outputs.mns.exists() and good_outputs.mnt.exists()
+    assert not bad_outputs.exist()
+
+
+def test_rasterize_tiles_pool_matches_sequential_outputs(workspace_tmp_path) -> None:
+    laz_folder = workspace_tmp_path / "laz"
+    laz_folder.mkdir()
+    write_laz(laz_folder / "1845_5175.laz", seed=1)
+    write_laz(laz_folder / "1845_5176.laz", seed=2, origin=(1845020.0, 5175000.0))
+    options = RasterizationOptions()
+
+    sequential_root = workspace_tmp_path / "sequential"
+    pool_root = workspace_tmp_path / "pool"
+    prepare_folders(sequential_root)
+    prepare_folders(pool_root)
+    sequential_jobs = build_jobs(laz_folder, sequential_root, 0.5)
+    pool_jobs = build_jobs(laz_folder, pool_root, 0.5)
+
+    assert rasterize_tiles(sequential_jobs, options, workers=1) == []
+    assert rasterize_tiles(pool_jobs, options, workers=2) == []
+
+    for (_, sequential_by_resolution), (_, pool_by_resolution) in zip(
+        sequential_jobs, pool_jobs, strict=True
+    ):
+        sequential_outputs = sequential_by_resolution[0.5]
+        pool_outputs = pool_by_resolution[0.5]
+        for sequential_path, pool_path in (
+            (sequential_outputs.height, pool_outputs.height),
+            (sequential_outputs.classes, pool_outputs.classes),
+        ):
+            with rasterio.open(sequential_path) as left, rasterio.open(pool_path) as right:
+                assert left.transform == right.transform
+                assert np.array_equal(left.read(1), right.read(1), equal_nan=True)
+
+
+def test_rasterize_laz_uses_footprint_extent_and_drops_outside_points(workspace_tmp_path) -> None:
+    laz_path = workspace_tmp_path / "1845_5175.laz"
+    write_laz(laz_path, seed=3)
+
+    (product,) = rasterize_laz(
+        laz_path,
+        (0.5,),
+        snap_to_grid=True,
+        extent=(1845000.0, 5175000.0, 1845010.0, 5175010.0),
+    ).products
+    accumulator, grid = product.accumulator, product.grid
+
+    assert (grid.xmin, grid.ymax, grid.shape) == (1845000.0, 5175010.0, (20, 20))
+    assert 0 < accumulator.point_count < 2000
+
+
+def test_statistics_are_computed_in_the_same_pass_and_chunking_is_transparent(
+    workspace_tmp_path,
+) -> None:
+    laz_path = workspace_tmp_path / "1845_5175.laz"
+    write_laz(laz_path, seed=4)
+    statistics = ("density", "class_counts", "intensity_mean", "returns_mean", "first_return_max")
+
+    (product,) = rasterize_laz(laz_path, (1.0,), statistics=statistics).products
+    (chunked_product,) = rasterize_laz(
+        laz_path, (1.0,), chunk_points=333, statistics=statistics
+    ).products
+    accumulator, grid = product.accumulator, product.grid
+    bands, descriptions = product.statistics.bands()
+    chunked_bands, _ = chunked_product.statistics.bands()
+
+    las = laspy.read(laz_path)
+    x_indices, y_indices = grid.cell_indices(las.x, las.y)
+    row, column = int(y_indices[0]), int(x_indices[0])
+    in_cell = (y_indices == row) & (x_indices == column)
+    first_returns = in_cell & (np.asarray(las.return_number) == 1)
+
+    assert descriptions[0] == "density"
+    assert descriptions[-1] == "first_return_max"
+    assert bands.shape == (len(descriptions), *grid.shape)
+    assert bands[0].sum() == accumulator.point_count == 2000
+    assert bands[0, row, column] == in_cell.sum()
+    class_2_band = descriptions.index("class_2_count")
+    assert bands[class_2_band, row, column] == (in_cell & (las.classification == 2)).sum()
+    intensity_band = descriptions.index("intensity_mean")
+    assert np.isclose(bands[intensity_band, row, column], las.intensity[in_cell].mean())
+    if first_returns.any():
+        assert bands[-1, row, column] == np.float32(las.z[first_returns].max())
+    assert np.allclose(chunked_bands, bands, equal_nan=True)
+
+
+def test_rasterize_laz_builds_every_resolution_from_one_read(workspace_tmp_path) -> None:
+    laz_path = workspace_tmp_path / "1845_5175.laz"
+    write_laz(laz_path, seed=5)
+
+    tile = rasterize_laz(laz_path, (0.5, 1.0, 2.0), chunk_points=700)
+
+    assert tile.decoded_points == 2000
+    for product in tile.products:
+        (single,) = rasterize_laz(laz_path, (product.grid.resolution,)).products
+        assert product.grid == single.grid
+        assert np.array_equal(product.accumulator.mns, single.accumulator.mns, equal_nan=True)
+        assert np.array_equal(product.accumulator.mnt, single.accumulator.mnt, equal_nan=True)
+        assert np.array_equal(product.accumulator.class_raster, single.accumulator.class_raster)
+
+
+def test_decompression_selection_only_requests_used_dimensions() -> None:
+    selection = decompression_selection({"x", "y", "z", "classification"})
+
+    assert selection.is_set_xy_returns_channel()
+    assert selection.is_set_z()
+    assert selection.is_set_classification()
+    assert not selection.is_set_rgb()
+    assert not selection.is_set_gps_time()
+    assert not selection.is_set_intensity()
+    assert decompression_selection({"intensity"}).is_set_intensity()
+
+
+def test_rasterize_laz_clips_points_to_the_requested_bbox(workspace_tmp_path) -> None:
+    laz_path = workspace_tmp_path / "1845_5175.laz"
+    write_laz(laz_path, seed=6)
+    bbox = (1845005.0, 5175005.0, 1845012.0, 5175030.0)
+
+    (product,) = rasterize_laz(laz_path, (1.0,), bbox=bbox).products
+
+    las = laspy.read(laz_path)
+    assert product.grid.xmin == 1845005.0
+    assert product.grid.ymax == pytest.approx(las.y.max())
+    assert 5175005.0 - product.grid.resolution < product.grid.ymin <= 5175005.0
+    assert product.accumulator.point_count == product.grid.contains(las.x, las.y).sum() < 2000
+
+
+def test_fingerprint_skips_unchanged_tiles_and_detects_changes(workspace_tmp_path) -> None:
+    laz_folder = workspace_tmp_path / "laz"
+    laz_folder.mkdir()
+    laz_path = laz_folder / "1845_5175.laz"
+    write_laz(laz_path, seed=1)
+    output_root = workspace_tmp_path / "out"
+    prepare_folders(output_root)
+    jobs = build_jobs(laz_folder, output_root, 1.0)
+    outputs = jobs[0][1][1.0]
+    options = RasterizationOptions()
+
+    assert not outputs_up_to_date(laz_path, outputs, 1.0, options)
+    assert rasterize_tiles(jobs, options) == []
+    assert outputs.fingerprint.exists()
+    assert outputs_up_to_date(laz_path, outputs, 1.0, options)
+    assert not outputs_up_to_date(laz_path, outputs, 0.5, options)
+    assert not outputs_up_to_date(laz_path, outputs, 1.0, RasterizationOptions(gap_fill="nearest"))
+
+    stat = laz_path.stat()
+    os.utime(laz_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert outputs_up_to_date(laz_path, outputs, 1.0, options)
+    assert str(stat.st_mtime_ns + 10**9) in outputs.fingerprint.read_text(encoding="utf-8")
+
+    write_laz(laz_path, seed=2)
+    assert not outputs_up_to_date(laz_path, outputs, 1.0, options)
+
+
+def test_height_percentiles_are_written_above_the_ground_model(workspace_tmp_path) -> None:
+    laz_path = workspace_tmp_path / "1845_5175.laz"
+    write_laz(laz_path, seed=7)
+    output_root = workspace_tmp_path / "out"
+    prepare_folders(output_root)
+    (output_root / "stats").mkdir()
+    outputs = build_tile_outputs(
+        laz_path.stem,
+        height_folder=output_root / "heights",
+        class_folder=output_root / "class",
+        mns_mnt_folder=output_root / "mns_mnt",
+        statistics_folder=output_root / "stats",
+    )
+    options = RasterizationOptions(height_percentiles=(50.0, 95.0), percentile_samples=8)
+
+    assert rasterize_tiles([(laz_path, {1.0: outputs})], options) == []
+
+    with rasterio.open(outputs.statistics) as src:
+        assert src.descriptions == ("height_p50", "height_p95")
+        percentiles = src.read()
+    with rasterio.open(outputs.height) as src:
+        height = src.read(1)
+    filled = ~np.isnan(percentiles[0])
+    assert filled.any()
+    assert np.all(percentiles[0][filled] <= percentiles[1][filled] + 1e-4)
+    assert np.all(percentiles[1][filled] <= height[filled] + 1e-4)
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from gap_filling import NEIGHBOR_OFFSETS, fill_gaps
+
+
+def fill_gaps_loop(array: np.ndarray) -> np.ndarray:
+    cleaned = array.astype(np.float32, copy=True)
+    height, width = cleaned.shape
+    while True:
+        nan_positions = np.argwhere(np.isnan(cleaned))
+        next_cleaned = cleaned.copy()
+        replaced_count = 0
+        for row_index, column_index in nan_positions:
+            neighbors = []
+            for row_offset, column_offset in NEIGHBOR_OFFSETS:
+                row, column = row_index + row_offset, column_index + column_offset
+                if 0 <= row < height and 0 <= column < width and not np.isnan(cleaned[row, column]):
+                    neighbors.append(float(cleaned[row, column]))
+            if neighbors:
+                next_cleaned[row_index, column_index] = np.float32(np.mean(neighbors))
+                replaced_count += 1
+        cleaned = next_cleaned
+        if replaced_count == 0:
+            return cleaned
+
+
+def test_fill_gaps_mean_matches_iterative_neighbor_averaging() -> None:
+    rng = np.random.default_rng(3)
+    array = (rng.uniform(-1.0, 1.0, (30, 40)) * 10.0 ** rng.integers(-6, 4, (30, 40))).astype(
+        np.float32
+    )
+    array[rng.random(array.shape) < 0.3] = np.nan
+    array[5:20, 10:30] = np.nan
+
+    expected = fill_gaps_loop(array)
+    result = fill_gaps(array, method="mean")
+
+    assert np.array_equal(result, expected, equal_nan=True)
+
+
+def test_fill_gaps_leaves_all_nan_raster_untouched() -> None:
+    array = np.full((3, 3), np.nan, dtype=np.float32)
+    assert np.isnan(fill_gaps(array)).all()
+
+
+def test_fill_gaps_nearest_copies_closest_valid_value() -> None:
+    array = np.array(
+        [
+            [1.0, np.nan, np.nan, np.nan, 9.0],
+        ],
+        dtype=np.float32,
+    )
+
+    result = fill_gaps(array, method="nearest")
+
+    assert np.array_equal(result, np.array([[1.0, 1.0, 1.0, 9.0, 9.0]], dtype=np.float32))
+
+
+def test_fill_gaps_rejects_unknown_method() -> None:
+    with pytest.raises(ValueError):
+        fill_gaps(np.zeros((2, 2), dtype=np.float32), method="bilinear")
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+import lidar_rasterization
+from lidar_rasterization import (
+    CELL_STATISTICS,
+    GROUND_EXCLUDED_CLASSES,
+    CellStatistics,
+    HeightSketch,
+    RasterAccumulator,
+    RasterGrid,
+    compute_cell_indices,
+    rasterize_points,
+)
+
+
+def rasterize_points_loop(x_indices, y_indices, z, classes, shape):
+    mns = np.full(shape, np.nan, dtype=np.float32)
+    mnt = np.full(shape, np.nan, dtype=np.float32)
+    class_raster = np.full(shape, -1, dtype=np.int16)
+    points = zip(x_indices, y_indices, z, classes, strict=True)
+    for x_index, y_index, z_value, class_value in points:
+        if (
+            np.isnan(mnt[y_index, x_index]) or z_value < mnt[y_index, x_index]
+        ) and class_value not in GROUND_EXCLUDED_CLASSES:
+            mnt[y_index, x_index] = z_value
+        if np.isnan(mns[y_index, x_index]) or z_value > mns[y_index, x_index]:
+            mns[y_index, x_index] = z_value
+            class_raster[y_index, x_index] = class_value
+    return mns, mnt, class_raster
+
+
+def test_rasterize_points_matches_point_loop_bit_for_bit() -> None:
+    rng = np.random.default_rng(42)
+    count = 5000
+    x = rng.uniform(1845000.0, 1845010.0, count)
+    y = rng.uniform(5175000.0, 5175010.0, count)
+    # Heights that collide after float32 rounding exercise the class tie-breaking rule.
+    z = 170.0 + rng.integers(0, 40, count) * 0.25 + rng.integers(0, 3, count) * 1e-6
+    classes = rng.choice(np.array([1, 2, 3, 5, 6, 9], dtype=np.uint8), count)
+    shape = (10, 10)
+    x_indices, y_indices = compute_cell_indices(
+        x, y, xmin=1845000.0, ymax=5175010.0, resolution=1.0, shape=shape
+    )
+
+    expected = rasterize_points_loop(x_indices, y_indices, z, classes, shape)
+    result = rasterize_points(x_indices, y_indices, z, classes, shape)
+
+    for expected_array, result_array in zip(expected, result, strict=True):
+        assert result_array.dtype == expected_array.dtype
+        assert np.array_equal(result_array, expected_array, equal_nan=True)
+
+
+def test_rasterize_points_leaves_empty_cells_as_nodata() -> None:
+    mns, mnt, class_raster = rasterize_points(
+        np.array([0, 0]),
+        np.array([0, 0]),
+        np.array([12.0, 15.0]),
+        np.array([2, 5], dtype=np.uint8),
+        (1, 2),
+    )
+
+    assert np.array_equal(mns, np.array([[15.0, np.nan]], dtype=np.float32), equal_nan=True)
+    assert np.array_equal(mnt, np.array([[12.0, np.nan]], dtype=np.float32), equal_nan=True)
+    assert np.array_equal(class_raster, np.array([[5, -1]], dtype=np.int16))
+
+
+def test_raster_accumulator_chunks_match_single_pass() -> None:
+    rng = np.random.default_rng(7)
+    count = 4000
+    x_indices = rng.integers(0, 6, count)
+    y_indices = rng.integers(0, 4, count)
+    z = 150.0 + rng.integers(0, 20, count) * 0.5 + rng.integers(0, 3, count) * 1e-6
+    classes = rng.choice(np.array([2, 3, 5, 6], dtype=np.uint8), count)
+    shape = (4, 6)
+
+    expected = rasterize_points(x_indices, y_indices, z, classes, shape)
+    # Chunks of 5 points leave most cells untouched by each update.
+    for chunk_points in (333, 5):
+        accumulator = RasterAccumulator(shape)
+        for start in range(0, count, chunk_points):
+            stop = start + chunk_points
+            accumulator.update(
+                x_indices[start:stop], y_indices[start:stop], z[start:stop], classes[start:stop]
+            )
+
+        assert accumulator.point_count == count
+        assert np.array_equal(accumulator.mns, expected[0], equal_nan=True)
+        assert np.array_equal(accumulator.mnt, expected[1], equal_nan=True)
+        assert np.array_equal(accumulator.class_raster, expected[2])
+
+
+def test_snapped_grids_of_adjacent_tiles_share_pixel_edges() -> None:
+    left = RasterGrid.from_bounds(1845000.13, 5175000.41, 1845999.87, 5175999.92, 0.5, snap=True)
+    right = RasterGrid.from_bounds(1846000.02, 5175000.2, 1846999.6, 5175999.7, 0.5, snap=True)
+
+    assert (left.xmin, left.ymax) == (1845000.0, 5176000.0)
+    assert left.shape == (2000, 2000)
+    assert right.xmin == left.xmax
+    assert right.transform.f == left.transform.f
+
+
+def test_cell_statistics_leave_empty_cells_as_nodata_and_reject_unknown_names() -> None:
+    statistics = CellStatistics((2, 2), ("density", "intensity_mean"), resolution=0.5)
+    statistics.update(
+        np.array([0, 0, 1]),
+        np.array([0, 0, 1]),
+        {"intensity": np.array([10, 20, 40])},
+    )
+    bands, descriptions = statistics.bands()
+
+    assert descriptions == ["density", "intensity_mean"]
+    assert np.array_equal(bands[0], [[8.0, 0.0], [0.0, 4.0]])
+    assert np.array_equal(bands[1], [[15.0, np.nan], [np.nan, 40.0]], equal_nan=True)
+    with pytest.raises(ValueError):
+        CellStatistics((2, 2), ("median",), resolution=1.0)
+
+
+def test_cell_statistics_are_independent_of_chunking() -> None:
+    rng = np.random.default_rng(5)
+    count = 2000
+    x_indices = rng.integers(0, 6, count)
+    y_indices = rng.integers(0, 4, count)
+    dimensions = {
+        "classification": rng.choice(np.array([1, 2, 3, 5, 6]), count),
+        "intensity": rng.integers(0, 4000, count),
+        "number_of_returns": rng.integers(1, 4, count),
+        "return_number": rng.integers(1, 3, count),
+        "z": 170.0 + rng.gamma(2.0, 3.0, count),
+    }
+    single = CellStatistics((4, 6), CELL_STATISTICS, resolution=1.0)
+    single.update(x_indices, y_indices, dimensions)
+    chunked = CellStatistics((4, 6), CELL_STATISTICS, resolution=1.0)
+    for start in range(0, count, 300):
+        chunk = slice(start, start + 300)
+        chunked.update(
+            x_indices[chunk],
+            y_indices[chunk],
+            {name: values[chunk] for name, values in dimensions.items()},
+        )
+    assert np.allclose(single.bands()[0], chunked.bands()[0], equal_nan=True)
+
+    # Only the requested accumulators are allocated.
+    density = CellStatistics((4, 6), ("density",), resolution=1.0)
+    assert density._class_counts is None and density._first_return_max is None
+
+
+def test_height_sketch_is_exact_below_capacity_and_independent_of_chunking(monkeypatch) -> None:
+    rng = np.random.default_rng(3)
+    count = 3000
+    x_indices = rng.integers(0, 3, count)
+    y_indices = rng.integers(0, 2, count)
+    z = 170.0 + rng.gamma(2.0, 3.0, count)
+    ground = np.full((2, 3), 170.0)
+
+    small = HeightSketch((2, 3), capacity=1000)
+    small.update(x_indices[:600], y_indices[:600], z[:600])
+    cells = y_indices[:600] * 3 + x_indices[:600]
+    expected = np.array(
+        [np.percentile(z[:600][cells == cell], [50, 90]) for cell in range(6)]
+    ).T.reshape(2, 2, 3)
+    # Heights are stored to the centimetre.
+    assert np.allclose(small.percentiles((50, 90), ground), expected - 170.0, atol=0.006)
+
+    single = HeightSketch((2, 3), capacity=16)
+    single.update(x_indices, y_indices, z)
+    chunked = HeightSketch((2, 3), capacity=16)
+    for start in range(0, count, 250):
+        stop = start + 250
+        chunked.update(x_indices[start:stop], y_indices[start:stop], z[start:stop])
+    bands = single.percentiles((50, 95), ground)
+    assert np.array_equal(bands, chunked.percentiles((50, 95), ground))
+    # Sorting the sketch one row at a time gives the same bands.
+    monkeypatch.setattr(lidar_rasterization, "PERCENTILE_CHUNK_CELLS", 1)
+    assert np.array_equal(single.percentiles((50, 95), ground), bands)
+
+    empty = HeightSketch((1, 2), capacity=4)
+    empty.update(np.array([0]), np.array([0]), np.array([12.0]))
+    assert np.array_equal(
+        empty.percentiles((90,), np.full((1, 2), 10.0)), [[[2.0, np.nan]]], equal_nan=True
+    )
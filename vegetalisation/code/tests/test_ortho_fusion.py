@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import numpy as np
+import rasterio
+from rasterio.merge import merge
+from rasterio.transform import from_origin
+
+from ortho_fusion import aligned_mosaic_layout, merge_tiffs
+
+TILE_CRS = "EPSG:3946"
+
+
+def test_merge_tiffs_places_aligned_tiles_like_rasterio_merge(
+    workspace_tmp_path, write_geotiff
+) -> None:
+    rng = np.random.default_rng(0)
+    input_dir = workspace_tmp_path / "tiles"
+    input_dir.mkdir()
+    for index, origin in enumerate(((1845000.0, 5175020.0), (1845009.5, 5175015.0))):
+        data = rng.uniform(0.0, 30.0, (40, 30)).astype(np.float32)
+        data[rng.random(data.shape) < 0.2] = np.nan
+        write_geotiff(
+            input_dir / f"tile_{index}.tif",
+            data,
+            transform=from_origin(*origin, 0.5, 0.5),
+            crs=TILE_CRS,
+            nodata=np.nan,
+        )
+
+    datasets = [rasterio.open(path) for path in sorted(input_dir.glob("*.tif"))]
+    try:
+        assert aligned_mosaic_layout(datasets) is not None
+        expected, expected_transform = merge(datasets)
+    finally:
+        for dataset in datasets:
+            dataset.close()
+
+    output_file = workspace_tmp_path / "mosaic.tif"
+    merge_tiffs(input_dir, output_file)
+
+    with rasterio.open(output_file) as mosaic:
+        assert mosaic.transform == expected_transform
+        assert np.array_equal(mosaic.read(), expected, equal_nan=True)
+
+
+def test_aligned_mosaic_layout_rejects_subpixel_offsets(workspace_tmp_path, write_geotiff) -> None:
+    data = np.ones((4, 4), dtype=np.int16)
+    write_geotiff(
+        workspace_tmp_path / "a.tif",
+        data,
+        transform=from_origin(1845000.0, 5175000.0, 0.5, 0.5),
+        crs=TILE_CRS,
+        nodata=-1,
+    )
+    write_geotiff(
+        workspace_tmp_path / "b.tif",
+        data,
+        transform=from_origin(1845001.3, 5175000.0, 0.5, 0.5),
+        crs=TILE_CRS,
+        nodata=-1,
+    )
+
+    datasets = [rasterio.open(workspace_tmp_path / name) for name in ("a.tif", "b.tif")]
+    try:
+        assert aligned_mosaic_layout(datasets) is None
+    finally:
+        for dataset in datasets:
+            dataset.close()
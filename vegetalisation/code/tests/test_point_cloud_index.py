@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import laspy
+import numpy as np
+
+from point_cloud_index import block_index_path, iter_points_in_bounds, load_block_index
+
+
+def write_sorted_laz(path: Path, count: int = 4000) -> None:
+    rng = np.random.default_rng(0)
+    header = laspy.LasHeader(point_format=6, version="1.4")
+    header.scales = np.array([0.01, 0.01, 0.01])
+    header.offsets = np.array([1845000.0, 5175000.0, 0.0])
+    las = laspy.LasData(header)
+    # Points sorted along x, like flight lines, so consecutive blocks cover separate strips.
+    las.x = 1845000.0 + np.sort(rng.uniform(0.0, 100.0, count))
+    las.y = 5175000.0 + rng.uniform(0.0, 100.0, count)
+    las.z = 170.0 + rng.gamma(2.0, 3.0, count)
+    las.write(path)
+
+
+def points_inside(chunks, bounds) -> np.ndarray:
+    xy = np.concatenate(
+        [np.column_stack((np.asarray(chunk.x), np.asarray(chunk.y))) for chunk in chunks]
+    )
+    inside = (
+        (xy[:, 0] >= bounds[0])
+        & (xy[:, 0] <= bounds[2])
+        & (xy[:, 1] >= bounds[1])
+        & (xy[:, 1] <= bounds[3])
+    )
+    return xy[inside]
+
+
+def test_block_index_limits_decoding_to_overlapping_blocks(workspace_tmp_path) -> None:
+    laz_path = workspace_tmp_path / "1845_5175.laz"
+    write_sorted_laz(laz_path)
+    bounds = (1845010.0, 5175000.0, 1845030.0, 5175050.0)
+
+    first_pass = list(iter_points_in_bounds(laz_path, bounds, block_points=500))
+    assert sum(len(chunk) for chunk in first_pass) == 4000
+    assert load_block_index(laz_path, 500).shape == (8, 4)
+
+    second_pass = list(iter_points_in_bounds(laz_path, bounds, block_points=500))
+    assert sum(len(chunk) for chunk in second_pass) < 4000
+    assert np.array_equal(points_inside(second_pass, bounds), points_inside(first_pass, bounds))
+
+
+def test_block_index_is_ignored_when_the_tile_changes(workspace_tmp_path) -> None:
+    laz_path = workspace_tmp_path / "1845_5175.laz"
+    write_sorted_laz(laz_path)
+    list(iter_points_in_bounds(laz_path, (1845000.0, 5175000.0, 1845100.0, 5175100.0)))
+    assert block_index_path(laz_path).exists()
+
+    write_sorted_laz(laz_path, count=3000)
+
+    assert load_block_index(laz_path) is None
+
+
+def test_unwritable_block_index_does_not_fail_the_read(workspace_tmp_path, monkeypatch) -> None:
+    laz_path = workspace_tmp_path / "1845_5175.laz"
+    write_sorted_laz(laz_path)
+    # Stands in for a read-only LAZ folder, which root would still be allowed to write.
+    monkeypatch.setattr(
+        "point_cloud_index.block_index_path",
+        lambda path: workspace_tmp_path / "missing" / (path.name + ".index.json"),
+    )
+
+    chunks = list(iter_points_in_bounds(laz_path, (1845000.0, 5175000.0, 1845050.0, 5175050.0)))
+
+    assert sum(len(chunk) for chunk in chunks) == 4000
+    assert load_block_index(laz_path) is None
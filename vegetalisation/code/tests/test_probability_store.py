@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+import rasterio
+
+from flair_probs_reweight import reweight_probabilities
+from probability_store import OTHER_CLASSES, probability_bands, write_probability_store
+
+WEIGHTS = {8: 1.0, 14: 2.61, 12: 1.37}
+MAPPING = {8: 0, 14: 1, 12: 2}
+
+
+def test_store_keeps_weighted_classes_and_reweights_like_the_float_raster(
+    workspace_tmp_path,
+    write_geotiff,
+) -> None:
+    # Distinct multiples of 1/255 per pixel are stored exactly and leave no argmax ties.
+    ranks = np.tile(np.arange(19, dtype=np.float32)[:, None, None], (1, 13, 7))
+    probabilities = np.random.default_rng(7).permuted(ranks, axis=0) * 13 / 255
+    input_path = write_geotiff(workspace_tmp_path / "probs.tif", probabilities)
+
+    store_path = workspace_tmp_path / "store.tif"
+    bands = write_probability_store(input_path, store_path, [14, 8, 12], block_size=4)
+    assert bands.class_ids == (8, 12, 14, OTHER_CLASSES)
+    with rasterio.open(store_path) as src:
+        assert probability_bands(src) == bands
+        assert src.count == 4
+        assert src.dtypes[0] == "uint8"
+        assert src.descriptions == ("class_8", "class_12", "class_14", "other_classes")
+        assert src.tags()["PROBABILITY_SCALE"] == "255"
+        stored = src.read()
+    others = [class_id for class_id in range(19) if class_id not in MAPPING]
+    assert np.array_equal(stored[:3], np.rint(probabilities[[8, 12, 14]] * 255))
+    assert np.array_equal(stored[3], np.rint(probabilities[others].max(axis=0) * 255))
+
+    expected = reweight_probabilities(input_path, WEIGHTS, MAPPING, 255).array
+    for block_size in (None, 5):
+        result = reweight_probabilities(store_path, WEIGHTS, MAPPING, 255, block_size=block_size)
+        assert np.array_equal(result.array, expected)
+
+    wide_path = workspace_tmp_path / "store16.tif"
+    write_probability_store(input_path, wide_path, list(MAPPING), dtype="uint16")
+    with rasterio.open(wide_path) as src:
+        assert src.dtypes[0] == "uint16"
+    assert np.array_equal(reweight_probabilities(wide_path, WEIGHTS, MAPPING, 255).array, expected)
+
+    with pytest.raises(ValueError, match="share one band"):
+        reweight_probabilities(store_path, {**WEIGHTS, 3: 2.0}, MAPPING, 255)
+    with pytest.raises(ValueError, match="missing class band"):
+        reweight_probabilities(store_path, {19: 1.0}, MAPPING, 255)
+    # A store keeping every class is still recognised from its tags.
+    full_path = workspace_tmp_path / "full.tif"
+    write_probability_store(input_path, full_path, list(range(19)))
+    for path in (store_path, full_path):
+        with pytest.raises(ValueError, match="already a probability store"):
+            write_probability_store(path, workspace_tmp_path / "again.tif", [8])
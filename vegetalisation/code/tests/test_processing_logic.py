@@ -1,11 +1,25 @@
 from __future__ import annotations
 
 import numpy as np
+import rasterio
+from rasterio.transform import from_origin
 
 from calculateVegetationFromLidar import classify_from_difference, compute_multi_vege
-from fusion_lidar_flair import create_vegetation_map, fuse_maps
+from class_rasters import CLASS_NODATA
+from fusion_lidar_flair import (
+    OUTPUT_NAMES,
+    create_vegetation_map,
+    fuse_maps,
+    fuse_rasters,
+    fuse_rasters_blocks,
+)
 from fusion_nuage import clean_mnt_mns
-from lidarCorrection import fill_nan_with_neighbors, replace_nan_by_zero
+from lidarCorrection import (
+    fill_nan_with_neighbors,
+    process_raster,
+    process_raster_blocks,
+    replace_nan_by_zero,
+)
 
 DEFAULT_MATRIX_CONFIG = {
     "lidar": {
@@ -42,6 +56,69 @@ def test_fill_nan_with_neighbors_uses_local_average() -> None:
     assert filled[1, 1] == np.mean([1.0, 1.0, 1.0, 1.0, 3.0, 1.0, 5.0, 7.0])
 
 
+def test_fill_nan_with_neighbors_matches_raster_order_loop() -> None:
+    rng = np.random.default_rng(2)
+    image = (170.0 + rng.normal(0.0, 3.0, (30, 40))).astype(np.float32)
+    image[rng.random(image.shape) < 0.3] = np.nan
+    image[5:15, 10:25] = np.nan
+    image[0, 3] = np.nan
+
+    for window_size in (3, 5):
+        expected = image.copy()
+        offset = window_size // 2
+        for row in range(offset, image.shape[0] - offset):
+            for col in range(offset, image.shape[1] - offset):
+                if np.isnan(expected[row, col]):
+                    window = expected[
+                        row - offset : row + offset + 1, col - offset : col + offset + 1
+                    ]
+                    valid = window[~np.isnan(window)]
+                    if valid.size > 0:
+                        expected[row, col] = float(np.mean(valid))
+
+        filled = fill_nan_with_neighbors(image, window_size=window_size)
+
+        assert np.array_equal(np.isnan(filled), np.isnan(expected))
+        assert np.allclose(filled, expected, rtol=1e-6, equal_nan=True)
+    assert np.isnan(filled[0, 3])
+
+
+def test_process_raster_blocks_match_whole_raster(workspace_tmp_path) -> None:
+    rng = np.random.default_rng(5)
+    image = (170.0 + rng.normal(0.0, 3.0, (47, 31))).astype(np.float32)
+    image[rng.random(image.shape) < 0.25] = np.nan
+    image[10:30, 5:20] = np.nan
+    input_path = workspace_tmp_path / "mns.tif"
+    with rasterio.open(
+        input_path,
+        "w",
+        driver="GTiff",
+        height=image.shape[0],
+        width=image.shape[1],
+        count=1,
+        dtype="float32",
+        transform=from_origin(0, 47, 1, 1),
+        nodata=np.nan,
+    ) as dst:
+        dst.write(image, 1)
+
+    expected_path = workspace_tmp_path / "whole.tif"
+    process_raster(input_path, expected_path, window_size=5)
+    with rasterio.open(expected_path) as src:
+        expected = src.read(1)
+    for block_size, workers in ((1, 1), (6, 1), (10, 3)):
+        output_path = workspace_tmp_path / f"blocks_{block_size}_{workers}.tif"
+        process_raster_blocks(
+            input_path, output_path, window_size=5, block_size=block_size, workers=workers
+        )
+        with rasterio.open(output_path) as src:
+            assert np.array_equal(src.read(1), expected)
+
+    process_raster_blocks(input_path, input_path, window_size=5, block_size=8)
+    with rasterio.open(input_path) as src:
+        assert np.array_equal(src.read(1), expected)
+
+
 def test_replace_nan_by_zero_fills_remaining_gaps() -> None:
     image = np.array([[np.nan, 2.0]], dtype=np.float32)
     assert np.array_equal(replace_nan_by_zero(image), np.array([[0.0, 2.0]], dtype=np.float32))
@@ -62,7 +139,7 @@ def test_compute_multi_vege_uses_lidar_and_mask_rules() -> None:
 def test_classify_from_difference_applies_height_thresholds() -> None:
     diff = np.array([[0.75, 2.0, 6.0, 20.0]], dtype=np.float32)
     result = classify_from_difference(diff)
-    assert np.array_equal(result, np.array([[1.0, 2.0, 3.0, 4.0]], dtype=np.float32))
+    assert np.array_equal(result, np.array([[1, 2, 3, 4]], dtype=np.uint8))
 
 
 def test_create_vegetation_map_generates_lidar_classes_and_keeps_flair_by_default() -> None:
@@ -80,12 +157,11 @@ def test_create_vegetation_map_generates_lidar_classes_and_keeps_flair_by_defaul
         keep_class_lidar1=True,
     )
 
-    assert np.array_equal(lidar_out, np.array([[0.0, 1.0], [2.0, np.nan]], dtype=np.float32), equal_nan=True)
-    assert np.array_equal(
-        flair_out,
-        np.array([[0.0, 1.0], [2.0, np.nan]], dtype=np.float32),
-        equal_nan=True,
-    )
+    expected = np.array([[0, 1], [2, CLASS_NODATA]], dtype=np.uint8)
+    assert lidar_out.dtype == np.uint8
+    assert np.array_equal(lidar_out, expected)
+    assert flair_out.dtype == np.uint8
+    assert np.array_equal(flair_out, expected)
 
 
 def test_create_vegetation_map_uses_configured_thresholds() -> None:
@@ -121,8 +197,8 @@ def test_create_vegetation_map_uses_configured_thresholds() -> None:
         keep_class_lidar1=False,
     )
 
-    assert np.array_equal(lidar_out, np.array([[0.0, 1.0], [2.0, 2.0]], dtype=np.float32))
-    assert np.array_equal(flair_out, np.array([[0.0, 1.0], [1.0, 2.0]], dtype=np.float32))
+    assert np.array_equal(lidar_out, np.array([[0, 1], [2, 2]], dtype=np.uint8))
+    assert np.array_equal(flair_out, np.array([[0, 1], [1, 2]], dtype=np.uint8))
 
 
 def test_fuse_maps_uses_flair_only_for_invalid_lidar_cells_when_restricted() -> None:
@@ -173,3 +249,32 @@ def test_clean_mnt_mns_stops_when_isolated_nans_cannot_be_interpolated() -> None
         cleaned,
         np.full((3, 3), 12.0, dtype=np.float32),
     )
+
+
+def test_fuse_rasters_blocks_match_whole_raster_fusion(workspace_tmp_path, write_geotiff) -> None:
+    rng = np.random.default_rng(11)
+    class_path = workspace_tmp_path / "class.tif"
+    height_path = workspace_tmp_path / "height.tif"
+    reweighted_path = workspace_tmp_path / "reweighted.tif"
+    classes = np.array([1, 2, 3, 4, 5, 6], dtype=np.uint8)
+    predictions = np.array([0, 1, 2, 3, 255], dtype=np.uint8)
+    write_geotiff(class_path, rng.choice(classes, (20, 25)))
+    write_geotiff(height_path, rng.uniform(-1.0, 12.0, (18, 25)).astype(np.float32))
+    write_geotiff(reweighted_path, rng.choice(predictions, (20, 23)))
+    paths = (class_path, height_path, reweighted_path, reweighted_path)
+    options = {
+        "config": DEFAULT_MATRIX_CONFIG,
+        "modify_flair": True,
+        "keep_class_lidar1": True,
+        "flair_only_herbaceous": False,
+    }
+
+    fuse_rasters(paths, workspace_tmp_path / "whole", **options)
+    for block_size in (1, 7, 64):
+        out_dir = workspace_tmp_path / f"blocks_{block_size}"
+        fuse_rasters_blocks(paths, out_dir, block_size=block_size, **options)
+        for name in OUTPUT_NAMES:
+            with rasterio.open(workspace_tmp_path / "whole" / name) as expected:
+                with rasterio.open(out_dir / name) as result:
+                    assert result.shape == expected.shape
+                    assert np.array_equal(result.read(1), expected.read(1), equal_nan=True)
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+from raster_alignment import RasterGrid, common_grid, dataset_grid, read_aligned
+from raster_products import open_raster, read_raster
+
+CRS_2154 = CRS.from_epsg(2154)
+
+
+def test_common_grid_covers_rasters_with_different_origins(
+    workspace_tmp_path, write_geotiff
+) -> None:
+    reference = np.arange(12, dtype=np.float32).reshape(3, 4)
+    shifted = np.full((2, 3), 7, dtype=np.uint8)
+    reference_path = write_geotiff(
+        workspace_tmp_path / "reference.tif",
+        reference,
+        transform=from_origin(100.0, 50.0, 1, 1),
+        crs=CRS_2154,
+    )
+    shifted_path = write_geotiff(
+        workspace_tmp_path / "shifted.tif",
+        shifted,
+        transform=from_origin(102.0, 48.0, 1, 1),
+        crs=CRS_2154,
+    )
+
+    with rasterio.open(reference_path) as first, rasterio.open(shifted_path) as second:
+        grid = common_grid([first, second])
+        assert grid.shape == (4, 5)
+        assert (grid.transform.c, grid.transform.f) == (100.0, 50.0)
+        assert common_grid([first, second], extent="reference") == dataset_grid(first)
+
+        aligned_reference = read_aligned(first, grid, fill_value=np.nan)
+        aligned_shifted = read_aligned(second, grid, fill_value=255)
+
+    expected_reference = np.full((4, 5), np.nan, dtype=np.float32)
+    expected_reference[:3, :4] = reference
+    expected_shifted = np.full((4, 5), 255, dtype=np.uint8)
+    expected_shifted[2:4, 2:5] = shifted
+    assert np.array_equal(aligned_reference, expected_reference, equal_nan=True)
+    assert aligned_shifted.dtype == np.uint8
+    assert np.array_equal(aligned_shifted, expected_shifted)
+
+
+def test_read_aligned_windows_match_the_full_read(workspace_tmp_path, write_geotiff) -> None:
+    array = np.random.default_rng(2).uniform(0.0, 10.0, (9, 7)).astype(np.float32)
+    path = write_geotiff(
+        workspace_tmp_path / "input.tif", array, transform=from_origin(3.0, 9.0, 1, 1), crs=CRS_2154
+    )
+    with rasterio.open(path) as dataset:
+        # Two columns and one row of margin before the raster, two rows after it.
+        grid = RasterGrid(from_origin(1.0, 10.0, 1.0, 1.0), 10, 12, dataset.crs)
+        full = read_aligned(dataset, grid, fill_value=np.nan, dtype=np.float64)
+        blocks = [
+            read_aligned(
+                dataset,
+                grid,
+                fill_value=np.nan,
+                dtype=np.float64,
+                window=Window(0, top, 10, min(5, 12 - top)),
+            )
+            for top in range(0, 12, 5)
+        ]
+
+    assert full.dtype == np.float64
+    assert np.array_equal(full[1:10, 2:9], array)
+    assert np.array_equal(np.concatenate(blocks), full, equal_nan=True)
+
+
+def test_read_aligned_resamples_rasters_on_another_pixel_grid(
+    workspace_tmp_path, write_geotiff
+) -> None:
+    fine = np.arange(16, dtype=np.float32).reshape(4, 4)
+    coarse = np.array([[1, 2], [3, 4]], dtype=np.float32)
+    fine_path = write_geotiff(
+        workspace_tmp_path / "fine.tif", fine, transform=from_origin(0.0, 4.0, 1, 1), crs=CRS_2154
+    )
+    coarse_path = write_geotiff(
+        workspace_tmp_path / "coarse.tif",
+        coarse,
+        transform=from_origin(0.0, 4.0, 2, 2),
+        crs=CRS_2154,
+    )
+
+    with rasterio.open(fine_path) as reference, rasterio.open(coarse_path) as other:
+        grid = common_grid([reference, other])
+        result = read_aligned(other, grid, fill_value=np.nan)
+
+    assert result.shape == (4, 4)
+    assert np.array_equal(result, np.kron(coarse, np.ones((2, 2), dtype=np.float32)))
+
+
+def test_read_aligned_fills_source_nodata_on_both_paths(workspace_tmp_path, write_geotiff) -> None:
+    classes = np.array([[1, 255, 2], [255, 3, 4]], dtype=np.uint8)
+    path = write_geotiff(workspace_tmp_path / "classes.tif", classes, crs=CRS_2154, nodata=255)
+
+    with rasterio.open(path) as dataset:
+        # The same grid is read window by window, the finer one through a warped read.
+        same = read_aligned(dataset, dataset_grid(dataset), fill_value=np.nan, dtype=np.float32)
+        fine_grid = RasterGrid(from_origin(0.0, 2.0, 0.5, 0.5), 6, 4, dataset.crs)
+        fine = read_aligned(dataset, fine_grid, fill_value=np.nan, dtype=np.float32)
+
+    expected = np.where(classes == 255, np.nan, classes).astype(np.float32)
+    assert np.array_equal(same, expected, equal_nan=True)
+    assert np.array_equal(fine[::2, ::2], expected, equal_nan=True)
+
+
+def test_in_memory_rasters_are_read_in_place_until_warped(
+    workspace_tmp_path, write_geotiff
+) -> None:
+    classes = np.array([[1, 255, 2], [255, 3, 4]], dtype=np.uint8)
+    path = write_geotiff(workspace_tmp_path / "classes.tif", classes, crs=CRS_2154, nodata=255)
+    fine_grid = RasterGrid(from_origin(0.0, 2.0, 0.5, 0.5), 6, 4, CRS_2154)
+    margin_grid = RasterGrid(from_origin(-1.0, 3.0, 1.0, 1.0), 5, 4, CRS_2154)
+
+    with rasterio.open(path) as expected, open_raster(read_raster(path)) as dataset:
+        assert dataset.bounds == expected.bounds
+        for grid in (dataset_grid(expected), margin_grid):
+            for window in (None, Window(1, 1, 2, 2)):
+                assert np.array_equal(
+                    read_aligned(dataset, grid, fill_value=np.nan, dtype=np.float32, window=window),
+                    read_aligned(
+                        expected, grid, fill_value=np.nan, dtype=np.float32, window=window
+                    ),
+                    equal_nan=True,
+                )
+        # Reads on the raster's own pixels never write it to /vsimem.
+        assert dataset._dataset is None
+
+        assert np.array_equal(
+            read_aligned(dataset, fine_grid, fill_value=np.nan, dtype=np.float32),
+            read_aligned(expected, fine_grid, fill_value=np.nan, dtype=np.float32),
+            equal_nan=True,
+        )
+        assert dataset._dataset is not None
+
+
+def test_common_grid_rejects_unknown_extent(workspace_tmp_path, write_geotiff) -> None:
+    path = write_geotiff(workspace_tmp_path / "input.tif", np.zeros((2, 2), np.float32))
+    with rasterio.open(path) as dataset:
+        with pytest.raises(ValueError, match="extent"):
+            common_grid([dataset], extent="intersection")
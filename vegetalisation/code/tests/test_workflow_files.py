@@ -2,12 +2,24 @@ from __future__ import annotations
 
 from pathlib import Path
 
+import json
+
 import numpy as np
+import pytest
 import rasterio
 import yaml
+from rasterio.enums import Resampling
 from rasterio.transform import from_origin
 
-from confusionMatrix import compute_confusion_percent_with_empty
+from confusionMatrix import (
+    bootstrap_confidence_intervals,
+    compute_confusion_percent_with_empty,
+    compute_metrics_from_confusion_matrix,
+    compute_tile_confusion_matrices,
+    evaluate_prediction,
+    sample_confusion_matrices,
+    stratified_bootstrap_intervals,
+)
 from extract_nuage import select_tiles as select_lidar_tiles
 from ortho_extract import resample_raster
 from run_workflow import (
@@ -113,8 +125,27 @@ def test_resolve_workflow_settings_prefers_configs_when_cli_absent() -> None:
             "modify_flair": None,
             "keep_class_lidar1": None,
             "flair_only_herbaceous": None,
+            "fusion_block_size": None,
+            "reweight_block_size": None,
+            "reweight_workers": None,
+            "probability_store": None,
+            "evaluation_block_size": None,
+            "evaluation_workers": None,
+            "evaluation_tile_size": None,
+            "evaluation_bootstrap": None,
             "run_legacy_fusion": None,
             "apply_lidar_correction": None,
+            "lidar_chunk_points": None,
+            "lidar_workers": None,
+            "lidar_gap_fill": None,
+            "lidar_laz_backend": None,
+            "lidar_statistics": None,
+            "lidar_height_percentiles": None,
+            "lidar_percentile_samples": None,
+            "lidar_bbox": None,
+            "lidar_snap_to_grid": None,
+            "lidar_tile_footprints": None,
+            "write_intermediates": None,
         },
     )()
 
@@ -128,19 +159,40 @@ def test_resolve_workflow_settings_prefers_configs_when_cli_absent() -> None:
     }
     matrix_config = {
         "workflow": {
+            "write_intermediates": True,
             "orthophoto": {
                 "source_resolution": 0.05,
                 "output_resolution": 0.25,
             },
+            "reweight": {"block_size": 512, "workers": 4, "probability_store": "uint16"},
+            "evaluation": {
+                "block_size": 1024,
+                "workers": 3,
+                "tile_size": 256,
+                "bootstrap_samples": 200,
+            },
             "fusion": {
                 "modify_flair": True,
                 "keep_class_lidar1": True,
                 "flair_only_herbaceous": True,
+                "block_size": 2048,
             },
             "legacy": {
                 "run_legacy_fusion": True,
                 "apply_lidar_correction": True,
             },
+            "lidar": {
+                "chunk_points": 2_000_000,
+                "workers": 8,
+                "gap_fill": "nearest",
+                "laz_backend": "single",
+                "statistics": ["density", "class_counts"],
+                "height_percentiles": [50, 90],
+                "percentile_samples": 24,
+                "bbox": [1845000, 5175000, 1845500, 5175250],
+                "snap_to_grid": True,
+                "tile_footprints": True,
+            },
         }
     }
 
@@ -161,8 +213,27 @@ def test_resolve_workflow_settings_prefers_configs_when_cli_absent() -> None:
     assert settings["modify_flair"] is True
     assert settings["keep_class_lidar1"] is True
     assert settings["flair_only_herbaceous"] is True
+    assert settings["fusion_block_size"] == 2048
+    assert settings["reweight_block_size"] == 512
+    assert settings["reweight_workers"] == 4
+    assert settings["probability_store"] == "uint16"
+    assert settings["evaluation_block_size"] == 1024
+    assert settings["evaluation_workers"] == 3
+    assert settings["evaluation_tile_size"] == 256
+    assert settings["evaluation_bootstrap"] == 200
     assert settings["run_legacy_fusion"] is True
     assert settings["apply_lidar_correction"] is True
+    assert settings["lidar_chunk_points"] == 2_000_000
+    assert settings["lidar_workers"] == 8
+    assert settings["lidar_gap_fill"] == "nearest"
+    assert settings["lidar_laz_backend"] == "single"
+    assert settings["lidar_statistics"] == ["density", "class_counts"]
+    assert settings["lidar_height_percentiles"] == [50.0, 90.0]
+    assert settings["lidar_percentile_samples"] == 24
+    assert settings["lidar_bbox"] == [1845000.0, 5175000.0, 1845500.0, 5175250.0]
+    assert settings["lidar_snap_to_grid"] is True
+    assert settings["lidar_tile_footprints"] is True
+    assert settings["write_intermediates"] is True
 
 
 def test_load_yaml_config_reads_baseline_workflow_settings() -> None:
@@ -189,7 +260,7 @@ def test_ensure_cuda_available_if_requested_rejects_missing_cuda(monkeypatch) ->
     class DummyTorch:
         cuda = DummyCuda()
 
-    monkeypatch.setattr("run_workflow.torch", DummyTorch)
+    monkeypatch.setattr("run_workflow.import_torch", lambda: DummyTorch)
 
     try:
         ensure_cuda_available_if_requested(True)
@@ -417,6 +488,306 @@ def test_confusion_matrix_uses_only_overlapping_extent(workspace_tmp_path) -> No
     assert class_names[2] == "Arbre"
 
 
+def test_block_confusion_matrix_matches_the_whole_overlap(workspace_tmp_path) -> None:
+    rng = np.random.default_rng(4)
+    # The reference is finer than the prediction, offset from it and partly outside it.
+    reference_path = workspace_tmp_path / "reference_blocks.tif"
+    with rasterio.open(
+        reference_path,
+        "w",
+        driver="GTiff",
+        height=83,
+        width=61,
+        count=1,
+        dtype="uint8",
+        nodata=0,
+        crs="EPSG:2154",
+        transform=from_origin(842002.3, 6519040.1, 0.4, 0.4),
+    ) as dst:
+        dst.write(rng.choice(np.arange(7, dtype=np.uint8), (83, 61)), 1)
+    prediction_path = workspace_tmp_path / "prediction_blocks.tif"
+    prediction = rng.choice(np.array([0, 1, 2, 3, np.nan], dtype=np.float32), (31, 27))
+    with rasterio.open(
+        prediction_path,
+        "w",
+        driver="GTiff",
+        height=31,
+        width=27,
+        count=1,
+        dtype="float32",
+        crs="EPSG:2154",
+        transform=from_origin(842000, 6519036, 1, 1),
+    ) as dst:
+        dst.write(prediction, 1)
+    # A reference in a CRS shifted by 0.7 m is reprojected onto the prediction grid instead.
+    reprojected_path = workspace_tmp_path / "reference_shifted_crs.tif"
+    with rasterio.open(reference_path) as src:
+        profile = src.profile.copy()
+        profile.update(
+            crs=(
+                "+proj=lcc +lat_0=46.5 +lon_0=3 +lat_1=49 +lat_2=44 +x_0=700000.7 "
+                "+y_0=6600000 +ellps=GRS80 +units=m +no_defs"
+            )
+        )
+        with rasterio.open(reprojected_path, "w", **profile) as dst:
+            dst.write(src.read())
+
+    for reference in (reference_path, reprojected_path):
+        expected = compute_confusion_percent_with_empty(reference, prediction_path)[0]
+        assert 0 < int(expected.sum()) < prediction.size
+        for block_size in (1, 4, 100):
+            cm, cm_percent, _ = compute_confusion_percent_with_empty(
+                reference, prediction_path, block_size=block_size
+            )
+            assert np.array_equal(cm, expected)
+            assert np.allclose(cm_percent.sum(axis=1)[cm.sum(axis=1) > 0], 100)
+    expected = compute_confusion_percent_with_empty(reference_path, prediction_path)[0]
+    cm = compute_confusion_percent_with_empty(
+        reference_path, prediction_path, block_size=7, workers=2
+    )[0]
+    assert np.array_equal(cm, expected)
+
+
+def test_tile_confusion_matrices_sum_to_the_whole_overlap(workspace_tmp_path) -> None:
+    rng = np.random.default_rng(5)
+    reference_path = workspace_tmp_path / "reference_tiles.tif"
+    prediction_path = workspace_tmp_path / "prediction_tiles.tif"
+    for path, values, shape, origin in (
+        (reference_path, np.arange(7, dtype=np.uint8), (23, 19), (842003, 6519040)),
+        (prediction_path, np.arange(5, dtype=np.uint8), (20, 22), (842000, 6519036)),
+    ):
+        with rasterio.open(
+            path,
+            "w",
+            driver="GTiff",
+            height=shape[0],
+            width=shape[1],
+            count=1,
+            dtype="uint8",
+            crs="EPSG:2154",
+            transform=from_origin(*origin, 1, 1),
+        ) as dst:
+            dst.write(rng.choice(values, shape), 1)
+
+    expected = compute_confusion_percent_with_empty(reference_path, prediction_path)[0]
+    tiles = compute_tile_confusion_matrices(reference_path, prediction_path, tile_size=8)
+    # The overlap is 19 x 19 pixels.
+    assert tiles.matrices.shape[:2] == (3, 3)
+    assert np.array_equal(tiles.matrices.sum(axis=(0, 1)), expected)
+    assert tiles.tile_bounds(2, 2) == (842019.0, 6519017.0, 842022.0, 6519020.0)
+    for block_size in (1, 5, 100):
+        other = compute_tile_confusion_matrices(
+            reference_path, prediction_path, tile_size=8, block_size=block_size
+        )
+        assert np.array_equal(other.matrices, tiles.matrices)
+
+    output_dir = workspace_tmp_path / "tile_evaluation"
+    metrics = evaluate_prediction(
+        reference_path, prediction_path, output_dir, tile_size=8, bootstrap_samples=50
+    )
+    with rasterio.open(output_dir / "tile_metrics.tif") as src:
+        assert src.shape == (3, 3)
+        # Edge tiles are clipped to the overlap in the GeoJSON only.
+        assert tuple(src.bounds) == (842003.0, 6519012.0, 842027.0, 6519036.0)
+        assert src.descriptions[:2] == ("accuracy", "mean_iou")
+        accuracy = src.read(1)
+    cm = tiles.matrices[1, 0]
+    assert np.isclose(accuracy[1, 0], np.trace(cm) / cm.sum())
+    with (output_dir / "tile_metrics.geojson").open(encoding="utf-8") as handle:
+        collection = json.load(handle)
+    assert len(collection["features"]) == 9
+    assert collection["crs"]["properties"]["name"] == "urn:ogc:def:crs:EPSG::2154"
+
+    intervals = metrics["confidence_intervals"]
+    assert intervals["tiles"] == 9 and intervals["samples"] == 50
+    low, high = intervals["summary"]["mean_iou"]
+    assert low <= high
+    assert intervals == {
+        "tile_size": 8,
+        **bootstrap_confidence_intervals(tiles.matrices, tiles.class_names, samples=50),
+    }
+
+
+def test_sampled_confusion_matrix_estimates_the_whole_overlap(workspace_tmp_path) -> None:
+    rng = np.random.default_rng(6)
+    prediction_path = workspace_tmp_path / "prediction_sample.tif"
+    with rasterio.open(
+        prediction_path,
+        "w",
+        driver="GTiff",
+        height=45,
+        width=38,
+        count=1,
+        dtype="uint8",
+        crs="EPSG:2154",
+        transform=from_origin(842000, 6519036, 1, 1),
+        tiled=True,
+        blockxsize=16,
+        blockysize=16,
+    ) as dst:
+        dst.write(rng.choice(np.arange(5, dtype=np.uint8), (45, 38)), 1)
+    # A finer reference, offset from the prediction, and the same reference in a shifted CRS.
+    references = []
+    for name, crs in (
+        ("reference_sample.tif", "EPSG:2154"),
+        (
+            "reference_sample_shifted.tif",
+            "+proj=lcc +lat_0=46.5 +lon_0=3 +lat_1=49 +lat_2=44 +x_0=700000.7 "
+            "+y_0=6600000 +ellps=GRS80 +units=m +no_defs",
+        ),
+    ):
+        references.append(workspace_tmp_path / name)
+        with rasterio.open(
+            references[-1],
+            "w",
+            driver="GTiff",
+            height=110,
+            width=90,
+            count=1,
+            dtype="uint8",
+            nodata=0,
+            crs=crs,
+            tiled=True,
+            blockxsize=16,
+            blockysize=16,
+            # Off the prediction pixel centres: nearest-neighbour ties may go either way when
+            # the reprojection is split into windows.
+            transform=from_origin(842001.33, 6519038.17, 0.4, 0.4),
+        ) as dst:
+            dst.write(np.random.default_rng(1).choice(np.arange(7, dtype=np.uint8), (110, 90)), 1)
+
+    for reference in references:
+        expected = compute_confusion_percent_with_empty(reference, prediction_path)[0]
+        # Sampling every block reads the whole overlap once.
+        for block_size in (1, 7, 64):
+            sampled = sample_confusion_matrices(
+                reference, prediction_path, fraction=1.0, block_size=block_size
+            )
+            assert np.array_equal(sampled.matrices.sum(axis=0), expected)
+            assert sampled.pixels_read == sampled.overlap_pixels == int(expected.sum())
+
+    expected = compute_confusion_percent_with_empty(references[0], prediction_path)[0]
+    # Blocks of a striped prediction span the whole overlap width.
+    striped_path = workspace_tmp_path / "prediction_sample_striped.tif"
+    with rasterio.open(prediction_path) as src:
+        profile = src.profile.copy()
+        profile.update(tiled=False)
+        profile.pop("blockxsize")
+        profile.pop("blockysize")
+        with rasterio.open(striped_path, "w", **profile) as dst:
+            dst.write(src.read())
+    sampled = sample_confusion_matrices(references[0], striped_path, fraction=1.0, block_size=5)
+    assert len(sampled.matrices) == 9
+    assert np.array_equal(sampled.matrices.sum(axis=0), expected)
+
+    sampled = sample_confusion_matrices(references[0], prediction_path, fraction=0.3, block_size=5)
+    # 36 x 42 overlap pixels make 8 x 9 blocks.
+    assert sampled.total_blocks == 72 and sampled.stratum_sizes.sum() == 72
+    assert sampled.pixels_read < sampled.overlap_pixels
+    # Every stratum has two sampled blocks or is read in full.
+    drawn = np.bincount(sampled.strata, minlength=len(sampled.stratum_sizes))
+    assert np.all((drawn >= 2) | (drawn == sampled.stratum_sizes))
+    # Block weights scale the sampled counts back to the whole overlap.
+    assert abs(sampled.estimate().sum() / expected.sum() - 1) < 0.15
+
+    metrics = evaluate_prediction(
+        references[0],
+        prediction_path,
+        workspace_tmp_path / "sample_evaluation",
+        sample_fraction=0.3,
+        sample_block_size=5,
+        bootstrap_samples=100,
+        sample_check=True,
+    )
+    assert set(metrics["summary"]) == {"mean_iou", "mean_precision", "mean_recall", "mean_dice"}
+    assert metrics["confidence_intervals"]["method"] == "stratified_block_bootstrap"
+    low, high = metrics["confidence_intervals"]["summary"]["mean_iou"]
+    assert low <= metrics["summary"]["mean_iou"] <= high
+    full_pass = metrics["sampling"]["full_pass"]
+    class_names = {0: "Grass", 1: "Bush", 2: "Tree", 3: "Other"}
+    exact = compute_metrics_from_confusion_matrix(expected, class_names)
+    assert full_pass["summary"] == exact["summary"]
+    assert abs(full_pass["error"]["mean_iou"]) < 0.05
+    # A census has no sampling error.
+    metrics = evaluate_prediction(
+        references[0],
+        prediction_path,
+        workspace_tmp_path / "census_evaluation",
+        sample_fraction=1.0,
+        sample_block_size=5,
+        bootstrap_samples=50,
+    )
+    assert metrics["summary"] == exact["summary"]
+    assert (
+        metrics["confidence_intervals"]["summary"]["mean_iou"] == [exact["summary"]["mean_iou"]] * 2
+    )
+    # One block out of several gives no variance, so no interval is reported.
+    assert (
+        stratified_bootstrap_intervals(
+            sampled.matrices[:3], np.array([0, 0, 1]), np.array([5, 4]), class_names
+        )
+        is None
+    )
+    with pytest.raises(ValueError, match="cannot be combined"):
+        evaluate_prediction(
+            references[0], prediction_path, workspace_tmp_path, sample_fraction=0.3, tile_size=8
+        )
+    with pytest.raises(ValueError, match="Sample fraction"):
+        sample_confusion_matrices(references[0], prediction_path, fraction=1.5)
+
+
+def test_sampled_confusion_matrix_draws_blocks_of_rare_reference_classes(
+    workspace_tmp_path,
+) -> None:
+    paths = {}
+    for name, array, nodata in (
+        ("prediction", np.zeros((64, 64), dtype=np.uint8), None),
+        ("reference", np.ones((64, 64), dtype=np.uint8), 0),
+    ):
+        if name == "reference":
+            # Street trees in a single block of 8 x 8 pixels.
+            array[42:46, 10:14] = 4
+        paths[name] = workspace_tmp_path / f"{name}_rare.tif"
+        with rasterio.open(
+            paths[name],
+            "w",
+            driver="GTiff",
+            height=64,
+            width=64,
+            count=1,
+            dtype="uint8",
+            nodata=nodata,
+            crs="EPSG:2154",
+            transform=from_origin(842000, 6519064, 1, 1),
+            tiled=True,
+            blockxsize=16,
+            blockysize=16,
+        ) as dst:
+            dst.write(array, 1)
+
+    # Without overviews the class profile would decode the whole reference, so it is skipped.
+    sampled = sample_confusion_matrices(
+        paths["reference"], paths["prediction"], fraction=0.05, block_size=8
+    )
+    assert not sampled.class_strata
+    assert sampled.reference_pixels_read == sampled.pixels_read
+
+    with rasterio.open(paths["reference"], "r+") as dst:
+        dst.build_overviews([2], Resampling.nearest)
+    for seed in range(5):
+        sampled = sample_confusion_matrices(
+            paths["reference"], paths["prediction"], fraction=0.05, block_size=8, seed=seed
+        )
+        assert sampled.class_strata
+        # The tree block is a stratum of its own, read in full.
+        assert len(sampled.matrices) < 8
+        assert sampled.estimate()[2].sum() == 16
+        assert abs(sampled.estimate().sum() - 64 * 64) < 1e-6
+        # The 32 x 32 overview read for the profile counts as reference pixels.
+        assert sampled.reference_pixels_read == sampled.pixels_read + 32 * 32
+        assert sampled.estimated_speedup() == 2 * 64 * 64 / (2 * sampled.pixels_read + 32 * 32)
+
+
 def test_confusion_matrix_uses_mapping_from_matrix_config(workspace_tmp_path) -> None:
     reference_path = workspace_tmp_path / "reference_custom.tif"
     prediction_path = workspace_tmp_path / "prediction_custom.tif"
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+from functools import partial
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from confusionMatrix import compute_confusion_percent_with_empty
+from flair_probs_reweight import reweight_and_filter, reweight_probabilities
+from fusion_lidar_flair import fuse_rasters
+from raster_products import RasterData, open_raster
+from run_workflow import fusion_stage
+from workflow_stages import Stage, order_stages, run_stages
+
+FUSION_OPTIONS = {
+    "config": {
+        "lidar": {
+            "vegetation_classes": [3, 4, 5, 8],
+            "optional_class_1": 1,
+            "mask_excluded_value": 255,
+            "height_thresholds": {"low_to_medium": 0.3, "medium_to_high": 5.0},
+        },
+        "flair": {
+            "mask_excluded_value": 255,
+            "height_thresholds": {"low_to_medium": 0.3, "medium_to_high": 5.0},
+        },
+    },
+    "modify_flair": False,
+    "keep_class_lidar1": True,
+    "flair_only_herbaceous": False,
+}
+WEIGHTS = {1: 1.5}
+MAPPING = {0: 0, 1: 1, 2: 2}
+TRANSFORM = from_origin(10.0, 20.0, 1.0, 1.0)
+
+
+def test_in_memory_stages_match_the_file_based_scripts(workspace_tmp_path, write_geotiff) -> None:
+    rng = np.random.default_rng(5)
+    probabilities_path = write_geotiff(
+        workspace_tmp_path / "probabilities.tif",
+        rng.random((4, 9, 11), dtype=np.float32),
+        transform=TRANSFORM,
+    )
+    class_path = write_geotiff(
+        workspace_tmp_path / "class.tif",
+        rng.choice(np.arange(1, 7, dtype=np.uint8), (9, 11)),
+        transform=TRANSFORM,
+    )
+    height_path = write_geotiff(
+        workspace_tmp_path / "height.tif",
+        rng.uniform(-1.0, 12.0, (9, 11)).astype(np.float32),
+        transform=TRANSFORM,
+    )
+
+    reweighted_path = workspace_tmp_path / "scripts" / "reweighted.tif"
+    reweight_and_filter(probabilities_path, reweighted_path, WEIGHTS, MAPPING, ignore_value=255)
+    paths = (class_path, height_path, reweighted_path, reweighted_path)
+    fuse_rasters(paths, workspace_tmp_path / "scripts", **FUSION_OPTIONS)
+
+    stages = [
+        # Listed before the stage producing its input on purpose.
+        Stage(
+            "fusion",
+            partial(
+                fusion_stage,
+                products=("final_fused",),
+                block_size=None,
+                out_dir=workspace_tmp_path / "graph",
+                options=FUSION_OPTIONS,
+            ),
+            inputs=("lidar_class", "lidar_height", "reweighted"),
+            outputs=("final_fused",),
+        ),
+        Stage(
+            "reweight",
+            lambda probabilities: {
+                "reweighted": reweight_probabilities(probabilities, WEIGHTS, MAPPING, 255)
+            },
+            inputs=("probabilities",),
+            outputs=("reweighted",),
+        ),
+    ]
+    final_path = workspace_tmp_path / "graph" / "final_fused.tif"
+    products = run_stages(
+        stages,
+        {
+            "probabilities": probabilities_path,
+            "lidar_class": class_path,
+            "lidar_height": height_path,
+        },
+        persist={"final_fused": final_path},
+    )
+
+    # The reweighted raster only lived in memory and was released once fused.
+    assert "reweighted" not in products
+    assert sorted(path.name for path in (workspace_tmp_path / "graph").iterdir()) == [
+        "final_fused.tif"
+    ]
+    fused = products["final_fused"]
+    assert isinstance(fused, RasterData)
+    with rasterio.open(workspace_tmp_path / "scripts" / "final_fused.tif") as expected:
+        assert np.array_equal(fused.array, expected.read(1))
+        with rasterio.open(final_path) as written:
+            assert written.profile == expected.profile
+            assert np.array_equal(written.read(1), expected.read(1))
+
+    with open_raster(fused) as dataset:
+        assert dataset.transform == TRANSFORM
+        assert dataset.nodata == 255
+    reference_path = write_geotiff(
+        workspace_tmp_path / "reference.tif",
+        rng.choice(np.arange(6, dtype=np.uint8), (9, 11)),
+        transform=TRANSFORM,
+    )
+    from_memory = compute_confusion_percent_with_empty(reference_path, fused)[0]
+    from_file = compute_confusion_percent_with_empty(reference_path, final_path)[0]
+    assert np.array_equal(from_memory, from_file)
+
+
+def test_order_stages_rejects_missing_cyclic_and_duplicate_products() -> None:
+    def noop(*_inputs):
+        return {}
+
+    first = Stage("first", noop, inputs=("b",), outputs=("c",))
+    second = Stage("second", noop, inputs=("a",), outputs=("b",))
+    assert order_stages([first, second], {"a"}) == [second, first]
+
+    with pytest.raises(ValueError, match="No stage produces: a"):
+        order_stages([first, second])
+    with pytest.raises(ValueError, match="cycle"):
+        order_stages([first, Stage("loop", noop, inputs=("c",), outputs=("b",))])
+    with pytest.raises(ValueError, match="more than once"):
+        order_stages([second], {"b"})
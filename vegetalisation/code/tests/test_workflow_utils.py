@@ -1,11 +1,14 @@
 from __future__ import annotations
 
+import hashlib
+
 import numpy as np
 import pytest
 
 from workflow_utils import (
     align_array_to_shape,
     coerce_int_key_mapping,
+    file_sha256,
     load_json_numeric_mapping,
     max_shape,
     validate_bbox,
@@ -52,3 +55,11 @@ def test_load_json_numeric_mapping_reads_float_values(workspace_tmp_path) -> Non
     mapping_path.write_text('{"8": 1.25, "14": 0.5}', encoding="utf-8")
 
     assert load_json_numeric_mapping(mapping_path, "weights") == {8: 1.25, 14: 0.5}
+
+
+def test_file_sha256_matches_hashlib_across_chunks(workspace_tmp_path) -> None:
+    path = workspace_tmp_path / "data.bin"
+    payload = bytes(range(256)) * 10
+    path.write_bytes(payload)
+
+    assert file_sha256(path, chunk_size=100) == hashlib.sha256(payload).hexdigest()
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import time
+from collections.abc import Callable, Collection, Mapping, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from raster_products import RasterData, write_raster
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    run: Callable[..., Mapping[str, Any]]
+    inputs: tuple[str, ...] = ()
+    outputs: tuple[str, ...] = ()
+
+
+def order_stages(stages: Sequence[Stage], available: Collection[str] = ()) -> list[Stage]:
+    producers: dict[str, str] = {}
+    for stage in stages:
+        for product in stage.outputs:
+            if product in producers or product in available:
+                raise ValueError(f"Product {product!r} is produced more than once.")
+            producers[product] = stage.name
+
+    # Stages keep their listed order unless an input comes from a later stage.
+    ordered: list[Stage] = []
+    ready = set(available)
+    pending = list(stages)
+    while pending:
+        for stage in pending:
+            if all(product in ready for product in stage.inputs):
+                break
+        else:
+            missing = sorted(
+                {product for stage in pending for product in stage.inputs} - ready - set(producers)
+            )
+            if missing:
+                raise ValueError(f"No stage produces: {', '.join(missing)}")
+            names = ", ".join(stage.name for stage in pending)
+            raise ValueError(f"Stages depend on each other in a cycle: {names}")
+        pending.remove(stage)
+        ordered.append(stage)
+        ready.update(stage.outputs)
+    return ordered
+
+
+def run_stages(
+    stages: Sequence[Stage],
+    products: Mapping[str, Any] | None = None,
+    *,
+    persist: Mapping[str, Path] | None = None,
+) -> dict[str, Any]:
+    products = dict(products or {})
+    persist = persist or {}
+    ordered = order_stages(stages, products)
+
+    # In-memory rasters are released after their last consumer. Products that no stage reads
+    # are the results of the graph and are returned.
+    last_use = {product: index for index, stage in enumerate(ordered) for product in stage.inputs}
+    for index, stage in enumerate(ordered):
+        print(f"\n==> {stage.name}")
+        start = time.perf_counter()
+        results = stage.run(*(products[product] for product in stage.inputs))
+        if set(results) != set(stage.outputs):
+            raise ValueError(
+                f"Stage {stage.name!r} returned {sorted(results)}, "
+                f"expected {sorted(stage.outputs)}."
+            )
+        products.update(results)
+        for product in stage.outputs:
+            if product in persist and isinstance(products[product], RasterData):
+                write_raster(products[product], persist[product])
+                print(f"Saved {product} to: {persist[product]}")
+        for product in stage.inputs:
+            if last_use[product] == index and isinstance(products.get(product), RasterData):
+                if product in persist:
+                    products[product] = persist[product]
+                else:
+                    del products[product]
+        print(f"{stage.name} finished in {time.perf_counter() - start:.1f} s")
+    return products
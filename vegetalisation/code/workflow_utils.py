@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import hashlib
 import json
 import platform
 import sys
@@ -11,6 +12,11 @@ from typing import Any
 
 import numpy as np
 
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
 
 @dataclass(frozen=True)
 class BoundingBox:
@@ -119,6 +125,34 @@ def max_shape(arrays: list[np.ndarray]) -> tuple[int, int]:
     )
 
 
+def import_torch() -> Any:
+    # Imported on demand rather than at module level: the workers spawned by the workflow
+    # re-import its modules, and torch takes seconds and hundreds of MB to load.
+    try:
+        import torch
+    except ImportError:  # pragma: no cover - optional dependency outside runtime images
+        return None
+    return torch
+
+
+def peak_rss_mib() -> float | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kibibytes, macOS reports bytes.
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def file_sha256(path: Path, chunk_size: int = 8 * 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def write_json(data: dict[str, Any], path: Path) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
     with path.open("w", encoding="utf-8") as handle: